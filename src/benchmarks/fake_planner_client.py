@@ -0,0 +1,149 @@
+import os
+import random
+import sys
+import threading
+import time
+
+from compas_fab.backends import BackendError
+from compas_fab.robots import Duration
+from compas_fab.robots import JointConstraint
+from compas_fab.robots import JointTrajectory
+from compas_fab.robots import JointTrajectoryPoint
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "planning"))
+from trajectory_cache import digest
+
+
+class FakePlannerClient(object):
+    """Stand-in for a connected `RosClient`, planning without ROS or MoveIt.
+
+    Motions interpolate from the start configuration to the joint values of a joint space goal, or
+    to a target drawn from a generator seeded with the request, so the same request always returns the same trajectory, whatever order
+    parallel planners send requests in. Collision objects are only counted.
+
+    With a `workspace`, requests for goals outside it fail after the latency, as they would in
+    MoveIt after its full search.
+
+    Parameters
+    ----------
+    latency : float, optional
+        Seconds every planning request takes.
+    jitter : float, optional
+        Up to this many seconds are added to `latency`, drawn per request.
+    points : int, optional
+        Number of points of every trajectory.
+    workspace : tuple, optional
+        Box `((xmin, ymin, zmin), (xmax, ymax, zmax))` of the reachable goal positions.
+
+    """
+
+    def __init__(self, latency = 0.0, jitter = 0.0, points = 50, workspace = None):
+        self.is_connected = True
+        self.latency = latency
+        self.jitter = jitter
+        self.points = points
+        self.workspace = workspace
+        self.requests = 0
+        self.failures = 0
+        self.ik_requests = 0
+        self.scene_updates = 0
+        self.collision_meshes = set()
+        self._lock = threading.Lock()
+
+
+    def plan_motion(self, robot, goal_constraints, start_configuration = None, group = None, options = None):
+        return self._plan(robot, goal_constraints, start_configuration, group)
+
+
+    def plan_cartesian_motion(self, robot, frames_WCF = None, start_configuration = None, group = None, options = None, **kwargs):
+        return self._plan(robot, frames_WCF or kwargs.get("waypoints"), start_configuration, group)
+
+
+    def forward_kinematics(self, robot, configuration, group = None, options = None):
+        """Solves with the robot model, like MoveIt would with the same URDF."""
+        link = (options or {}).get("link") or robot.get_end_effector_link_name(group)
+        return robot.model.forward_kinematics(configuration, link)
+
+
+    def inverse_kinematics(self, robot, frame_WCF, start_configuration = None, group = None, options = None):
+        """Yields the start configuration of `group` slightly moved, for frames inside the workspace."""
+        generator = random.Random(digest([frame_WCF, start_configuration]))
+        with self._lock:
+            self.ik_requests += 1
+        if not self.in_workspace(frame_WCF.point):
+            raise BackendError("no inverse kinematics solution for {}".format(frame_WCF.point))
+        joint_names = robot.get_configurable_joint_names(group)
+        start = dict(zip(start_configuration.joint_names, start_configuration.joint_values)) if start_configuration else {}
+        yield [start.get(name, 0.0) + generator.uniform(-0.1, 0.1) for name in joint_names], joint_names
+
+
+    def in_workspace(self, point):
+        if self.workspace is None or point is None:
+            return True
+        return all(self.workspace[0][i] <= point[i] <= self.workspace[1][i] for i in range(3))
+
+
+    def _plan(self, robot, goal, start_configuration, group):
+        generator = random.Random(digest([goal, start_configuration]))
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency + self.jitter * generator.random())
+        if not self.in_workspace(goal_point(goal)):
+            with self._lock:
+                self.failures += 1
+            raise BackendError("planning failed, goal outside the workspace")
+
+        joint_names = robot.get_configurable_joint_names(group)
+        joint_types = robot.get_joint_types_by_names(joint_names)
+        start = dict(zip(start_configuration.joint_names, start_configuration.joint_values)) if start_configuration else {}
+        a = [start.get(name, 0.0) for name in joint_names]
+        b = [value + generator.uniform(-0.5, 0.5) for value in a]
+        """joint space goals are reached exactly"""
+        targets = {constraint.joint_name: constraint.value for constraint in (goal or []) if isinstance(constraint, JointConstraint)}
+        b = [targets.get(name, value) for name, value in zip(joint_names, b)]
+        trajectory_points = []
+        for index in range(self.points):
+            t = index / float(max(self.points - 1, 1))
+            values = [x + t * (y - x) for x, y in zip(a, b)]
+            trajectory_points.append(JointTrajectoryPoint(values, joint_types, time_from_start=Duration(index * 0.1, 0), joint_names=joint_names))
+        return JointTrajectory(trajectory_points, joint_names, start_configuration, fraction=1.0)
+
+
+    def add_collision_mesh(self, collision_mesh, options = None):
+        with self._lock:
+            self.scene_updates += 1
+            self.collision_meshes.add(collision_mesh.id)
+
+
+    def append_collision_mesh(self, collision_mesh, options = None):
+        self.add_collision_mesh(collision_mesh, options)
+
+
+    def remove_collision_mesh(self, id, options = None):
+        with self._lock:
+            self.scene_updates += 1
+            self.collision_meshes.discard(id)
+
+
+    def add_attached_collision_mesh(self, attached_collision_mesh, options = None):
+        with self._lock:
+            self.scene_updates += 1
+
+
+    def remove_attached_collision_mesh(self, id, options = None):
+        with self._lock:
+            self.scene_updates += 1
+
+
+def goal_point(goal):
+    """Returns the position a list of frames or of goal constraints leads to, or None for a joint space goal."""
+    if not goal:
+        return None
+    last = goal[-1]
+    if hasattr(last, "point"):
+        return last.point
+    for constraint in goal:
+        volume = getattr(getattr(constraint, "bounding_volume", None), "volume", None)
+        if volume is not None:
+            return volume.point if hasattr(volume, "point") else volume.frame.point
+    return None
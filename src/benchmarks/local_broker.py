@@ -0,0 +1,95 @@
+import itertools
+import json
+import queue
+import threading
+import time
+import traceback
+
+from compas_eve import Transport
+
+
+class LocalBroker(Transport):
+    """In-process stand-in for the MQTT broker and the client connections to it.
+
+    Every publisher and subscriber sharing one `LocalBroker` talks to the others as they would
+    through a broker: messages are serialized to JSON on publish and delivered, in publish order,
+    on a single dispatch thread, like the network loop of a paho client.
+
+    Parameters
+    ----------
+    latency : float, optional
+        Seconds between publishing a message and delivering it.
+
+    """
+
+    def __init__(self, latency = 0.0):
+        super(LocalBroker, self).__init__()
+        self.latency = latency
+        self.published = 0
+        self.delivered = 0
+        self.bytes = 0
+        self._ids = itertools.count(1)
+        self._subscriptions = {}    # topic name -> {subscribe id: callback}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._thread.start()
+
+
+    def publish(self, topic, message):
+        payload = json.dumps(message.data)
+        with self._lock:
+            callbacks = list(self._subscriptions.get(topic.name, {}).values())
+            self.published += 1
+            self.bytes += len(payload)
+        self._queue.put((time.monotonic() + self.latency, topic, payload, callbacks))
+
+
+    def subscribe(self, topic, callback):
+        subscribe_id = "{}:{}".format(topic.name, next(self._ids))
+        with self._lock:
+            self._subscriptions.setdefault(topic.name, {})[subscribe_id] = callback
+        return subscribe_id
+
+
+    def unsubscribe_by_id(self, subscribe_id):
+        with self._lock:
+            for callbacks in self._subscriptions.values():
+                callbacks.pop(subscribe_id, None)
+
+
+    def unsubscribe(self, topic):
+        with self._lock:
+            self._subscriptions.pop(topic.name, None)
+
+
+    def advertise(self, topic):
+        return "{}:{}".format(topic.name, next(self._ids))
+
+
+    def unadvertise(self, topic):
+        pass
+
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+    def _dispatch(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            deliver_at, topic, payload, callbacks = item
+            delay = deliver_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            for callback in callbacks:
+                try:
+                    callback(topic.message_type(json.loads(payload)))
+                except Exception:
+                    """like a paho client, a failing callback does not stop delivery to the others"""
+                    traceback.print_exc()
+                with self._lock:
+                    self.delivered += 1
@@ -0,0 +1,428 @@
+"""Offline throughput benchmarks of the planning and execution pipelines.
+
+Planning runs `TimberAssemblyPlanner.plan_robot_assembly` against :class:`FakePlannerClient`
+instead of MoveIt, and execution runs the confirm/execute loop of `TimberAssemblyExecutioner`
+against mock AR users over :class:`LocalBroker` instead of the public broker, so neither needs
+the ROS stack or a network.
+
+With `--lookahead`, the pipelined executioner, which overlaps planning, confirmation and motion,
+is benchmarked as well and its report gives the utilization of each stage.
+
+With `--reachability`, every ROBOT step is planned with and without a reachability map and IK
+cache, against a fake client failing goals outside the map's workspace, and the report compares
+planning time, planner requests and failures.
+
+With `--blend`, the motions of every phase of the planned steps are blended into one, and the
+report gives the cycle time of every step before and after.
+
+Plans are the example building plan and copies of it laid out side by side, with every step
+given to the robot. Each benchmark runs once for timing and, unless `--no-memory` is given, once
+more under `tracemalloc` for the peak memory, since tracing slows Python down.
+
+The harness runs on the stack pinned in requirements.txt (compas 2, compas_robots, compas_fab 1.x,
+compas_eve 0.5, compas_timber 0.6.1, which decodes the example plan). The robot is the RFL: the
+`urdf/robot_description.urdf` and `robot_description_semantic.srdf` of the `rfl` folder in the
+compas_fab robot library, or `--ros-host` to load it from the ROS stack of docker-compose.yml.
+
+    pip install -r requirements.txt
+    export T2_RFL_URDF=<rfl>/urdf/robot_description.urdf T2_RFL_SRDF=<rfl>/robot_description_semantic.srdf
+    python src/benchmarks/run_benchmarks.py --scales 1 10 --output report.json
+    python src/benchmarks/run_benchmarks.py --scales 1 --no-memory --workers 2 --lookahead 1 --reachability --reachability-samples 2000 --blend
+"""
+import argparse
+import contextlib
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+from compas.geometry import Frame
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, "..", "planning"))
+sys.path.append(os.path.join(HERE, "..", "interface"))
+import instrumentation
+from executor_communicator import ExecutorCommunicator
+from lazy_building_plan import load_lazy
+from mock_ar import MockAR
+from reachability import IKCache
+from reachability import ReachabilityMap
+from reachability import UnreachableFrameError
+from timber_assembly_executioner import TimberAssemblyExecutioner
+from timber_assembly_planner import TimberAssemblyPlanner
+from trajectory_blending import TrajectoryBlender
+
+from fake_planner_client import FakePlannerClient
+from local_broker import LocalBroker
+
+EXAMPLE = os.path.join(HERE, "..", "..", "examples", "building_plan.json")
+PICKUP_BASE_FRAME = Frame([2.0, -3.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0])
+TOPIC_DIRECTORY = "T2_benchmark"
+
+
+def synthetic_plan(source, scale, directory, spacing = 6.0):
+    """Writes `scale` copies of the building plan at `source`, `spacing` apart along y, and returns the path.
+
+    Every step of the copy is a ROBOT step, since the robot is what is benchmarked.
+    """
+    with open(source) as f:
+        plan = json.load(f)
+    beams, joints, steps = plan["beams"], plan["joints"], plan["building_plan"]["data"]["steps"]
+    graph = plan["assembly"]["graph"]
+    count = len(beams) + len(joints)
+    scaled_beams, scaled_joints, scaled_nodes, scaled_edges, scaled_steps = {}, {}, {}, {}, []
+
+    def moved(frame, offset):
+        frame = dict(frame, point=list(frame["point"]))
+        frame["point"][1] += offset
+        return frame
+
+    for copy in range(scale):
+        offset, shift = copy * count, copy * spacing
+        for key, beam in beams.items():
+            beam = json.loads(json.dumps(beam))
+            beam["data"]["key"] = int(key) + offset
+            beam["data"]["frame"] = moved(beam["data"]["frame"], shift)
+            scaled_beams[str(int(key) + offset)] = beam
+        for key, joint in joints.items():
+            scaled_joints[str(int(key) + offset)] = joint
+        for key, node in graph["node"].items():
+            scaled_nodes[str(int(key) + offset)] = node
+        for key, neighbors in graph["edge"].items():
+            scaled_edges[str(int(key) + offset)] = {str(int(n) + offset): value for n, value in neighbors.items()}
+        for step in steps:
+            step = json.loads(json.dumps(step))
+            step["data"]["actor"] = "ROBOT"
+            step["data"]["element_ids"] = [e + offset for e in step["data"]["element_ids"]]
+            if step["data"].get("location"):
+                step["data"]["location"] = moved(step["data"]["location"], shift)
+            scaled_steps.append(step)
+    plan["beams"], plan["joints"], plan["building_plan"]["data"]["steps"] = scaled_beams, scaled_joints, scaled_steps
+    graph["node"], graph["edge"] = scaled_nodes, scaled_edges
+
+    path = os.path.join(directory, "building_plan_x{}.json".format(scale))
+    with open(path, "w") as f:
+        json.dump(plan, f)
+    return path
+
+
+def load_robot(urdf = None, srdf = None, ros_host = None):
+    """Loads the RFL robot model only; planning goes to the fake client, not to ROS.
+
+    The model comes from `urdf` and `srdf`, by default `$T2_RFL_URDF` and `$T2_RFL_SRDF`, or else
+    from the `rfl_moveit_config` of the ROS stack in docker-compose.yml, through rosbridge at `ros_host`.
+    """
+    urdf = urdf or os.environ.get("T2_RFL_URDF")
+    srdf = srdf or os.environ.get("T2_RFL_SRDF")
+    if urdf:
+        try:
+            from compas_robots import RobotModel
+        except ImportError:
+            from compas.robots import RobotModel
+        from compas_fab.robots import Robot
+        from compas_fab.robots import RobotSemantics
+        model = RobotModel.from_urdf_file(urdf)
+        return Robot(model, semantics=RobotSemantics.from_srdf_file(srdf, model) if srdf else None)
+    if ros_host:
+        from compas_fab.backends import RosClient
+        with RosClient(ros_host) as client:
+            robot = client.load_robot(load_geometry=False)
+        robot.client = None
+        return robot
+    raise SystemExit("no robot model: give --urdf and --srdf, set $T2_RFL_URDF and $T2_RFL_SRDF, or give --ros-host")
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of `samples`."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(0, int(math.ceil(q / 100.0 * len(ordered))) - 1)]
+
+
+@contextlib.contextmanager
+def timed_method(cls, name, samples):
+    """Appends the duration of every call of `cls.name` to `samples`, from any thread."""
+    method = getattr(cls, name)
+    lock = threading.Lock()
+
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            with lock:
+                samples.append(time.perf_counter() - start)
+
+    setattr(cls, name, wrapper)
+    try:
+        yield
+    finally:
+        setattr(cls, name, method)
+
+
+def measure(run, memory = True):
+    """Calls `run()` for timing, then again under tracemalloc, and returns the result of the timed call with the peak in MB.
+
+    The span histograms of the timed call are added to the result.
+    """
+    instrumentation.tracer.reset()
+    result = run()
+    result["spans"] = instrumentation.summary()
+    if memory:
+        tracemalloc.start()
+        try:
+            run()
+            result["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def summary(name, plan_name, samples, seconds, **extra):
+    result = {
+        "benchmark": name,
+        "plan": plan_name,
+        "steps": len(samples),
+        "seconds": seconds,
+        "steps_per_second": len(samples) / seconds if seconds > 0 else None,
+        "latency_ms": {
+            "p50": 1000 * percentile(samples, 50) if samples else None,
+            "p99": 1000 * percentile(samples, 99) if samples else None,
+            "max": 1000 * max(samples) if samples else None,
+            },
+        }
+    result.update(extra)
+    return result
+
+
+def benchmark_planning(robot, plan, plan_name, args):
+    """Plans every ROBOT step of `plan` and returns the summary and the planner of the timed run."""
+    planners = []
+
+    def run():
+        clients = [FakePlannerClient(args.latency, args.jitter, args.points) for _ in range(args.workers)]
+        robot.client = clients[0]
+        planner = TimberAssemblyPlanner(robot, plan["assembly"], plan["building_plan"], PICKUP_BASE_FRAME, group=args.group)
+        planners.append(planner)
+        samples = []
+        with timed_method(TimberAssemblyPlanner, "plan_robot_step", samples):
+            start = time.perf_counter()
+            if args.workers > 1:
+                planner.plan_robot_assembly_parallel(clients)
+            else:
+                planner.plan_robot_assembly()
+            seconds = time.perf_counter() - start
+        return summary("planning", plan_name, samples, seconds,
+                       workers=args.workers,
+                       planner_requests=sum(client.requests for client in clients),
+                       scene_updates=sum(client.scene_updates for client in clients))
+
+    result = measure(run, not args.no_memory)
+    return result, planners[0]
+
+
+@contextlib.contextmanager
+def ar_session(args):
+    """Yields an `ExecutorCommunicator` and its broker once `args.users` mock AR users have checked in."""
+    broker = LocalBroker(args.broker_latency)
+    comms = ExecutorCommunicator(None, TOPIC_DIRECTORY, user_ttl=args.user_ttl, transport=broker)
+    users = [MockAR(broker, TOPIC_DIRECTORY, response_delay=args.response_delay, check_in_interval=args.user_ttl / 4.0) for _ in range(args.users)]
+    deadline = time.monotonic() + 10 * args.user_ttl
+    while len(comms.AR_users) < args.users and time.monotonic() < deadline:
+        time.sleep(0.01)
+    try:
+        yield comms, broker
+    finally:
+        for user in users:
+            user.stop()
+        comms.presence.stop()
+        broker.stop()
+
+
+def benchmark_execution(planner, plan, plan_name, args):
+    """Runs the confirm/execute loop over every planned step with `args.users` mock AR users."""
+
+    def run():
+        samples = []
+        with ar_session(args) as (comms, broker):
+            executioner = TimberAssemblyExecutioner(assembly=plan["assembly"], building_plan=plan["building_plan"], confirmation_timeout=args.confirmation_timeout, comms=comms, planner=planner)
+            executioner.settle_time = args.settle_time
+            with timed_method(TimberAssemblyExecutioner, "execute_step", samples):
+                start = time.perf_counter()
+                for index in sorted(planner.robot_steps):
+                    executioner.execute_step(index)
+                seconds = time.perf_counter() - start
+        return summary("execution", plan_name, samples, seconds,
+                       users=args.users,
+                       messages_published=broker.published,
+                       messages_delivered=broker.delivered,
+                       bytes_published=broker.bytes)
+
+    return measure(run, not args.no_memory)
+
+
+def benchmark_pipeline(robot, plan, plan_name, args):
+    """Plans, confirms and executes every ROBOT step with `TimberAssemblyExecutioner.execute_pipelined`."""
+
+    def run():
+        samples = []
+        robot.client = FakePlannerClient(args.latency, args.jitter, args.points)
+        planner = TimberAssemblyPlanner(robot, plan["assembly"], plan["building_plan"], PICKUP_BASE_FRAME, group=args.group)
+        with ar_session(args) as (comms, broker):
+            executioner = TimberAssemblyExecutioner(assembly=plan["assembly"], building_plan=plan["building_plan"], confirmation_timeout=args.confirmation_timeout, comms=comms, planner=planner)
+            executioner.settle_time = args.settle_time
+            with timed_method(TimberAssemblyExecutioner, "execute_confirmed_step", samples):
+                report = executioner.execute_pipelined(lookahead=args.lookahead)
+        return summary("pipeline", plan_name, samples, report["wall_time"],
+                       users=args.users,
+                       lookahead=args.lookahead,
+                       failures=report["failures"],
+                       stages=report["stages"],
+                       bottleneck=report["bottleneck"])
+
+    return measure(run, not args.no_memory)
+
+
+def benchmark_reachability(robot, plan, plan_name, args):
+    """Plans every ROBOT step on its own, without and with the reachability map and IK cache, and counts failed steps."""
+    planner = TimberAssemblyPlanner(robot, plan["assembly"], plan["building_plan"], PICKUP_BASE_FRAME, group=args.group)
+    start = time.perf_counter()
+    reachability = ReachabilityMap.build(robot, planner.kinematics, planner.group, args.reachability_samples, planner.global_constraints, args.reachability_resolution)
+    build_seconds = time.perf_counter() - start
+    cells = np.array(list(reachability.voxels), dtype=float) * reachability.resolution
+    workspace = (tuple(cells.min(axis=0)), tuple(cells.max(axis=0) + reachability.resolution))
+    indices = [index for index in range(len(plan["building_plan"].steps)) if plan["building_plan"].steps[index]["actor"] == "ROBOT"]
+    results = []
+    for mode in ("baseline", "reachability"):
+        client = FakePlannerClient(args.latency, args.jitter, args.points, workspace)
+        robot.client = client
+        if mode == "baseline":
+            planner = TimberAssemblyPlanner(robot, plan["assembly"], plan["building_plan"], PICKUP_BASE_FRAME, group=args.group)
+        else:
+            planner = TimberAssemblyPlanner(robot, plan["assembly"], plan["building_plan"], PICKUP_BASE_FRAME, group=args.group, reachability=reachability, ik_cache=IKCache())
+        samples, failed, rejected = [], [], []
+        start = time.perf_counter()
+        for index in indices:
+            step_start = time.perf_counter()
+            try:
+                planner.plan_segment([index])
+            except UnreachableFrameError:
+                rejected.append(index)
+            except Exception:
+                failed.append(index)
+            samples.append(time.perf_counter() - step_start)
+        seconds = time.perf_counter() - start
+        results.append(summary("reachability/" + mode, plan_name, samples, seconds,
+                               failed_steps=len(failed) + len(rejected),
+                               failure_rate=(len(failed) + len(rejected)) / float(len(indices)) if indices else 0.0,
+                               rejected_up_front=len(rejected),
+                               planner_requests=client.requests,
+                               planner_failures=client.failures,
+                               ik_requests=client.ik_requests,
+                               reachability_stats=planner.reachability_stats,
+                               ik_cache=planner.ik_cache.stats() if planner.ik_cache else None,
+                               map_build_seconds=build_seconds if mode == "reachability" else None,
+                               map_voxels=len(reachability.voxels) if mode == "reachability" else None))
+    return results
+
+
+def benchmark_blending(planner, plan, plan_name, args):
+    """Blends the phases of every planned step and compares the cycle times with the planned ones."""
+    blender = TrajectoryBlender(planner.kinematics, planner.group, args.blend_tolerance, args.blend_tool_deviation)
+    samples = []
+    start = time.perf_counter()
+    for index in sorted(planner.robot_steps):
+        beam = plan["assembly"].beams[plan["building_plan"].steps[index]["element_ids"][0]]
+        step_start = time.perf_counter()
+        blender.blend_step(index, planner.robot_steps[index], beam.length)
+        samples.append(time.perf_counter() - step_start)
+    seconds = time.perf_counter() - start
+    report = blender.report()
+    return summary("blending", plan_name, samples, seconds,
+                   tolerance=args.blend_tolerance,
+                   max_tool_deviation=args.blend_tool_deviation,
+                   original_cycle_time=report["original_duration"],
+                   blended_cycle_time=report["blended_duration"],
+                   cycle_time_reduction=report["reduction"],
+                   step_reductions={index: step["reduction"] for index, step in report["steps"].items()})
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--plan", default=EXAMPLE, help="building plan to scale up")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10], help="number of copies of the plan per run")
+    parser.add_argument("--urdf", help="RFL robot description, defaults to $T2_RFL_URDF")
+    parser.add_argument("--srdf", help="RFL semantics, defaults to $T2_RFL_SRDF")
+    parser.add_argument("--ros-host", help="load the robot model from rosbridge on this host instead")
+    parser.add_argument("--group", default="robot11")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per planning request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra seconds per planning request, at most")
+    parser.add_argument("--points", type=int, default=50, help="points per planned trajectory")
+    parser.add_argument("--workers", type=int, default=1, help="parallel planner clients")
+    parser.add_argument("--users", type=int, default=2, help="mock AR users")
+    parser.add_argument("--user-ttl", type=float, default=2.0)
+    parser.add_argument("--response-delay", type=float, default=0.0, help="seconds a mock AR user takes to confirm")
+    parser.add_argument("--broker-latency", type=float, default=0.0)
+    parser.add_argument("--settle-time", type=float, default=0.0, help="seconds the executioner waits after each motion")
+    parser.add_argument("--confirmation-timeout", type=float, default=30.0)
+    parser.add_argument("--skip-execution", action="store_true")
+    parser.add_argument("--lookahead", type=int, default=0, help="also benchmark the pipelined executioner with this lookahead")
+    parser.add_argument("--reachability", action="store_true", help="also benchmark the reachability precheck and IK cache")
+    parser.add_argument("--reachability-samples", type=int, default=20000, help="configurations sampled for the reachability map")
+    parser.add_argument("--reachability-resolution", type=float, default=0.25, help="voxel size of the reachability map")
+    parser.add_argument("--blend", action="store_true", help="also benchmark blending the motions of each phase")
+    parser.add_argument("--blend-tolerance", type=float, default=0.01, help="largest joint deviation of a blend")
+    parser.add_argument("--blend-tool-deviation", type=float, default=0.005, help="largest tool deviation of a blend")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--verbose", action="store_true", help="show the log of the planner and executioner")
+    parser.add_argument("--output", help="write the JSON report here instead of to stdout")
+    args = parser.parse_args(argv)
+
+    instrumentation.configure_logging(logging.DEBUG if args.verbose else logging.WARNING)
+    robot = load_robot(args.urdf, args.srdf, args.ros_host)
+    directory = tempfile.mkdtemp()
+    results = []
+    for scale in args.scales:
+        plan = load_lazy(synthetic_plan(args.plan, scale, directory))
+        plan_name = "{} x{}".format(os.path.basename(args.plan), scale)
+        result, planner = benchmark_planning(robot, plan, plan_name, args)
+        scale_results = [result]
+        if not args.skip_execution:
+            scale_results.append(benchmark_execution(planner, plan, plan_name, args))
+        if args.lookahead > 0:
+            scale_results.append(benchmark_pipeline(robot, plan, plan_name, args))
+        if args.reachability:
+            scale_results.extend(benchmark_reachability(robot, plan, plan_name, args))
+        if args.blend:
+            scale_results.append(benchmark_blending(planner, plan, plan_name, args))
+        plan["document"].close()
+        results.extend(scale_results)
+        for result in scale_results:
+            sys.stderr.write("{} {} : {} steps in {:.3f} s\n".format(result["benchmark"], result["plan"], result["steps"], result["seconds"]))
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "results": results,
+        }
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""Simulates many AR headsets from one asyncio process, to load test the executor side.
+
+All simulated users share one transport connection. Every user checks in on its own schedule,
+confirms the configurations of a step after a delay drawn from a distribution, and can drop out
+and reconnect. Each message is decoded once for all users, since every user receives the same
+messages.
+
+Latencies are measured where the generator can observe them:
+
+- `confirmation_ms`: from a user receiving the whole configurations of a step until its
+  confirmation comes back through the broker.
+- `step_ms`: from the configurations of a step arriving until the confirmation of the last user
+  online comes back.
+- `executor_ms`, with `--local` only: from `ExecutorCommunicator.publish_configurations` until
+  `wait_for_confirmation` returns. In this mode the generator runs the executor side in process
+  over :class:`LocalBroker` and drives the steps itself.
+
+    python src/interface/ar_load_generator.py --users 500 --local --steps 20
+    python src/interface/ar_load_generator.py --users 200 --broker localhost:1883 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+
+from compas_eve import Message
+from compas_eve import Publisher
+from compas_eve import Subscriber
+
+from mock_ar import MockAR
+from message_bus import MessageBus
+from message_bus import topic
+import configuration_codec
+import instrumentation
+
+
+def parse_distribution(spec):
+    """Parses `fixed:a`, `uniform:a,b`, `exp:mean` or `lognormal:mu,sigma` into a sampler taking a `random.Random`."""
+    name, _, values = spec.partition(":")
+    values = [float(v) for v in values.split(",") if v]
+    if name == "fixed":
+        return lambda generator: values[0]
+    if name == "uniform":
+        return lambda generator: generator.uniform(values[0], values[1])
+    if name == "exp":
+        return lambda generator: generator.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    if name == "lognormal":
+        return lambda generator: generator.lognormvariate(values[0], values[1])
+    raise ValueError("unknown distribution {}".format(spec))
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0, "p50": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+    rank = lambda q: ordered[max(0, int(math.ceil(q / 100.0 * len(ordered))) - 1)]
+    return {"count": len(ordered), "p50": 1000 * rank(50), "p99": 1000 * rank(99), "max": 1000 * ordered[-1]}
+
+
+class SimulatedUser(object):
+
+    def __init__(self, id):
+        self.id = id
+        self.online = True
+        self.epoch = 0          # incremented on every dropout, so confirmations scheduled before it are dropped
+
+
+class StepDecoder(object):
+    """Reassembles the configuration messages of each step once, for all simulated users."""
+
+    receive_configurations = MockAR.receive_configurations
+    receive_stream = MockAR.receive_stream
+
+    def __init__(self):
+        self.previews = {}
+        self._chunks = {}
+        self._keyframes = {}
+
+
+class ARLoadGenerator(object):
+    """Simulated AR users on one transport.
+
+    Parameters
+    ----------
+    transport : :class:`compas_eve.Transport`
+    server_topic : str
+        Top level directory of the executor's topics.
+    users : int
+    check_in_interval : float, optional
+        Seconds between check-ins of a user; each interval is jittered by up to `check_in_jitter`.
+    confirmation_delay : str, optional
+        Distribution of the time a user takes to confirm, see :func:`parse_distribution`.
+    dropout_rate : float, optional
+        Dropouts per user per second.
+    offline_time : str, optional
+        Distribution of the time a user stays offline after dropping out.
+    formats : list of str, optional
+        Configuration formats the users announce.
+    seed : int, optional
+
+    """
+
+    def __init__(self, transport, server_topic, users, check_in_interval = 1.0, check_in_jitter = 0.1, confirmation_delay = "fixed:0.5", dropout_rate = 0.0, offline_time = "fixed:5", formats = None, seed = 0):
+        self.tx = transport
+        self.server_topic = server_topic
+        self.users = [SimulatedUser("sim-{}".format(index)) for index in range(users)]
+        self.check_in_interval = check_in_interval
+        self.check_in_jitter = check_in_jitter
+        self.confirmation_delay = parse_distribution(confirmation_delay)
+        self.dropout_rate = dropout_rate
+        self.offline_time = parse_distribution(offline_time)
+        self.formats = formats or ["json", configuration_codec.FORMAT]
+        self.random = random.Random(seed)
+        self.decoder = StepDecoder()
+        self.loop = None
+
+        self.counts = {"check_ins": 0, "dropouts": 0, "reconnects": 0, "confirmations_sent": 0, "confirmations_seen": 0, "steps": 0}
+        self.confirmation_latencies = []
+        self.step_latencies = []
+        self._received = {}         # step -> time the configurations were complete
+        self._pending = {}          # (user id, step) -> time the configurations were complete
+        self._waiting = {}          # step -> ids of online users whose confirmation has not come back
+
+        self.checkin_publisher = Publisher(topic(server_topic, "user_checkin_topic"), transport=self.tx)
+        self.confirmation_publisher = Publisher(topic(server_topic, "confirmation_topic"), transport=self.tx)
+        self.interface_subscriber = Subscriber(topic(server_topic, "interface_topic"), callback=lambda msg: self._from_transport(self.on_interface_message, msg), transport=self.tx)
+        self.confirmation_subscriber = Subscriber(topic(server_topic, "confirmation_topic"), callback=lambda msg: self._from_transport(self.on_confirmation, msg), transport=self.tx)
+
+
+    def _from_transport(self, handler, message):
+        """Transport callbacks run on the transport's thread; handling them is moved onto the event loop."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(handler, message)
+
+
+    def start(self, loop):
+        self.loop = loop
+        self.interface_subscriber.subscribe()
+        self.confirmation_subscriber.subscribe()
+        for user in self.users:
+            """stagger the first check-ins over one interval, like headsets started one by one"""
+            loop.call_later(self.random.uniform(0, self.check_in_interval), self.check_in, user, user.epoch)
+
+
+    def check_in(self, user, epoch):
+        if not user.online or user.epoch != epoch:
+            return
+        interval = self.check_in_interval * (1.0 + self.random.uniform(-self.check_in_jitter, self.check_in_jitter))
+        if self.dropout_rate > 0 and self.random.random() < 1.0 - math.exp(-self.dropout_rate * interval):
+            self.drop(user)
+            return
+        self.checkin_publisher.publish(Message(text=user.id, formats=self.formats))
+        self.counts["check_ins"] += 1
+        self.loop.call_later(interval, self.check_in, user, epoch)
+
+
+    def drop(self, user):
+        user.online = False
+        user.epoch += 1
+        self.counts["dropouts"] += 1
+        for step, waiting in list(self._waiting.items()):
+            waiting.discard(user.id)
+            if not waiting:
+                del self._waiting[step]
+        self.loop.call_later(self.offline_time(self.random), self.reconnect, user)
+
+
+    def reconnect(self, user):
+        user.online = True
+        self.counts["reconnects"] += 1
+        self.check_in(user, user.epoch)
+
+
+    def on_interface_message(self, message):
+        if not str(message.data.get("type", "")).startswith("configurations"):
+            return
+        configurations = self.decoder.receive_configurations(message)
+        if configurations is None:
+            return
+        step = message["step"]
+        now = time.perf_counter()
+        self._received[step] = now
+        self._waiting[step] = set()
+        self.counts["steps"] += 1
+        for user in self.users:
+            if user.online:
+                self._pending[(user.id, step)] = now
+                self._waiting[step].add(user.id)
+                self.loop.call_later(self.confirmation_delay(self.random), self.confirm, user, user.epoch, step)
+
+
+    def confirm(self, user, epoch, step):
+        if not user.online or user.epoch != epoch:
+            self._pending.pop((user.id, step), None)
+            return
+        self.confirmation_publisher.publish(Message(type="confirmation", user_id=user.id, step=step, confirmation=True))
+        self.counts["confirmations_sent"] += 1
+
+
+    def on_confirmation(self, message):
+        received = self._pending.pop((message["user_id"], message["step"]), None)
+        if received is None:
+            return
+        now = time.perf_counter()
+        self.counts["confirmations_seen"] += 1
+        self.confirmation_latencies.append(now - received)
+        waiting = self._waiting.get(message["step"])
+        if waiting is not None:
+            waiting.discard(message["user_id"])
+            if not waiting:
+                self.step_latencies.append(now - self._received[message["step"]])
+                del self._waiting[message["step"]]
+
+
+    def report(self):
+        return {
+            "users": len(self.users),
+            "online": sum(1 for user in self.users if user.online),
+            "counts": dict(self.counts),
+            "confirmation_ms": percentiles(self.confirmation_latencies),
+            "step_ms": percentiles(self.step_latencies),
+            }
+
+
+async def drive_executor(comms, users, steps, points, timeout, join_timeout):
+    """Waits for the users to join the in-process executor, then publishes `steps` steps and times their confirmation."""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    while len(comms.AR_users) < users and time.perf_counter() - start < join_timeout:
+        await asyncio.sleep(0.05)
+    joined = {"users": len(comms.AR_users), "seconds": time.perf_counter() - start}
+
+    configurations = [[math.sin(t / (50.0 + 10 * j)) for j in range(11)] for t in range(points)]
+    latencies, unconfirmed = [], 0
+
+    def step(index):
+        begin = time.perf_counter()
+        comms.publish_configurations(index, configurations)
+        confirmed = comms.wait_for_confirmation(index, timeout=timeout)
+        return confirmed, time.perf_counter() - begin
+
+    for index in range(steps):
+        confirmed, seconds = await loop.run_in_executor(None, step, index)
+        if confirmed:
+            latencies.append(seconds)
+        else:
+            unconfirmed += 1
+    return {"joined": joined, "unconfirmed_steps": unconfirmed, "executor_ms": percentiles(latencies)}
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    comms = None
+    if args.local:
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+        from executor_communicator import ExecutorCommunicator
+        from local_broker import LocalBroker
+        transport = LocalBroker(args.broker_latency)
+        comms = ExecutorCommunicator(None, args.topic, quorum=args.quorum, user_ttl=args.user_ttl, transport=transport)
+    else:
+        transport = MessageBus.shared(args.broker)
+
+    generator = ARLoadGenerator(transport, args.topic, args.users, args.check_in_interval, args.check_in_jitter,
+                                args.confirmation_delay, args.dropout_rate, args.offline_time, seed=args.seed)
+    generator.start(loop)
+    report = {"config": vars(args)}
+    try:
+        if comms is not None:
+            report["executor"] = await drive_executor(comms, args.users, args.steps, args.points, args.confirmation_timeout, 10 * args.user_ttl)
+        else:
+            await asyncio.sleep(args.duration)
+    finally:
+        if comms is not None:
+            comms.presence.stop()
+        else:
+            report["bus"] = transport.metrics()
+        transport.stop()
+    report["generator"] = generator.report()
+    report["spans"] = instrumentation.summary()
+    return report
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--broker", help="host or host:port of the MQTT broker, defaults to $T2_MQTT_BROKER, then to broker.hivemq.com")
+    parser.add_argument("--topic", default="T2_command_test")
+    parser.add_argument("--check-in-interval", type=float, default=1.0)
+    parser.add_argument("--check-in-jitter", type=float, default=0.1, help="fraction of the interval")
+    parser.add_argument("--confirmation-delay", default="fixed:0.5", help="fixed:a, uniform:a,b, exp:mean or lognormal:mu,sigma")
+    parser.add_argument("--dropout-rate", type=float, default=0.0, help="dropouts per user per second")
+    parser.add_argument("--offline-time", default="fixed:5", help="distribution of the time a dropped user stays offline")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run against a remote executor")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--local", action="store_true", help="run the executor side in process over a local broker")
+    parser.add_argument("--steps", type=int, default=10, help="steps published in --local mode")
+    parser.add_argument("--points", type=int, default=100, help="configurations per step in --local mode")
+    parser.add_argument("--quorum", default="all")
+    parser.add_argument("--user-ttl", type=float, default=2.0)
+    parser.add_argument("--confirmation-timeout", type=float, default=30.0)
+    parser.add_argument("--broker-latency", type=float, default=0.0)
+    parser.add_argument("--output", help="write the JSON report here instead of to stdout")
+    args = parser.parse_args(argv)
+
+    instrumentation.configure_logging(logging.WARNING)
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,133 @@
 import time
 import random
+import logging
 import threading
 import os
+import sys
 
 from compas_eve import Message
 from compas_eve import Publisher
 from compas_eve import Subscriber
-from compas_eve import Topic
-from compas_eve.mqtt import MqttTransport
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "planning"))
+from message_bus import MessageBus
+from message_bus import topic
+import configuration_codec
+import instrumentation
+import trajectory_preview
+
+logger = logging.getLogger(__name__)
 
 
 class MockAR(object):
-    def __init__(self):
-        print("instantiated mock AR")
+    def __init__(self, transport = None, server_topic = "T2_command_test", response_delay = 0.5, check_in_interval = 1):
+        logger.info("instantiated mock AR")
         self.confirm_step = {}
         self.id = random.randint(0, 100000)
+        self.formats = ["json", configuration_codec.FORMAT]
+        self.configurations = {}
+        self.previews = {}
+        self._chunks = {}
+        self._keyframes = {}
+
+        self.response_delay = response_delay
+        self.stop_event = threading.Event()
 
         self._start_time = time.monotonic()
-        self.tx = MqttTransport("broker.hivemq.com")
-        self.server_topic = "T2_command_test"
+        self.tx = transport or MessageBus.shared()
+        self.server_topic = server_topic
 
         """checkin with the system"""
-        self.user_checkin_topic = Topic("/{}/user_checkin_topic".format(self.server_topic), Message)
+        self.user_checkin_topic = topic(self.server_topic, "user_checkin_topic")
         self.user_checkin_publisher = Publisher(self.user_checkin_topic, transport=self.tx)
 
         """connect to publish topic"""
-        self.user_data_topic = Topic("/{}/user_data_topic/{}".format(self.server_topic,self.id), Message)
+        self.user_data_topic = topic(self.server_topic, "user_data_topic", self.id)
         self.user_data_publisher = Publisher(self.user_data_topic, transport=self.tx)
 
+        """connect to confirmation topic"""
+        self.confirmation_topic = topic(self.server_topic, "confirmation_topic")
+        self.confirmation_publisher = Publisher(self.confirmation_topic, transport=self.tx)
+
         """subscribe to interface topic"""
-        self.interface_topic = Topic("/{}/interface_topic".format(self.server_topic), Message)
+        self.interface_topic = topic(self.server_topic, "interface_topic")
         self.interface_subscriber = Subscriber(self.interface_topic, callback=lambda msg: self.respond(msg), transport=self.tx)        
         self.interface_subscriber.subscribe()
-        self.start_check_in()
-        print("running mock AR #{}".format(self.id))
+        self.start_check_in(check_in_interval)
+        logger.info("running mock AR #%s", self.id, extra={"user": str(self.id)})
 
 
     def start_check_in(self, interval = 1):
-        thread = threading.Thread(target=self.check_in, args=(interval,))
+        thread = threading.Thread(target=self.check_in, args=(interval,), daemon=True)
         thread.start()
 
     def check_in(self, interval = 1):
-            while True:
-                self.user_checkin_publisher.publish(Message(text=str(self.id)))
-                print("published message: {} on topic: {}".format(self.id, self.user_checkin_publisher.topic.name))
-                time.sleep(interval)
+            while not self.stop_event.is_set():
+                self.user_checkin_publisher.publish(Message(text=str(self.id), formats=self.formats))
+                logger.debug("checked in on %s", self.user_checkin_publisher.topic.name, extra={"user": str(self.id)})
+                self.stop_event.wait(interval)
+
+
+    def stop(self):
+        self.stop_event.set()
+
+
+    def receive_configurations(self, message):
+        """Returns the configurations of a step once they are complete, or None while chunks are missing."""
+        if message["type"] in ("configurations_preview", "configurations_refinement"):
+            return self.receive_stream(message)
+        if message.data.get("encoding") != configuration_codec.FORMAT:
+            return [value for key, value in message.data.items() if key not in ("type", "step")]
+        chunks = self._chunks.setdefault(message["step"], {})
+        chunks[message["chunk"]] = configuration_codec.from_text(message["data"])
+        if len(chunks) < message["chunks"]:
+            return None
+        del self._chunks[message["step"]]
+        return configuration_codec.decode_configurations(chunks.values())[2]
+
+
+    def receive_stream(self, message):
+        """Shows the interpolated preview as keyframes arrive and returns the configurations once all have."""
+        step = message["step"]
+        keyframes = self._keyframes.setdefault(step, {})
+        keyframes.update(zip(message["indices"], message["configurations"]))
+        self.previews[step] = trajectory_preview.interpolate(keyframes.items(), message["count"])
+        if len(keyframes) < message["count"]:
+            return None
+        del self._keyframes[step]
+        return [keyframes[index] for index in range(message["count"])]
 
 
     def respond(self, message):
-        print("recieved message: {} on topic: {}".format(message, self.interface_topic.name))
-        
-        time.sleep(0.5)
-        msg = {"type": "confirmation", "step": message["step"], "command": True}
-        print("publishing message: {} on topic: {}".format(msg, self.user_data_publisher.topic.name))
-        self.user_data_publisher.publish(Message(text="howdy {}, my number is {}".format(message, self.id)))
+        step = message.data.get("step")
+        with instrumentation.span("mqtt.receive", topic=self.interface_topic.name, user=str(self.id), step=step):
+            logger.debug("received %s on %s", message.data.get("type"), self.interface_topic.name, extra={"user": str(self.id), "step": step})
+            configurations = self.receive_configurations(message)
+        if configurations is None:
+            return
+        self.configurations[message["step"]] = configurations
+
+        """confirm on a timer: sleeping here would hold up the transport's delivery to every other subscriber"""
+        timer = threading.Timer(self.response_delay, self.confirm, args=(step,))
+        timer.daemon = True
+        timer.start()
+
+
+    def confirm(self, step):
+        if self.stop_event.is_set():
+            return
+        msg = Message(type="confirmation", user_id=str(self.id), step=step, confirmation=True)
+        with instrumentation.span("mqtt.publish", topic=self.confirmation_publisher.topic.name, user=str(self.id), step=step):
+            self.confirmation_publisher.publish(msg)
 
 
 
 if __name__ == "__main__":
+    instrumentation.configure_logging()
     ar = MockAR()
-    while True:
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
         pass
+
             
\ No newline at end of file
@@ -0,0 +1,30 @@
+"""Axis-aligned bounding boxes as `((xmin, ymin, zmin), (xmax, ymax, zmax))` tuples."""
+
+
+def aabb_from_points(points):
+    xs, ys, zs = zip(*[(p[0], p[1], p[2]) for p in points])
+    return ((min(xs), min(ys), min(zs)), (max(xs), max(ys), max(zs)))
+
+
+def aabb_from_mesh(mesh):
+    return aabb_from_points(mesh.vertices_attributes("xyz"))
+
+
+def aabb_union(boxes):
+    boxes = list(boxes)
+    return (
+        tuple(min(box[0][i] for box in boxes) for i in range(3)),
+        tuple(max(box[1][i] for box in boxes) for i in range(3)),
+        )
+
+
+def aabb_inflate(box, margin):
+    return (tuple(v - margin for v in box[0]), tuple(v + margin for v in box[1]))
+
+
+def aabb_intersects(a, b):
+    return all(a[0][i] <= b[1][i] and b[0][i] <= a[1][i] for i in range(3))
+
+
+def aabb_volume(box):
+    return (box[1][0] - box[0][0]) * (box[1][1] - box[0][1]) * (box[1][2] - box[0][2])
@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import threading
+import paho.mqtt.client as mqtt
+from compas.data import json_dumps
+from compas.data import json_loads
+from compas_eve import Message
+
+from executor_communicator import ExecutorCommunicator
+from executor_communicator import ARUser
+from executor_communicator import quorum_reached
+from presence_tracker import PresenceTracker
+from publish_queue import PublishQueue
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncExecutorCommunicator(object):
+    """asyncio variant of :class:`ExecutorCommunicator`.
+
+    The MQTT socket, the subscriptions, the user list and confirmations all run on the event loop
+    of the coroutine that calls `start`. Users expire on the thread of a :class:`PresenceTracker`,
+    which hands joins and leaves to the loop in the order they happen. Outgoing messages go through a bounded :class:`PublishQueue`,
+    so robot commands are always published before configuration updates, and those before AR
+    chatter. A configuration update replaces the queued update of the same step, and chatter
+    is dropped when the queue is full.
+
+    Parameters
+    ----------
+    broker : str
+        Host name of the MQTT broker.
+    directory_name : str
+        Top level directory of all topics.
+    quorum : str or int, optional
+        Confirmations needed before a step counts as confirmed: "all" users, "any" user, or a number of users.
+    user_ttl : float, optional
+        Seconds without a check-in after which a user is dropped.
+    queue_size : int, optional
+        Maximum number of queued outgoing messages.
+
+    """
+
+    COMMAND = 0
+    CONFIGURATION = 1
+    INTERFACE = 2
+
+    def __init__(self, broker, directory_name, quorum = ExecutorCommunicator.ALL, user_ttl = 2.0, queue_size = 256, port = 1883):
+        self.broker = broker
+        self.port = port
+        self.topic_top_directory = directory_name
+        self.quorum = quorum
+        self.user_ttl = user_ttl
+        self.queue_size = queue_size
+        self.AR_users = {}
+        self.queue = None
+        self.client = None
+        self._loop = None
+        self._loop_thread = None
+        self._tasks = []
+        self.presence = None
+        self._confirmation_waiters = set()
+        self._step_message = None
+        self.user_checkin_topic = self.topic("user_checkin_topic")
+        self.confirmation_topic = self.topic("confirmation_topic")
+        self.interface_topic = self.topic("interface_topic")
+        self.command_topic = self.topic("command_topic")
+
+
+    def topic(self, name):
+        return "/{}/{}".format(self.topic_top_directory, name)
+
+
+    async def start(self):
+        """Connects to the broker and starts the publish and socket tasks on the running loop, and user expiry."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.presence = PresenceTracker(self.user_ttl,
+                                        on_join=lambda user_id: self._loop.call_soon_threadsafe(self.add_user, user_id),
+                                        on_leave=lambda user_id: self._loop.call_soon_threadsafe(self.drop_user, user_id))
+        self.presence.start()
+        self.queue = PublishQueue(self.queue_size, {
+            AsyncExecutorCommunicator.COMMAND: PublishQueue.BLOCK,
+            AsyncExecutorCommunicator.CONFIGURATION: PublishQueue.COALESCE,
+            AsyncExecutorCommunicator.INTERFACE: PublishQueue.DROP,
+            })
+
+        self.client = mqtt.Client()
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+        """connecting resolves the host name and opens the socket, so keep it off the loop; the socket
+        callbacks paho runs on the executor thread meanwhile are handed to the loop"""
+        await self._loop.run_in_executor(None, self.client.connect, self.broker, self.port, 60)
+        self._tasks = [
+            asyncio.ensure_future(self._publish_messages()),
+            asyncio.ensure_future(self._misc_loop()),
+            ]
+        logger.info("connected to %s", self.broker)
+
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.presence.stop()
+        self.client.disconnect()
+
+
+    """paho socket callbacks, which hand the socket to the event loop instead of a network thread"""
+
+    def _call_on_loop(self, callback, *args):
+        """Runs `callback` now on the loop thread, or schedules it there from any other thread, since
+        the loop's reader and writer registry is not thread safe."""
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call_on_loop(self._loop.add_reader, sock, client.loop_read)
+
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call_on_loop(self._loop.remove_reader, sock)
+
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call_on_loop(self._loop.add_writer, sock, client.loop_write)
+
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call_on_loop(self._loop.remove_writer, sock)
+
+
+    async def _misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+
+    def _on_connect(self, client, userdata, flags, rc):
+        client.subscribe(self.user_checkin_topic)
+        client.subscribe(self.confirmation_topic)
+        logger.info("subscribed to %s and %s", self.user_checkin_topic, self.confirmation_topic)
+
+
+    def _on_message(self, client, userdata, msg):
+        message = Message.parse(json_loads(msg.payload.decode("utf-8")))
+        if msg.topic == self.user_checkin_topic:
+            self.check_in(message.text)
+        elif msg.topic == self.confirmation_topic:
+            self.parse_confirmation(message)
+
+
+    async def _publish_messages(self):
+        while True:
+            _, (topic, message) = await self.queue.get()
+            self.client.publish(topic, json_dumps(message.data))
+
+
+    """user presence, changed on the loop only"""
+
+    def check_in(self, user_id):
+        self.presence.check_in(user_id)
+
+
+    def remove_user(self, user_id):
+        self.presence.remove(user_id)
+
+
+    def add_user(self, user_id):
+        self.AR_users[user_id] = ARUser(user_id)
+        self._notify_confirmation_waiters()
+        logger.info("user %s added", user_id, extra={"user": user_id})
+        if self._step_message is not None:
+            """the user may have missed the configurations of the step being confirmed, queued again like an update of that step"""
+            step_index, message = self._step_message
+            self._tasks.append(asyncio.ensure_future(self.queue.put(AsyncExecutorCommunicator.CONFIGURATION, (self.interface_topic, message), key=step_index)))
+
+
+    def drop_user(self, user_id):
+        if self.AR_users.pop(user_id, None) is not None:
+            self._notify_confirmation_waiters()
+            logger.info("user %s removed", user_id, extra={"user": user_id})
+
+
+    """confirmations"""
+
+    def parse_confirmation(self, message):
+        user = self.AR_users.get(message["user_id"])
+        if user:
+            user.step_confirmations[message["step"]] = message["confirmation"]
+            self._notify_confirmation_waiters()
+        else:
+            logger.warning("confirmation from unknown user %s", message["user_id"], extra={"user": message["user_id"]})
+
+
+    def _notify_confirmation_waiters(self):
+        for waiter in self._confirmation_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._confirmation_waiters.clear()
+
+
+    def is_confirmed(self, step_index, quorum = None):
+        users = list(self.AR_users.values())
+        confirmed = sum(1 for user in users if user.step_confirmations.get(step_index) is True)
+        return quorum_reached(confirmed, len(users), quorum or self.quorum)
+
+
+    async def wait_for_confirmation(self, step_index, quorum = None, timeout = None):
+        """Waits until `step_index` is confirmed by the quorum. Returns False on timeout."""
+        deadline = None if timeout is None else self._loop.time() + timeout
+        while not self.is_confirmed(step_index, quorum):
+            remaining = None if deadline is None else deadline - self._loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            waiter = self._loop.create_future()
+            self._confirmation_waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                return self.is_confirmed(step_index, quorum)
+        return True
+
+
+    """outgoing messages"""
+
+    async def send_to_robot(self, command):
+        await self.queue.put(AsyncExecutorCommunicator.COMMAND, (self.command_topic, Message(text=command)))
+
+
+    async def send_configurations(self, step_index, configurations):
+        """Queues the configurations of `step_index`, replacing an update of the same step that is still queued."""
+        configurations["type"] = "configurations"
+        for user in self.AR_users.values():
+            user.step_confirmations[step_index] = False
+        message = Message(configurations)
+        self._step_message = (step_index, message)
+        await self.queue.put(AsyncExecutorCommunicator.CONFIGURATION, (self.interface_topic, message), key=step_index)
+
+
+    async def send_to_interface(self, user_id, message):
+        """Queues a message for the AR interface. Returns False if it was dropped under backpressure."""
+        msg = Message(text="{}: {}".format(user_id, message))
+        return await self.queue.put(AsyncExecutorCommunicator.INTERFACE, (self.interface_topic, msg))
@@ -0,0 +1,163 @@
+import numpy as np
+from compas.geometry import Frame
+from compas.geometry import Transformation
+try:
+    from compas_robots import Configuration
+    from compas_robots.model import Joint
+except ImportError:
+    """compas 1 and compas_fab before 1.0 keep the robot model in compas"""
+    from compas.robots import Configuration
+    from compas.robots import Joint
+
+
+class BatchKinematics(object):
+    """Vectorized configuration merging and forward kinematics over many configurations at once.
+
+    Configurations are `(N, joints)` arrays. Joint-name index maps and kinematic chains are built
+    once per planning group (`robot11`, `robot12`, `bridge1`, ...) and cached.
+
+    Parameters
+    ----------
+    robot : :class:`compas_fab.robots.Robot`
+    full_configuration : :class:`compas_fab.robots.Configuration`
+        Configuration of all joints; fills in the joints a group does not move and fixes the
+        column order of the full configuration arrays.
+
+    """
+
+    def __init__(self, robot, full_configuration):
+        self.robot = robot
+        self.full_configuration = full_configuration
+        self.full_joint_names = list(full_configuration.joint_names)
+        self.full_values = np.asarray(full_configuration.joint_values, dtype=float)
+        self._full_index = {name: index for index, name in enumerate(self.full_joint_names)}
+        self._group_indices = {}
+        self._chains = {}
+        self._chain_links = {}
+
+
+    def group_indices(self, group, joint_names = None):
+        """Returns the columns of the full configuration that the joints of `group` map to."""
+        key = (group, tuple(joint_names) if joint_names else None)
+        if key not in self._group_indices:
+            names = joint_names or self.robot.get_configurable_joint_names(group)
+            self._group_indices[key] = np.array([self._full_index[name] for name in names], dtype=int)
+        return self._group_indices[key]
+
+
+    def points_array(self, trajectories):
+        """Stacks the points of `trajectories` into an `(N, joints)` array, and returns it with their joint names."""
+        points = [point for trajectory in trajectories for point in trajectory.points]
+        if not points:
+            return np.zeros((0, len(self.full_joint_names))), []
+        return np.array([point.joint_values for point in points], dtype=float), list(points[0].joint_names)
+
+
+    def merge(self, values, group, joint_names = None):
+        """Merges an `(N, group joints)` array into `(N, full joints)` full configurations."""
+        values = np.atleast_2d(np.asarray(values, dtype=float))
+        merged = np.repeat(self.full_values[np.newaxis, :], len(values), axis=0)
+        merged[:, self.group_indices(group, joint_names)] = values
+        return merged
+
+
+    def chain(self, group):
+        """Returns the cached joint chain from the model root to the end effector link of `group`.
+
+        Each joint is `(origin matrix, unit axis, joint type, full configuration column or -1, (lower, upper))`.
+        Revolute and prismatic positions are clamped to their limits, as `robot.forward_kinematics` does.
+        """
+        if group not in self._chains:
+            end_link = self.robot.get_end_effector_link_name(group)
+            chain = []
+            for joint in self.robot.model.iter_joint_chain(self.robot.model.root.name, end_link):
+                origin = np.array(Transformation.from_frame(joint.origin).matrix) if joint.origin else np.identity(4)
+                axis = np.array(list(joint.axis.vector), dtype=float) if joint.axis else np.array([0.0, 0.0, 1.0])
+                axis /= np.linalg.norm(axis)
+                if joint.type in (Joint.REVOLUTE, Joint.PRISMATIC) and joint.limit:
+                    bounds = (joint.limit.lower, joint.limit.upper)
+                else:
+                    bounds = (-np.inf, np.inf)
+                chain.append((origin, axis, joint.type, self._full_index.get(joint.name, -1), bounds))
+            self._chains[group] = chain
+        return self._chains[group]
+
+
+    def chain_links(self, group):
+        """Returns the names of the child links of the joints in the chain of `group`, in chain order."""
+        if group not in self._chain_links:
+            end_link = self.robot.get_end_effector_link_name(group)
+            self._chain_links[group] = [joint.child.link for joint in self.robot.model.iter_joint_chain(self.robot.model.root.name, end_link)]
+        return self._chain_links[group]
+
+
+    def forward_kinematics(self, full_values, group):
+        """Returns the `(N, 4, 4)` transformations of the end effector link of `group` for `(N, full joints)` values."""
+        return self.chain_transformations(full_values, group)[-1]
+
+
+    def chain_transformations(self, full_values, group):
+        """Returns the `(N, 4, 4)` transformations of the child link of every joint in the chain of `group`, in chain order."""
+        full_values = np.atleast_2d(full_values)
+        count = len(full_values)
+        matrices = np.repeat(np.identity(4)[np.newaxis, :, :], count, axis=0)
+        transformations = []
+        for origin, axis, joint_type, column, bounds in self.chain(group):
+            matrices = matrices @ origin
+            if column >= 0 and joint_type != Joint.FIXED:
+                q = np.clip(full_values[:, column], *bounds)
+                motion = np.repeat(np.identity(4)[np.newaxis, :, :], count, axis=0)
+                if joint_type == Joint.PRISMATIC:
+                    motion[:, :3, 3] = q[:, np.newaxis] * axis
+                elif joint_type in (Joint.REVOLUTE, Joint.CONTINUOUS):
+                    motion[:, :3, :3] = rotation_matrices(axis, q)
+                matrices = matrices @ motion
+            transformations.append(matrices)
+        return transformations or [matrices]
+
+
+    def link_origins(self, full_values, group, moving_only = False, shared_with = None):
+        """Returns the `(N, links, 3)` origins of the links in the chain of `group`, the end effector link last.
+
+        With `moving_only`, the links before the first moving joint, which stay put whatever the
+        group does, are left out. With `shared_with`, so are the links in the chain of that group
+        too, e.g. the bridge two arms hang from.
+        """
+        transformations = self.chain_transformations(full_values, group)
+        if moving_only:
+            moving = [index for index, (_, _, joint_type, column, _) in enumerate(self.chain(group)) if column >= 0 and joint_type != Joint.FIXED]
+            first = moving[0] if moving else len(transformations) - 1
+            transformations = transformations[first:]
+            links = self.chain_links(group)[first:]
+        else:
+            links = self.chain_links(group)
+        if shared_with:
+            shared = set(self.chain_links(shared_with))
+            transformations = [matrices for matrices, link in zip(transformations, links) if link not in shared] or transformations[-1:]
+        return np.stack([matrices[:, :3, 3] for matrices in transformations], axis=1)
+
+
+    def to_configurations(self, full_values):
+        """Converts `(N, full joints)` values back to compas configurations."""
+        joint_types = self.full_configuration.joint_types
+        return [Configuration(row.tolist(), joint_types, self.full_joint_names) for row in np.atleast_2d(full_values)]
+
+
+    def tool_frames(self, trajectories, group):
+        """Returns the full configurations and end effector frames of every point of `trajectories`."""
+        values, joint_names = self.points_array(trajectories)
+        merged = self.merge(values, group, joint_names)
+        return merged, matrices_to_frames(self.forward_kinematics(merged, group))
+
+
+def rotation_matrices(axis, angles):
+    """Returns the `(N, 3, 3)` rotations by `angles` about the unit `axis` (Rodrigues' formula)."""
+    x, y, z = axis
+    k = np.array([[0.0, -z, y], [z, 0.0, -x], [-y, x, 0.0]])
+    sin = np.sin(angles)[:, np.newaxis, np.newaxis]
+    cos = np.cos(angles)[:, np.newaxis, np.newaxis]
+    return np.identity(3) + sin * k + (1.0 - cos) * (k @ k)
+
+
+def matrices_to_frames(matrices):
+    return [Frame(m[:3, 3].tolist(), m[:3, 0].tolist(), m[:3, 1].tolist()) for m in matrices]
@@ -0,0 +1,201 @@
+"""Compact binary wire format for configuration streams sent to the AR interface.
+
+A stream is a list of self-contained chunks. Each chunk is
+
+    header     magic "T2CF", version, flags, step index, name count, joint count, point count,
+               chunk index, chunk count
+    names      name count times (length byte, utf-8 name); no names, or one per joint
+    ranges     if QUANTIZED: float32 offset and scale per joint
+    values     point count * joint count values, point-major:
+               float32, or uint16 if QUANTIZED, delta encoded along the points (mod 2**16) if DELTA
+    (all after the header zlib compressed if ZLIB)
+
+Quantization maps every joint to 16 bits over its range in the chunk, which is an error of at most
+half a step: 0.15 mm on a 20 m gantry axis, 5e-5 rad on a full turn.
+"""
+import sys
+import zlib
+import array
+import base64
+import struct
+import itertools
+
+FORMAT = "t2cf/2"
+MAGIC = b"T2CF"
+VERSION = 2
+
+QUANTIZED = 1
+DELTA = 2
+ZLIB = 4
+
+_HEADER = struct.Struct("<4sBBiHHIHH")
+_LEVELS = 65535
+
+
+def _little_endian(values):
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def configuration_values(configuration):
+    """Returns the joint values of a compas `Configuration` or a plain sequence of numbers."""
+    return list(getattr(configuration, "joint_values", configuration))
+
+
+def encode_configurations(step_index, configurations, joint_names = None, quantize = False, delta = False, compress = False, chunk_points = None):
+    """Encodes `configurations` as a list of binary chunks.
+
+    Parameters
+    ----------
+    step_index : int
+    configurations : list
+        Compas `Configuration` objects or sequences of joint values, all of the same length.
+    joint_names : list of str, optional
+        Defaults to the `joint_names` of the first configuration, if it has any.
+    quantize, delta, compress : bool, optional
+        Enable 16 bit quantization, delta encoding of the quantized values, and zlib compression.
+    chunk_points : int, optional
+        Maximum number of configurations per chunk. Defaults to a single chunk.
+
+    """
+    if delta and not quantize:
+        raise ValueError("delta encoding needs quantized values")
+    rows = [configuration_values(c) for c in configurations]
+    if joint_names is None:
+        joint_names = list(getattr(configurations[0], "joint_names", None) or []) if configurations else []
+    joint_count = len(rows[0]) if rows else len(joint_names)
+    if joint_names and len(joint_names) != joint_count:
+        raise ValueError("{} joint names for {} joint values".format(len(joint_names), joint_count))
+    flags = (QUANTIZED if quantize else 0) | (DELTA if delta else 0) | (ZLIB if compress else 0)
+    chunk_points = chunk_points or max(len(rows), 1)
+    chunk_count = max((len(rows) + chunk_points - 1) // chunk_points, 1)
+
+    names = b"".join(struct.pack("<B", len(n.encode("utf-8"))) + n.encode("utf-8") for n in joint_names)
+    chunks = []
+    for chunk_index in range(chunk_count):
+        chunk_rows = rows[chunk_index * chunk_points:(chunk_index + 1) * chunk_points]
+        body = names + _encode_values(chunk_rows, joint_count, quantize, delta)
+        if compress:
+            body = zlib.compress(body)
+        header = _HEADER.pack(MAGIC, VERSION, flags, step_index, len(joint_names), joint_count, len(chunk_rows), chunk_index, chunk_count)
+        chunks.append(header + body)
+    return chunks
+
+
+def _encode_values(rows, joint_count, quantize, delta):
+    flat = [value for row in rows for value in row]
+    if not quantize:
+        return _little_endian(array.array("f", flat)).tobytes()
+    offsets = [min(row[j] for row in rows) if rows else 0.0 for j in range(joint_count)]
+    scales = [((max(row[j] for row in rows) - offsets[j]) / _LEVELS if rows else 0.0) or 1.0 for j in range(joint_count)]
+    quantized = array.array("H", [int(round((value - offsets[i % joint_count]) / scales[i % joint_count])) for i, value in enumerate(flat)])
+    if delta:
+        for i in range(len(quantized) - 1, joint_count - 1, -1):
+            quantized[i] = (quantized[i] - quantized[i - joint_count]) % 65536
+    ranges = array.array("f", [v for pair in zip(offsets, scales) for v in pair])
+    return _little_endian(ranges).tobytes() + _little_endian(quantized).tobytes()
+
+
+def decode_chunk(chunk):
+    """Decodes one chunk.
+
+    Returns
+    -------
+    tuple
+        `(step_index, joint_names, configurations, chunk_index, chunk_count)`, with the
+        configurations as lists of floats.
+    """
+    magic, version, flags, step_index, name_count, joint_count, point_count, chunk_index, chunk_count = _HEADER.unpack_from(chunk)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a {} chunk".format(FORMAT))
+    body = chunk[_HEADER.size:]
+    if flags & ZLIB:
+        body = zlib.decompress(body)
+
+    joint_names = []
+    position = 0
+    for _ in range(name_count):
+        length = body[position]
+        joint_names.append(body[position + 1:position + 1 + length].decode("utf-8"))
+        position += 1 + length
+    if point_count == 0 or joint_count == 0:
+        return step_index, joint_names, [[] for _ in range(point_count)], chunk_index, chunk_count
+
+    if flags & QUANTIZED:
+        ranges = array.array("f")
+        ranges.frombytes(body[position:position + 8 * joint_count])
+        _little_endian(ranges)
+        position += 8 * joint_count
+        quantized = array.array("H")
+        quantized.frombytes(body[position:position + 2 * joint_count * point_count])
+        _little_endian(quantized)
+        values = [0.0] * len(quantized)
+        for j in range(joint_count):
+            column = quantized[j::joint_count]
+            if flags & DELTA:
+                column = itertools.accumulate(column, lambda a, b: (a + b) & 0xFFFF)
+            offset, scale = ranges[2 * j], ranges[2 * j + 1]
+            values[j::joint_count] = [offset + q * scale for q in column]
+    else:
+        values = array.array("f")
+        values.frombytes(body[position:position + 4 * joint_count * point_count])
+        _little_endian(values)
+        values = values.tolist()
+
+    configurations = [values[i:i + joint_count] for i in range(0, len(values), joint_count)]
+    return step_index, joint_names, configurations, chunk_index, chunk_count
+
+
+def decode_configurations(chunks):
+    """Decodes a complete stream of chunks, in any order, into `(step_index, joint_names, configurations)`."""
+    decoded = sorted((decode_chunk(chunk) for chunk in chunks), key=lambda d: d[3])
+    if not decoded or len(decoded) != decoded[0][4]:
+        raise ValueError("incomplete configuration stream")
+    configurations = []
+    for d in decoded:
+        configurations.extend(d[2])
+    return decoded[0][0], decoded[0][1], configurations
+
+
+def to_text(chunk):
+    """Makes a chunk safe to carry in a JSON message field."""
+    return base64.b64encode(chunk).decode("ascii")
+
+
+def from_text(text):
+    return base64.b64decode(text)
+
+
+if __name__ == "__main__":
+    """compare the size and decode time of the JSON and the compact formats on a synthetic 11 axis trajectory"""
+    import json
+    import math
+    import timeit
+
+    joint_names = ["bridge1_joint_EA_X", "robot11_joint_EA_Y", "robot11_joint_EA_Z"] + ["robot11_joint_{}".format(i) for i in range(1, 7)] + ["robot12_joint_EA_Y", "robot12_joint_EA_Z"]
+    points = 2000
+    configurations = [[9 + 3 * math.sin(t / 300.0), -2 + t / 1000.0, -4.5 + 0.5 * math.cos(t / 200.0)]
+                      + [math.sin(t / (50.0 + 10 * j)) for j in range(6)] + [-12.0, -4.5] for t in range(points)]
+
+    json_message = {"type": "configurations", "step": 0}
+    for index, configuration in enumerate(configurations):
+        json_message[index] = configuration
+    json_payload = json.dumps(json_message)
+    print("{:<28}{:>12}{:>16}".format("format", "bytes", "decode [ms]"))
+    decode_ms = 1000 * min(timeit.repeat(lambda: json.loads(json_payload), number=10, repeat=3)) / 10
+    print("{:<28}{:>12}{:>16.2f}".format("json", len(json_payload), decode_ms))
+
+    variants = [
+        ("float32", {}),
+        ("float32+zlib", {"compress": True}),
+        ("quantized", {"quantize": True}),
+        ("quantized+delta+zlib", {"quantize": True, "delta": True, "compress": True}),
+        ]
+    for name, options in variants:
+        chunks = encode_configurations(0, configurations, joint_names, chunk_points=500, **options)
+        payload = json.dumps([to_text(chunk) for chunk in chunks])
+        decode = lambda: decode_configurations([from_text(text) for text in json.loads(payload)])
+        decode_ms = 1000 * min(timeit.repeat(decode, number=10, repeat=3)) / 10
+        error = max(abs(a - b) for row, decoded in zip(configurations, decode()[2]) for a, b in zip(row, decoded))
+        print("{:<28}{:>12}{:>16.2f}   max error {:.2e}".format(name, len(payload), decode_ms, error))
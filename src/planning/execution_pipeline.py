@@ -0,0 +1,214 @@
+import threading
+import time
+
+
+class ExecutionPipeline(object):
+    """Runs the planning, confirmation and execution of steps as three overlapping stages.
+
+    While one step executes, the steps after it are planned and sent out for confirmation, at
+    most `lookahead` steps ahead of the executing one. Every stage handles steps in order on its
+    own thread; execution runs on the calling thread.
+
+    A step fails if planning raises, confirmation returns False or execution returns False or
+    raises. The steps after it were planned on the assumption that it succeeded, so they are
+    discarded, `rollback` is called with the failed step before planning resumes from it, and
+    the failed step is retried up to `max_retries` times before the pipeline stops.
+
+    A confirmation still pending when its step is discarded, or when the pipeline stops, is
+    stale: :meth:`confirmation_cancelled` turns True for it and `cancel` is called to wake it, so
+    a `confirm` that blocks should return once it sees the flag.
+
+    Parameters
+    ----------
+    plan : callable
+        `plan(step_index, attempt)`, returns what `confirm` and `execute` get. Always called
+        from the same thread.
+    confirm : callable
+        `confirm(step_index, planned)`, returns True once the step is confirmed.
+    execute : callable
+        `execute(step_index, planned)`, returns False on failure.
+    lookahead : int, optional
+        Number of steps planned and confirmed ahead of the executing step.
+    max_retries : int, optional
+    rollback : callable, optional
+        `rollback(step_index)`, called on the planning thread before replanning from `step_index`.
+    cancel : callable, optional
+        `cancel()`, called whenever the pending confirmation may have become stale.
+
+    """
+
+    STAGES = ("plan", "confirm", "execute")
+
+    def __init__(self, plan, confirm, execute, lookahead = 1, max_retries = 1, rollback = None, cancel = None):
+        self.plan = plan
+        self.confirm = confirm
+        self.execute = execute
+        self.lookahead = lookahead
+        self.max_retries = max_retries
+        self.rollback = rollback
+        self.cancel = cancel
+        self._condition = threading.Condition()
+        self._reset([])
+
+
+    def _reset(self, indices):
+        self.indices = list(indices)
+        self.completed = []
+        self.failures = []          # (step index, stage, reason)
+        self.busy = {stage: 0.0 for stage in ExecutionPipeline.STAGES}
+        self.counts = {stage: 0 for stage in ExecutionPipeline.STAGES}
+        self.wall_time = 0.0
+        self._generation = 0        # incremented on every rollback; results of older generations are dropped
+        self._confirm_generation = 0    # generation of the confirmation in progress
+        self._attempts = {}         # position -> attempts so far
+        self._planned = {}          # position -> (ok, result, reason)
+        self._confirmed = {}        # position -> (ok, result, stage, reason)
+        self._next_plan = 0
+        self._next_confirm = 0
+        self._executing = 0
+        self._rollback_to = None
+        self._stopped = False
+
+
+    def _timed(self, stage, function, *args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            with self._condition:
+                self.busy[stage] += time.perf_counter() - start
+                self.counts[stage] += 1
+
+
+    def run(self, indices):
+        """Plans, confirms and executes the steps `indices` in order, and returns :meth:`report`."""
+        self._reset(indices)
+        start = time.perf_counter()
+        workers = [threading.Thread(target=self._plan_loop, daemon=True), threading.Thread(target=self._confirm_loop, daemon=True)]
+        for worker in workers:
+            worker.start()
+        try:
+            self._execute_loop()
+        finally:
+            with self._condition:
+                self._stopped = True
+                self._condition.notify_all()
+            if self.cancel:
+                self.cancel()
+            for worker in workers:
+                worker.join()
+            self.wall_time = time.perf_counter() - start
+        return self.report()
+
+
+    def _plan_loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopped or (
+                    self._next_plan < len(self.indices) and self._next_plan <= self._executing + self.lookahead))
+                if self._stopped:
+                    return
+                position, generation, rollback_to = self._next_plan, self._generation, self._rollback_to
+                self._rollback_to = None
+                self._next_plan += 1
+                attempt = self._attempts.get(position, 0)
+            if rollback_to is not None and self.rollback:
+                self.rollback(self.indices[rollback_to])
+            try:
+                planned = (True, self._timed("plan", self.plan, self.indices[position], attempt), None)
+            except Exception as e:
+                planned = (False, None, repr(e))
+            with self._condition:
+                if generation == self._generation:
+                    self._planned[position] = planned
+                    self._condition.notify_all()
+
+
+    def _confirm_loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopped or self._next_confirm in self._planned)
+                if self._stopped:
+                    return
+                position, generation = self._next_confirm, self._generation
+                self._confirm_generation = generation
+                ok, result, reason = self._planned[position]
+                self._next_confirm += 1
+                if not ok:
+                    self._confirmed[position] = (False, None, "plan", reason)
+                    self._condition.notify_all()
+                    continue
+            try:
+                confirmed = self._timed("confirm", self.confirm, self.indices[position], result)
+                confirmed = (bool(confirmed), result, "confirm", None if confirmed else "not confirmed")
+            except Exception as e:
+                confirmed = (False, result, "confirm", repr(e))
+            with self._condition:
+                if generation == self._generation:
+                    self._confirmed[position] = confirmed
+                    self._condition.notify_all()
+
+
+    def _execute_loop(self):
+        while self._executing < len(self.indices):
+            with self._condition:
+                self._condition.wait_for(lambda: self._executing in self._confirmed)
+                position = self._executing
+                ok, result, stage, reason = self._confirmed[position]
+            if ok:
+                stage = "execute"
+                try:
+                    if self._timed("execute", self.execute, self.indices[position], result) is False:
+                        ok, reason = False, "execution failed"
+                except Exception as e:
+                    ok, reason = False, repr(e)
+
+            with self._condition:
+                self._planned.pop(position, None)
+                self._confirmed.pop(position, None)
+                if ok:
+                    self.completed.append(self.indices[position])
+                    self._executing += 1
+                    self._condition.notify_all()
+                    continue
+                self.failures.append((self.indices[position], stage, reason))
+                self._attempts[position] = self._attempts.get(position, 0) + 1
+                if self._attempts[position] > self.max_retries:
+                    return
+                """everything planned after the failed step assumed it succeeded"""
+                self._generation += 1
+                self._planned.clear()
+                self._confirmed.clear()
+                self._next_plan = self._next_confirm = position
+                self._rollback_to = position
+                self._condition.notify_all()
+            if self.cancel:
+                self.cancel()
+
+
+    def confirmation_cancelled(self):
+        """True while the confirmation in progress belongs to a discarded step or the pipeline stopped."""
+        with self._condition:
+            return self._stopped or self._confirm_generation != self._generation
+
+
+    def report(self):
+        """Returns the completed and failed steps and, per stage, its busy time and utilization.
+
+        The stage with the highest utilization is the one limiting throughput.
+        """
+        stages = {}
+        for stage in ExecutionPipeline.STAGES:
+            stages[stage] = {
+                "count": self.counts[stage],
+                "busy": self.busy[stage],
+                "utilization": self.busy[stage] / self.wall_time if self.wall_time > 0 else 0.0,
+                }
+        return {
+            "completed": list(self.completed),
+            "failures": list(self.failures),
+            "rollbacks": sum(self._attempts.values()),
+            "wall_time": self.wall_time,
+            "stages": stages,
+            "bottleneck": max(stages, key=lambda stage: stages[stage]["utilization"]),
+            }
@@ -1,161 +1,282 @@
 import time
+import logging
 import threading
-import paho.mqtt.client as mqtt
 from compas_eve import Message
 from compas_eve import Publisher
 from compas_eve import Subscriber
-from compas_eve import Topic
-from compas_eve.mqtt import MqttTransport
+
+from message_bus import MessageBus
+from message_bus import topic
+from presence_tracker import PresenceTracker
+import configuration_codec
+import instrumentation
+import trajectory_preview
+
+logger = logging.getLogger(__name__)
+
 
 class ExecutorCommunicator(object):
     """Class for managing communication between the AR interface and the robot
     
     Parameters
-
-
+    broker : str
+        `host` or `host:port` of the MQTT broker, see :class:`MessageBus`.
+    directory_name : str
+        Top level directory of all topics.
+    quorum : str or int, optional
+        Confirmations needed before a step counts as confirmed: "all" users, "any" user, or a number of users.
+    user_ttl : float, optional
+        Seconds without a check-in after which a user is dropped.
+    compact : bool, optional
+        Send configurations in the compact binary format when every active user supports it.
+    compact_options : dict, optional
+        Options for :func:`configuration_codec.encode_configurations`.
+    transport : :class:`compas_eve.Transport`, optional
+        Transport to use instead of the shared :class:`MessageBus` to `broker`, e.g. an in-process broker.
 
     Attributes
-    
+    AR_users : dict
+        Active AR users by id.
+
+    The messages of the last step published are sent again to every user who joins, so a headset
+    that reconnects gets the configurations it is asked to confirm.
     
     """	
 
-    def __init__(self, broker, directory_name): 
-        self.tx = MqttTransport(broker)
+    ALL = "all"
+    ANY = "any"
+
+    DEFAULT_COMPACT_OPTIONS = {"quantize": True, "delta": True, "compress": True, "chunk_points": 256}
+
+    def __init__(self, broker, directory_name, quorum = ALL, user_ttl = 2.0, compact = False, compact_options = None, transport = None): 
+        self.tx = transport or MessageBus.shared(broker)
         self.topic_top_directory = directory_name
         
         self.AR_users = {}
-        self._users_to_add = []        
-        self._users_to_cull = []
-        self.print_flag = False
+        self.user_formats = {}
+        self.compact = compact
+        self.compact_options = compact_options or ExecutorCommunicator.DEFAULT_COMPACT_OPTIONS
+        self.quorum = quorum
+        self._confirmation_condition = threading.Condition()
+        self._step_messages = (None, [])
+        self.presence = PresenceTracker(user_ttl, on_join=self.add_user, on_leave=self.drop_user)
         self.initialize_mqtt()
 
     def remove_user(self, user_id):
-        self._users_to_cull.append(user_id)
+        self.presence.remove(user_id)
 
     def initialize_mqtt(self):
         """Initialize the MQTT transport and create the topics and publishers/subscribers"""	
 
         """create and subscribe to the user checkin topic, which is used to maintain a list of active users"""
-        self.user_checkin_topic = Topic("/{}/user_checkin_topic".format(self.topic_top_directory), Message)
-        user_checkin_subcriber = Subscriber(self.user_checkin_topic, callback = lambda msg: self.add_AR_user_id(msg.text), transport=self.tx)
-        print("subscribed to {}".format(self.user_checkin_topic.name))
+        self.user_checkin_topic = topic(self.topic_top_directory, "user_checkin_topic")
+        user_checkin_subcriber = Subscriber(self.user_checkin_topic, callback = lambda msg: self.check_in(msg), transport=self.tx)
+        logger.info("subscribed to %s", self.user_checkin_topic.name)
         user_checkin_subcriber.subscribe()
 
         """create the configuration topic, which is used to publish robot configurations the AR interface"""
-        configuration_topic = Topic("/{}/configuration_topic".format(self.topic_top_directory), Message)
+        configuration_topic = topic(self.topic_top_directory, "configuration_topic")
         self.configuration_publisher = Publisher(configuration_topic, transport=self.tx)
 
         """create the confirmation topic, which is used to get confirmations from the AR interface"""
-        confirmation_topic = Topic("/{}/confirmation_topic".format(self.topic_top_directory), Message)
+        confirmation_topic = topic(self.topic_top_directory, "confirmation_topic")
         self.confirmation_listener = Subscriber(confirmation_topic, callback = lambda msg: self.parse_confirmation(msg), transport=self.tx)
+        self.confirmation_listener.subscribe()
+
+        """create the interface topic, which is used to publish step data to the AR interface"""
+        interface_topic = topic(self.topic_top_directory, "interface_topic")
+        self.interface_publisher = Publisher(interface_topic, transport=self.tx)
 
         """create the command topic, which is used to publish to the robot"""	
-        command_topic = Topic("/{}/command_topic".format(self.topic_top_directory), Message)
+        command_topic = topic(self.topic_top_directory, "command_topic")
         self.command_publisher = Publisher(command_topic, transport=self.tx)
 
-        thread = threading.Thread(target=self.manage_users, args = (self.AR_users, self._users_to_add, self._users_to_cull), daemon=True)
-        thread.start()
+        self.presence.start()
+
+    def add_user(self, user_id):
+        with self._confirmation_condition:
+            self.AR_users[user_id] = ARUser(user_id)
+            self._confirmation_condition.notify_all()
+            step_index, messages = self._step_messages
+        logger.info("user %s added", user_id, extra={"user": user_id})
+        if messages:
+            logger.info("resending the configurations of step %s", step_index, extra={"user": user_id, "step": step_index})
+        for msg in messages:
+            self.publish(self.interface_publisher, msg, step_index)
+
+    def drop_user(self, user_id):
+        with self._confirmation_condition:
+            self.AR_users.pop(user_id, None)
+            self._confirmation_condition.notify_all()
+        self.user_formats.pop(user_id, None)
+        logger.info("user %s removed", user_id, extra={"user": user_id})
+
+    def check_in(self, message):
+        """Records a check-in and the configuration formats the user announced with it."""
+        with instrumentation.span("mqtt.receive", topic=self.user_checkin_topic.name, user=message.text):
+            self.user_formats[message.text] = message.data.get("formats", ["json"])
+            self.presence.check_in(message.text)
+
+    def compact_format_accepted(self):
+        users = list(self.AR_users)
+        return self.compact and len(users) > 0 and all(configuration_codec.FORMAT in self.user_formats.get(user, []) for user in users)
+
+    def publish(self, publisher, message, step = None):
+        with instrumentation.span("mqtt.publish", topic=publisher.topic.name, step=step):
+            publisher.publish(message)
 
-    def add_AR_user_id(self, user_id):
-        if user_id not in self.AR_users.keys():
-            print("adding {}".format(user_id))
-            self._users_to_add.append(user_id)
 
     def send_to_robot(self, command):
-        self.command_publisher.publish(Message(text=command))
+        self.publish(self.command_publisher, Message(text=command))
 
 
     def send_to_interface(self, user_id, message):
         msg = Message(text="{}: {}".format(user_id, message))
-        self.interface_publisher.publish(msg)
+        self.publish(self.interface_publisher, msg)
 
 
-    def manage_users(self, users, to_add, to_cull):
-        while True:
-            while len(to_add) > 0:
-                id = to_add.pop()
-                users[id] = ARUser(id, self)
-                print("User {} added".format(id))
-                self.print_flag = True 
-            for user in self.AR_users.values():
-                if user.active_flags["to_delete"]:
-                    to_cull.append(user.id)
-            while len(self._users_to_cull) > 0:
-                id = self._users_to_cull.pop()
-                print("User {} removed".format(id))
-                del users[id]
-                self.print_flag = True
+    def parse_confirmation(self, message):
+        user_id, step = message["user_id"], message["step"]
+        with instrumentation.span("mqtt.receive", topic=self.confirmation_listener.topic.name, user=user_id, step=step):
+            logger.debug("confirmation %s", message.data, extra={"user": user_id, "step": step})
+            with self._confirmation_condition:
+                user = self.AR_users.get(user_id)
+                if user:
+                    user.step_confirmations[step] = message["confirmation"]
+                    self._confirmation_condition.notify_all()
+                else:
+                    logger.warning("confirmation from unknown user %s", user_id, extra={"user": user_id, "step": step})
 
 
-    def parse_confirmation(self, message):
-        print("on topic {}, recieved message: {}".format(self.confirmation_listener.topic.name, message.text))
-        user = self.AR_users.get(message["user_id"])
-        if user:
-            user.step_confirmations[message["step"]] = message["confirmation"]
-        else:
-            print("user {} does not exist".format(message["user_id"]))
+    def confirmation_count(self, step_index):
+        """Returns the number of active users that confirmed `step_index`, and the number of active users."""
+        users = list(self.AR_users.values())
+        return sum(1 for user in users if user.step_confirmations.get(step_index) is True), len(users)
+
+
+    def is_confirmed(self, step_index, quorum = None):
+        confirmed, user_count = self.confirmation_count(step_index)
+        return quorum_reached(confirmed, user_count, quorum or self.quorum)
+
+
+    def wait_for_confirmation(self, step_index, quorum = None, timeout = None, cancelled = None):
+        """Blocks until `step_index` is confirmed by the quorum, without polling.
+
+        The waiting thread is woken by every confirmation, every user joining or leaving and
+        :meth:`wake_confirmation_waiters`. A wait whose `cancelled()` turns True ends there.
+
+        Returns
+        -------
+        bool
+            False if `timeout` seconds passed, or the wait was cancelled, without the quorum being reached.
+        """
+        with instrumentation.span("confirmation.wait", step=step_index) as span:
+            with self._confirmation_condition:
+                self._confirmation_condition.wait_for(lambda: self.is_confirmed(step_index, quorum) or (cancelled is not None and cancelled()), timeout)
+                confirmed = self.is_confirmed(step_index, quorum)
+            span.set(confirmed=confirmed)
+        return confirmed
+
+
+    def wake_confirmation_waiters(self):
+        """Wakes the waiting threads to check whether their wait was cancelled."""
+        with self._confirmation_condition:
+            self._confirmation_condition.notify_all()
 
 
     def test_messages(self, message, publisher):
         while True:
             publisher.publish(Message(text=message))
             time.sleep(0.1)
-            print("user count = {}".format(len(self.AR_users)))
-            for user in self.AR_users.values():
-                print("user {}: {}".format(user.id, user.message.text))
+            logger.info("user count = %d", len(self.AR_users))
             time.sleep(1.9)
 
 
+    def publish_step(self, step_index, messages):
+        """Asks every active user to confirm `step_index` again and publishes its `messages`, which users who join later get too."""
+        with self._confirmation_condition:
+            for user in self.AR_users.values():
+                user.step_confirmations[step_index] = False
+            self._step_messages = (step_index, messages)
+        for msg in messages:
+            self.publish(self.interface_publisher, msg, step_index)
+
+
     def send_configurations(self, step_index, configurations):
-        print("send_configurations method called")
         configurations["type"] = "configurations"
-        self.interface_publisher.publish(Message(configurations), retain=True)
-        for user in self.AR_users.values():
-            user.step_confirmations[step_index] = False
+        self.publish_step(step_index, [Message(configurations)])
+
+
+    def send_compact_configurations(self, step_index, configurations):
+        """Publishes `configurations` as chunks of the compact binary format."""
+        chunks = configuration_codec.encode_configurations(step_index, configurations, **self.compact_options)
+        self.publish_step(step_index, [
+            Message(type="configurations", step=step_index, encoding=configuration_codec.FORMAT, chunk=index, chunks=len(chunks), data=configuration_codec.to_text(chunk))
+            for index, chunk in enumerate(chunks)])
+
+
+    def stream_configurations(self, step_index, configurations, tolerance = 0.01, chunk_size = 100):
+        """Publishes a keyframe preview of the configurations first, then refines it in chunks.
+
+        The preview interpolates the full trajectory to within `tolerance` on every joint, so the AR
+        interface can show the motion before the rest arrives. Every message carries the point
+        indices it holds and the total `count`.
+        """
+        preview, refinements = trajectory_preview.preview_and_refinements(configurations, tolerance, chunk_size)
+        count = len(configurations)
+        messages = [Message(
+            type="configurations_preview", step=step_index, count=count, chunks=len(refinements),
+            indices=[index for index, _ in preview], configurations=[values for _, values in preview])]
+        for chunk_index, chunk in enumerate(refinements):
+            messages.append(Message(
+                type="configurations_refinement", step=step_index, count=count, chunk=chunk_index, chunks=len(refinements),
+                indices=[index for index, _ in chunk], configurations=[values for _, values in chunk]))
+        self.publish_step(step_index, messages)
+
+
+    def publish_configurations(self, step_index, configurations):
+        """Publishes the configurations of a step in the most compact format all active users accept."""
+        if self.compact_format_accepted():
+            self.send_compact_configurations(step_index, configurations)
+            return
+        configs = {"type": "configurations", "step": step_index}
+        for index, config in enumerate(configurations):
+            configs[index] = configuration_codec.configuration_values(config)
+        self.send_configurations(step_index, configs)
 
 
     def run(self):
-        print("running")
+        logger.info("running")
         thread = threading.Thread(target=self.test_messages, args=("master comms", self.interface_publisher), daemon=True)
         thread.start()
-        while True:
-            print("managing users")
-            self.manage_users()
-            if self.print_flag:
-                print("AR users: {}".format(self.AR_users.keys()))
-                self.print_flag = False
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            self.presence.stop()
+
+
+def quorum_reached(confirmed, user_count, quorum):
+    """Returns True if `confirmed` of `user_count` active users satisfy `quorum` ("all", "any" or a number)."""
+    if user_count == 0:
+        return False
+    if quorum == ExecutorCommunicator.ALL:
+        return confirmed == user_count
+    if quorum == ExecutorCommunicator.ANY:
+        return confirmed > 0
+    return confirmed >= int(quorum)
 
 
 class ARUser(object):
+    """An AR user seen by the presence tracker, with its confirmations by step index."""
     
-    def __init__(self, id, parent):
+    def __init__(self, id):
         self.id = id
-        self.parent = parent
         self.step_confirmations = {}
-        self.active_flags = {"is_active": True, "to_delete": False}
         self.message = None
-        self.maintain_user()
-
-
-    def confirm_active(self, message, active_flags):
-        if message.text == str(self.id):
-            active_flags["is_active"] = False
-
-
-    def checkin_thread(self, active_dict, interval = 2):
-        user_checkin_subcriber = Subscriber(self.parent.user_checkin_topic, callback=lambda msg: self.confirm_active(msg, active_dict), transport=self.parent.tx)
-        user_checkin_subcriber.subscribe()
-        while active_dict["is_active"]:
-            active_dict["is_active"] = False
-            time.sleep(interval)
-        active_dict["to_delete"] = True
-
-
-    def maintain_user(self, interval = 2):
-        thread = threading.Thread(target=self.checkin_thread, args=(self.active_flags, interval), daemon=True)
-        thread.start()
 
 
 if __name__ == "__main__":
-    ex_comm = ExecutorCommunicator()
-    ex_comm.run()
\ No newline at end of file
+    instrumentation.configure_logging()
+    ex_comm = ExecutorCommunicator(None, "T2_command_test")
+    ex_comm.run()
+
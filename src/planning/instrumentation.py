@@ -0,0 +1,200 @@
+"""Spans, latency histograms and structured logging for the planner, communicator and executor.
+
+A span times a block of code and carries attributes such as `step` and `user`, which correlate
+the spans of one step across components:
+
+    with instrumentation.span("confirmation.wait", step=step_index):
+        ...
+
+Every finished span is added to the histogram of its name. When the ring buffer is enabled, the
+last spans are also kept with their attributes, for :func:`export`. Both can be switched on and
+off at runtime; a disabled tracer returns a shared no-op span, so instrumented hot loops only pay
+for one attribute check.
+"""
+import collections
+import json
+import logging
+import threading
+import time
+
+
+class Histogram(object):
+    """Latency histogram with buckets growing by a factor of 2 from 1 microsecond."""
+
+    BUCKETS = 40
+
+    def __init__(self):
+        self.counts = [0] * Histogram.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = int(seconds * 1e6)
+        self.counts[min(micros.bit_length(), Histogram.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Returns the upper bound in seconds of the bucket holding the `q` percentile."""
+        if self.count == 0:
+            return None
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": 1000 * self.total / self.count if self.count else None,
+            "p50_ms": 1000 * self.percentile(50) if self.count else None,
+            "p99_ms": 1000 * self.percentile(99) if self.count else None,
+            "max_ms": 1000 * self.max if self.count else None,
+            }
+
+
+class Span(object):
+
+    __slots__ = ("tracer", "name", "attributes", "start", "wall_start")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.finish(self, duration)
+        return False
+
+
+class _NoSpan(object):
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class Tracer(object):
+    """Collects spans into histograms and, optionally, a ring buffer of the most recent ones."""
+
+    def __init__(self, enabled = True, ring_buffer_size = 0):
+        self.enabled = enabled
+        self.histograms = collections.defaultdict(Histogram)
+        self.ring_buffer = collections.deque(maxlen=ring_buffer_size) if ring_buffer_size else None
+        self._lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return NO_SPAN
+        return Span(self, name, attributes)
+
+    def finish(self, span, duration):
+        with self._lock:
+            self.histograms[span.name].record(duration)
+            if self.ring_buffer is not None:
+                self.ring_buffer.append({
+                    "name": span.name,
+                    "start": span.wall_start,
+                    "duration": duration,
+                    "thread": threading.current_thread().name,
+                    "attributes": span.attributes,
+                    })
+
+    def enable_ring_buffer(self, size = 10000):
+        with self._lock:
+            self.ring_buffer = collections.deque(self.ring_buffer or (), maxlen=size)
+
+    def disable_ring_buffer(self):
+        with self._lock:
+            self.ring_buffer = None
+
+    def export(self, clear = False):
+        """Returns the spans in the ring buffer, oldest first."""
+        with self._lock:
+            spans = list(self.ring_buffer or ())
+            if clear and self.ring_buffer is not None:
+                self.ring_buffer.clear()
+        return spans
+
+    def summary(self):
+        """Returns the histogram summary of every span name."""
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            if self.ring_buffer is not None:
+                self.ring_buffer.clear()
+
+
+tracer = Tracer()
+
+
+def span(name, **attributes):
+    return tracer.span(name, **attributes)
+
+
+def enable(enabled = True):
+    tracer.enabled = enabled
+
+
+def enable_ring_buffer(size = 10000):
+    tracer.enable_ring_buffer(size)
+
+
+def disable_ring_buffer():
+    tracer.disable_ring_buffer()
+
+
+def export(clear = False):
+    return tracer.export(clear)
+
+
+def summary():
+    return tracer.summary()
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records as JSON lines holding the message and the fields passed in `extra`."""
+
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {"time": record.created, "level": record.levelname, "logger": record.name, "message": record.getMessage()}
+        entry.update((key, value) for key, value in vars(record).items() if key not in StructuredFormatter.RESERVED)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level = logging.INFO, structured = False):
+    """Sends the log of every component to stderr, as text or, if `structured`, as JSON lines."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter() if structured else logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
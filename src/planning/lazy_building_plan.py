@@ -0,0 +1,383 @@
+"""Lazy, memory-mapped loading of building plan files.
+
+The file is scanned once for the byte spans of every step, beam, joint and graph node. The spans
+are kept in a sidecar index (`<file>.index.json`), which is reused while the file's size and
+modification time are unchanged. Elements are deserialized from the memory map the first time
+they are accessed, and then cached, so changes such as `steps[i]["is_built"] = "true"` persist.
+
+Steps are loaded as the plain data of their JSON, so they are indexed the same way
+(`step["actor"] == "ROBOT"`) whichever compas_timber version wrote or reads the plan.
+"""
+import os
+import re
+import json
+import mmap
+
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"')
+_STRUCTURE = re.compile(rb'[\[\]{}"]')
+_WHITESPACE = re.compile(rb'[ \t\r\n]*')
+
+"""paths whose children are indexed, or whose value is recorded as a whole"""
+INDEXED = {
+    ("beams",): "children",
+    ("joints",): "children",
+    ("building_plan", "data", "steps"): "children",
+    ("assembly", "graph", "node"): "children",
+    ("assembly", "graph", "edge"): "value",
+    ("assembly", "attributes"): "value",
+    ("building_plan", "dtype"): "value",
+    ("building_plan", "guid"): "value",
+    }
+
+
+def compas_decode(text):
+    """Deserializes compas JSON. Imported here so the index can be built without compas installed."""
+    from compas.data import json_loads
+    return json_loads(text)
+
+
+def step_data(text):
+    """Returns the data dict of a serialized building plan step."""
+    step = json.loads(text)
+    return step["data"] if "dtype" in step and "data" in step else step
+
+
+class _Scanner(object):
+    """Records the spans of the values at the `INDEXED` paths without deserializing anything else."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.spans = {}
+
+    def skip_whitespace(self, position):
+        return _WHITESPACE.match(self.buffer, position).end()
+
+    def skip_value(self, position):
+        """Returns the end of the value starting at `position`."""
+        first = self.buffer[position:position + 1]
+        if first == b'"':
+            return _STRING.match(self.buffer, position).end()
+        if first not in (b"{", b"["):
+            end = position
+            while self.buffer[end:end + 1] not in (b",", b"}", b"]", b"") and not self.buffer[end:end + 1].isspace():
+                end += 1
+            return end
+        depth = 0
+        match = _STRUCTURE.search(self.buffer, position)
+        while match:
+            token = match.group()
+            if token == b'"':
+                match = _STRUCTURE.search(self.buffer, _STRING.match(self.buffer, match.start()).end())
+                continue
+            depth += 1 if token in (b"{", b"[") else -1
+            if depth == 0:
+                return match.end()
+            match = _STRUCTURE.search(self.buffer, match.end())
+        raise ValueError("unterminated value at byte {}".format(position))
+
+    def wanted(self, path):
+        """Returns what to do with the value at `path`: descend, index its children, record it, or skip it."""
+        if path in INDEXED:
+            return INDEXED[path]
+        if any(indexed[:len(path)] == path for indexed in INDEXED):
+            return "descend"
+        return None
+
+    def scan(self, position = 0, path = (), record_children = False):
+        position = self.skip_whitespace(position)
+        opening = self.buffer[position:position + 1]
+        closing = b"}" if opening == b"{" else b"]"
+        position = self.skip_whitespace(position + 1)
+        index = 0
+        while self.buffer[position:position + 1] != closing:
+            if opening == b"{":
+                end = _STRING.match(self.buffer, position).end()
+                key = json.loads(self.buffer[position:end].decode("utf-8"))
+                position = self.skip_whitespace(end)
+                position = self.skip_whitespace(position + 1)    # the colon
+            else:
+                key = index
+            child_path = path + (key,)
+            action = None if record_children else self.wanted(child_path)
+            if action in ("descend", "children") and self.buffer[position:position + 1] in (b"{", b"["):
+                end = self.scan(position, child_path, record_children=(action == "children"))
+            else:
+                end = self.skip_value(position)
+                if record_children:
+                    self.spans.setdefault(path, {})[key] = (position, end)
+                elif action == "value":
+                    self.spans[child_path] = (position, end)
+            position = self.skip_whitespace(end)
+            if self.buffer[position:position + 1] == b",":
+                position = self.skip_whitespace(position + 1)
+            index += 1
+        return position + 1
+
+
+class _LazyElements(object):
+    """Deserializes the indexed elements of one container on first access."""
+
+    def __init__(self, document, spans, decode = None):
+        self._document = document
+        self._spans = spans
+        self._decode = decode or document.decode
+        self._loaded = {}
+
+    def _load(self, key):
+        if key not in self._loaded:
+            start, end = self._spans[key]
+            self._loaded[key] = self._decode(self._document.buffer[start:end].decode("utf-8"))
+        return self._loaded[key]
+
+    def __len__(self):
+        return len(self._spans)
+
+
+class LazyMapping(_LazyElements):
+    """Read access to a JSON object by key; integer keys are looked up as their string form."""
+
+    def __getitem__(self, key):
+        return self._load(str(key))
+
+    def __contains__(self, key):
+        return str(key) in self._spans
+
+    def __iter__(self):
+        return iter(self._spans)
+
+    def keys(self):
+        return self._spans.keys()
+
+    def values(self):
+        return (self[key] for key in self._spans)
+
+    def items(self):
+        return ((key, self[key]) for key in self._spans)
+
+    def get(self, key, default = None):
+        return self[key] if key in self else default
+
+
+class LazySequence(_LazyElements):
+    """Read access to a JSON list by index."""
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self._spans)
+        if index not in self._spans:
+            raise IndexError(index)
+        return self._load(index)
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self._spans)))
+
+
+class LazyGraph(object):
+    """The parts of the assembly graph the planner uses: adjacency from the edges, and nodes on demand."""
+
+    def __init__(self, edges, nodes):
+        self.edge = edges
+        self.node = nodes
+        self._adjacency = {}
+        for u, targets in edges.items():
+            for v in targets:
+                self._adjacency.setdefault(int(u), set()).add(int(v))
+                self._adjacency.setdefault(int(v), set()).add(int(u))
+
+    def neighbors(self, key):
+        return sorted(self._adjacency.get(int(key), ()))
+
+    def nodes(self):
+        return (int(key) for key in self.node)
+
+    def node_attribute(self, key, name):
+        return self.node[key][name]
+
+
+class LazyAssembly(object):
+
+    def __init__(self, document):
+        self.attributes = document.value(("assembly", "attributes"))
+        self.graph = LazyGraph(document.value(("assembly", "graph", "edge"), json.loads), document.elements(("assembly", "graph", "node")))
+        self.beams = document.elements(("beams",))
+        self.joints = document.elements(("joints",))
+
+
+class LazyBuildingPlan(object):
+
+    def __init__(self, document):
+        self.steps = document.elements(("building_plan", "data", "steps"), step_data)
+        self.guid = document.value(("building_plan", "guid"))
+
+
+class LazyDocument(object):
+    """A memory-mapped building plan file with its span index.
+
+    Parameters
+    ----------
+    path : str
+    decode : callable, optional
+        Turns the JSON text of an element into an object. Defaults to compas deserialization,
+        which yields the same objects as loading the whole file with `compas.data.json_load`.
+    use_index_file : bool, optional
+        Read and write the sidecar index.
+
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(self, path, decode = None, use_index_file = True):
+        self.path = path
+        self.decode = decode or compas_decode
+        self._file = open(path, "rb")
+        self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.spans = self._read_index() if use_index_file else None
+        if self.spans is None:
+            scanner = _Scanner(self.buffer)
+            scanner.scan()
+            self.spans = scanner.spans
+            if use_index_file:
+                self._write_index()
+
+    def _signature(self):
+        stat = os.stat(self.path)
+        return [LazyDocument.INDEX_VERSION, stat.st_size, stat.st_mtime]
+
+    def _read_index(self):
+        try:
+            with open(self.path + ".index.json") as f:
+                index = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if index.get("signature") != self._signature():
+            return None
+        spans = {}
+        for entry in index["spans"]:
+            path = tuple(entry["path"])
+            if entry["children"] is None:
+                spans[path] = tuple(entry["span"])
+            else:
+                spans[path] = {(int(k) if entry["list"] else k): tuple(v) for k, v in entry["children"]}
+        return spans
+
+    def _write_index(self):
+        entries = []
+        for path, value in self.spans.items():
+            if isinstance(value, dict):
+                is_list = all(isinstance(k, int) for k in value)
+                entries.append({"path": list(path), "children": [[k, v] for k, v in value.items()], "list": is_list, "span": None})
+            else:
+                entries.append({"path": list(path), "children": None, "list": False, "span": value})
+        try:
+            with open(self.path + ".index.json", "w") as f:
+                json.dump({"signature": self._signature(), "spans": entries}, f)
+        except (IOError, OSError):
+            pass
+
+    def value(self, path, decode = None):
+        if path not in self.spans:
+            return None
+        start, end = self.spans[path]
+        return (decode or self.decode)(self.buffer[start:end].decode("utf-8"))
+
+    def elements(self, path, decode = None):
+        spans = self.spans.get(path, {})
+        if spans and all(isinstance(key, int) for key in spans):
+            return LazySequence(self, spans, decode)
+        return LazyMapping(self, spans, decode)
+
+    def close(self):
+        self.buffer.close()
+        self._file.close()
+
+
+def load_lazy(path, decode = None, use_index_file = True):
+    """Opens a building plan file lazily.
+
+    Returns
+    -------
+    dict
+        `assembly`, `beams`, `joints` and `building_plan`, like the eagerly loaded file. Steps are
+        reached through `building_plan.steps` and beams through `assembly.beams`.
+    """
+    document = LazyDocument(path, decode, use_index_file)
+    assembly = LazyAssembly(document)
+    return {
+        "assembly": assembly,
+        "beams": assembly.beams,
+        "joints": assembly.joints,
+        "building_plan": LazyBuildingPlan(document),
+        "document": document,
+        }
+
+
+if __name__ == "__main__":
+    """report cold start time and memory of the lazy loader against json.load, on the example scaled up"""
+    import sys
+    import time
+    import resource
+    import tempfile
+    import subprocess
+
+    def peak_rss_kb():
+        """VmHWM is reset by exec, unlike ru_maxrss on Linux, which a child inherits from its parent"""
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1])
+        except IOError:
+            pass
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if len(sys.argv) > 2 and sys.argv[1] == "--measure":
+        mode, path = sys.argv[2], sys.argv[3]
+        start = time.perf_counter()
+        if mode == "eager":
+            with open(path) as f:
+                data = json.load(f)
+            step = data["building_plan"]["data"]["steps"][len(data["building_plan"]["data"]["steps"]) // 2]
+        else:
+            data = load_lazy(path, decode=json.loads, use_index_file=(mode == "indexed"))
+            steps = data["building_plan"].steps
+            step = steps[len(steps) // 2]
+            beam = data["assembly"].beams[step["element_ids"][0]]
+        elapsed = time.perf_counter() - start
+        print(json.dumps({"seconds": elapsed, "max_rss_kb": peak_rss_kb()}))
+        sys.exit(0)
+
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "examples", "building_plan.json")
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with open(source) as f:
+        plan = json.load(f)
+    beams, joints, steps = plan["beams"], plan["joints"], plan["building_plan"]["data"]["steps"]
+    nodes = plan["assembly"]["graph"]["node"]
+    count = len(beams) + len(joints)
+    scaled_beams, scaled_joints, scaled_nodes, scaled_steps = {}, {}, {}, []
+    for copy in range(scale):
+        offset = copy * count
+        for key, beam in beams.items():
+            scaled_beams[str(int(key) + offset)] = beam
+            scaled_nodes[str(int(key) + offset)] = nodes[key]
+        for key, joint in joints.items():
+            scaled_joints[str(int(key) + offset)] = joint
+            scaled_nodes[str(int(key) + offset)] = nodes[key]
+        for step in steps:
+            step = json.loads(json.dumps(step))
+            step["data"]["element_ids"] = [e + offset for e in step["data"]["element_ids"]]
+            scaled_steps.append(step)
+    plan["beams"], plan["joints"], plan["building_plan"]["data"]["steps"] = scaled_beams, scaled_joints, scaled_steps
+    plan["assembly"]["graph"]["node"] = scaled_nodes
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "building_plan.json")
+    with open(path, "w") as f:
+        json.dump(plan, f, indent=4)
+    print("{} beams, {} steps, {:.1f} MB".format(len(scaled_beams), len(scaled_steps), os.path.getsize(path) / 1e6))
+    print("{:<34}{:>12}{:>16}".format("loader", "seconds", "max RSS [MB]"))
+    LazyDocument(path, json.loads).close()
+    for mode, label in (("eager", "json.load"), ("scan", "lazy, building the index"), ("indexed", "lazy, reusing the index")):
+        """each mode runs in a fresh process so RSS is not shared"""
+        output = subprocess.check_output([sys.executable, __file__, "--measure", mode, path])
+        result = json.loads(output)
+        print("{:<34}{:>12.3f}{:>16.1f}".format(label, result["seconds"], result["max_rss_kb"] / 1024.0))
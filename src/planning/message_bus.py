@@ -0,0 +1,325 @@
+import logging
+import os
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from compas.data import json_loads
+from compas_eve import Message
+from compas_eve import Topic
+from compas_eve import Transport
+
+from instrumentation import Histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROKER = "broker.hivemq.com"
+
+"""quality of service levels of MQTT"""
+AT_MOST_ONCE = 0
+AT_LEAST_ONCE = 1
+EXACTLY_ONCE = 2
+
+
+def topic(directory, name, *levels, message_type = Message):
+    """Returns the topic `/<directory>/<name>/<levels...>` of the T2 topic tree."""
+    return Topic("/".join(["", directory, name] + [str(level) for level in levels]), message_type)
+
+
+def broker_address(broker = None):
+    """Returns the host and port of `broker`, a `host` or `host:port`, or of `$T2_MQTT_BROKER` if it is None."""
+    broker = broker or os.environ.get("T2_MQTT_BROKER") or DEFAULT_BROKER
+    host, _, port = broker.partition(":")
+    return host, int(port) if port else 1883
+
+
+class TopicTrie(object):
+    """Topic filters in a trie of their levels, matched against topic names with the MQTT wildcards `+` and `#`.
+
+    Matching a topic walks one path per wildcard branch, so its cost depends on the depth of the
+    topic and not on the number of filters.
+    """
+
+    def __init__(self):
+        self.root = {}              # level -> node; a node holds its children and its values under None
+
+    def insert(self, topic_filter, value):
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.setdefault(level, {})
+        node.setdefault(None, []).append(value)
+
+    def remove(self, topic_filter, value):
+        """Removes `value` from `topic_filter`, and returns True if the filter has no values left."""
+        path = [self.root]
+        for level in topic_filter.split("/"):
+            node = path[-1].get(level)
+            if node is None:
+                return True
+            path.append(node)
+        values = path[-1].get(None, [])
+        if value in values:
+            values.remove(value)
+        if values:
+            return False
+        path[-1].pop(None, None)
+        for level, (parent, node) in zip(reversed(topic_filter.split("/")), reversed(list(zip(path, path[1:])))):
+            if node:
+                break
+            del parent[level]
+        return True
+
+    def match(self, topic_name):
+        """Returns the `(filter, value)` pairs of every filter matching `topic_name`."""
+        matches = []
+        levels = topic_name.split("/")
+
+        def walk(node, index, path):
+            if "#" in node and not (index == 0 and levels[0].startswith("$")):
+                matches.extend(("/".join(path + ["#"]), value) for value in node["#"].get(None, ()))
+            if index == len(levels):
+                matches.extend(("/".join(path), value) for value in node.get(None, ()))
+                return
+            if levels[index] in node:
+                walk(node[levels[index]], index + 1, path + [levels[index]])
+            if "+" in node and not (index == 0 and levels[0].startswith("$")):
+                walk(node["+"], index + 1, path + ["+"])
+
+        walk(self.root, 0, [])
+        return matches
+
+
+class MessageBus(Transport):
+    """Process-wide MQTT connection shared by every publisher and subscriber, with per-topic QoS and metrics.
+
+    A compas_eve transport, so :class:`Publisher` and :class:`Subscriber` work over it unchanged.
+    Subscriptions are kept in a :class:`TopicTrie`: the broker gets one subscription per distinct
+    filter, however many callbacks it has, and every incoming message is dispatched to the
+    callbacks of all filters matching its topic, on the network thread of the connection.
+
+    The QoS of a topic is the one of its most specific rule in `qos_rules`, matched like a
+    subscription. Messages published before the connection is up are held and sent once it is,
+    and subscriptions are renewed on every reconnect.
+
+    Published messages carry their send time as an MQTT 5 user property, which gives the lag of
+    every message received from another `MessageBus`; the payload stays plain compas JSON.
+
+    Parameters
+    ----------
+    broker : str, optional
+        `host` or `host:port`; defaults to `$T2_MQTT_BROKER`, then to the public HiveMQ broker.
+    qos_rules : dict, optional
+        QoS by topic filter, replacing `DEFAULT_QOS_RULES`.
+    protocol : int, optional
+        `paho.mqtt.client.MQTTv5`, or `MQTTv311` for brokers without MQTT 5, which leaves lag unmeasured.
+
+    """
+
+    DEFAULT_QOS_RULES = {
+        "#": AT_MOST_ONCE,
+        "/+/user_checkin_topic": AT_MOST_ONCE,          # missed check-ins are covered by the next one
+        "/+/user_data_topic/+": AT_MOST_ONCE,
+        "/+/interface_topic": AT_LEAST_ONCE,            # configurations are keyed by step and chunk, so duplicates are harmless
+        "/+/configuration_topic": AT_LEAST_ONCE,
+        "/+/confirmation_topic": AT_LEAST_ONCE,
+        "/+/command_topic": EXACTLY_ONCE,               # a gripper command must neither be lost nor repeated
+        }
+
+    SENT_PROPERTY = "sent"
+
+    _pool = {}
+    _pool_lock = threading.Lock()
+
+    def __init__(self, broker = None, qos_rules = None, protocol = mqtt.MQTTv5):
+        super(MessageBus, self).__init__()
+        self.host, self.port = broker_address(broker)
+        self.qos_rules = TopicTrie()
+        for topic_filter, qos in (qos_rules or MessageBus.DEFAULT_QOS_RULES).items():
+            self.qos_rules.insert(topic_filter, qos)
+        self.subscriptions = TopicTrie()
+        self._filters = {}          # topic filter -> number of callbacks
+        self._subscribe_ids = {}    # subscribe id -> (topic filter, entry)
+        self._pending = []          # (topic name, payload, qos) published before connecting
+        self._connected = False
+        self._lock = threading.RLock()
+        self._ids = 0
+        self._start = time.monotonic()
+        self._metrics = {}          # topic name -> counters and lag histogram
+        self._last_rates = (self._start, {})
+
+        self.protocol = protocol
+        self.client = mqtt.Client(protocol=protocol)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+        self.client.connect_async(self.host, self.port, 60)
+        self.client.loop_start()
+        logger.info("connecting to %s:%d", self.host, self.port)
+
+
+    @classmethod
+    def shared(cls, broker = None):
+        """Returns the bus of this process for `broker`, connecting on first use."""
+        address = broker_address(broker)
+        with cls._pool_lock:
+            if address not in cls._pool:
+                cls._pool[address] = cls("{}:{}".format(*address))
+            return cls._pool[address]
+
+
+    def qos(self, topic_name):
+        """Returns the QoS of the most specific rule matching `topic_name`: the one with the most literal levels."""
+        rules = self.qos_rules.match(topic_name)
+        if not rules:
+            return AT_MOST_ONCE
+        return max(rules, key=lambda rule: sum(1 for level in rule[0].split("/") if level not in ("+", "#")))[1]
+
+
+    def _counters(self, topic_name):
+        if topic_name not in self._metrics:
+            self._metrics[topic_name] = {"published": 0, "received": 0, "bytes_out": 0, "bytes_in": 0, "lag": Histogram()}
+        return self._metrics[topic_name]
+
+
+    def publish(self, topic, message):
+        """Publishes `message` serialized by its topic, as compas_eve's own transports do."""
+        payload = topic._message_to_json(message)
+        qos = self.qos(topic.name)
+        with self._lock:
+            counters = self._counters(topic.name)
+            counters["published"] += 1
+            counters["bytes_out"] += len(payload)
+            if not self._connected:
+                self._pending.append((topic.name, payload, qos))
+                return
+        self._send(topic.name, payload, qos)
+
+
+    def _send(self, topic_name, payload, qos):
+        if self.protocol != mqtt.MQTTv5:
+            self.client.publish(topic_name, payload, qos=qos)
+            return
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.UserProperty = (MessageBus.SENT_PROPERTY, repr(time.time()))
+        self.client.publish(topic_name, payload, qos=qos, properties=properties)
+
+
+    def subscribe(self, topic, callback):
+        with self._lock:
+            self._ids += 1
+            subscribe_id = "{}:{}".format(topic.name, self._ids)
+            entry = (subscribe_id, topic, callback)
+            self.subscriptions.insert(topic.name, entry)
+            self._subscribe_ids[subscribe_id] = (topic.name, entry)
+            self._filters[topic.name] = self._filters.get(topic.name, 0) + 1
+            if self._filters[topic.name] == 1 and self._connected:
+                self.client.subscribe(topic.name, qos=self.qos(topic.name))
+        return subscribe_id
+
+
+    def unsubscribe_by_id(self, subscribe_id):
+        """Removes the callback subscribed as `subscribe_id`, and the broker subscription with the last callback of its filter."""
+        with self._lock:
+            if subscribe_id not in self._subscribe_ids:
+                return
+            topic_filter, entry = self._subscribe_ids.pop(subscribe_id)
+            self.subscriptions.remove(topic_filter, entry)
+            self._filters[topic_filter] -= 1
+            if self._filters[topic_filter] == 0:
+                del self._filters[topic_filter]
+                if self._connected:
+                    self.client.unsubscribe(topic_filter)
+
+
+    def unsubscribe(self, topic):
+        """Removes every callback subscribed to `topic`."""
+        with self._lock:
+            subscribe_ids = [subscribe_id for subscribe_id, (topic_filter, _) in self._subscribe_ids.items() if topic_filter == topic.name]
+        for subscribe_id in subscribe_ids:
+            self.unsubscribe_by_id(subscribe_id)
+
+
+    def advertise(self, topic):
+        with self._lock:
+            self._ids += 1
+            return "{}:{}".format(topic.name, self._ids)
+
+
+    def unadvertise(self, topic):
+        pass
+
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties = None):
+        if reason_code != 0:
+            logger.warning("connection to %s:%d refused (%s)", self.host, self.port, reason_code)
+            return
+        with self._lock:
+            self._connected = True
+            for topic_filter in self._filters:
+                client.subscribe(topic_filter, qos=self.qos(topic_filter))
+            pending, self._pending = self._pending, []
+        for topic_name, payload, qos in pending:
+            self._send(topic_name, payload, qos)
+        logger.info("connected to %s:%d, %d subscriptions, %d held messages sent", self.host, self.port, len(self._filters), len(pending))
+
+
+    def _on_disconnect(self, client, userdata, reason_code = None, properties = None):
+        with self._lock:
+            self._connected = False
+        logger.warning("disconnected from %s:%d (%s)", self.host, self.port, reason_code)
+
+
+    def _on_message(self, client, userdata, msg):
+        received = time.time()
+        with self._lock:
+            counters = self._counters(msg.topic)
+            counters["received"] += 1
+            counters["bytes_in"] += len(msg.payload)
+            for name, value in getattr(getattr(msg, "properties", None), "UserProperty", None) or ():
+                if name == MessageBus.SENT_PROPERTY:
+                    counters["lag"].record(max(0.0, received - float(value)))
+            entries = [entry for _, entry in self.subscriptions.match(msg.topic)]
+        data = json_loads(msg.payload.decode("utf-8"))
+        for _, topic, callback in entries:
+            try:
+                callback(topic.message_type.parse(data))
+            except Exception:
+                """a failing callback does not stop delivery to the others"""
+                logger.exception("callback on %s failed", msg.topic)
+
+
+    def metrics(self):
+        """Returns the message counts, rates since the previous call and lag of every topic seen.
+
+        Lag is measured from the send time stamped by the publishing bus, so across machines it
+        includes their clock offset.
+        """
+        now = time.monotonic()
+        with self._lock:
+            since, last = self._last_rates
+            interval = now - since
+            topics = {}
+            for name, counters in sorted(self._metrics.items()):
+                published, received = last.get(name, (0, 0))
+                topics[name] = {
+                    "qos": self.qos(name),
+                    "published": counters["published"],
+                    "received": counters["received"],
+                    "bytes_out": counters["bytes_out"],
+                    "bytes_in": counters["bytes_in"],
+                    "publish_rate": (counters["published"] - published) / interval if interval > 0 else 0.0,
+                    "receive_rate": (counters["received"] - received) / interval if interval > 0 else 0.0,
+                    "lag": counters["lag"].summary(),
+                    }
+            self._last_rates = (now, {name: (c["published"], c["received"]) for name, c in self._metrics.items()})
+            return {"broker": "{}:{}".format(self.host, self.port), "connected": self._connected, "uptime": now - self._start, "interval": interval, "topics": topics}
+
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+        with MessageBus._pool_lock:
+            if MessageBus._pool.get((self.host, self.port)) is self:
+                del MessageBus._pool[(self.host, self.port)]
@@ -0,0 +1,368 @@
+import bisect
+import logging
+import threading
+
+import numpy as np
+from compas_fab.robots import Robot
+
+from scene_store import SceneStore
+from step_dependencies import StepDependencies
+from timber_assembly_planner import TimberAssemblyPlanner
+from trajectory_blending import TrajectoryBlender
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduleConflictError(Exception):
+    """Raised when running a schedule in which the arms would come too close."""
+
+
+class ScheduledMotion(object):
+    """One trajectory of a step, placed on the timeline of the arm that runs it.
+
+    `after` holds the ids of the motions that must finish before this one starts: the previous
+    motion of the same arm, the placement of the previous beam, and the motions of the other arm
+    it would come too close to.
+    """
+
+    def __init__(self, id, arm, step, phase, index, trajectory, duration):
+        self.id = id
+        self.arm = arm
+        self.step = step
+        self.phase = phase
+        self.index = index
+        self.trajectory = trajectory
+        self.duration = duration
+        self.start = 0.0
+        self.after = []
+        self.times = None           # time of every trajectory point, from the start of the motion
+        self.links = None           # (points, links, 3) origins of the links the arm moves, the tool last
+        self.carry = 0.0            # half length of the beam held during the motion
+        self.carry_after = 0.0      # half length of the beam held once the motion is done
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+
+class MultiRobotPlanner(object):
+    """Assigns the ROBOT steps to both arms, plans each arm in parallel and schedules their motions.
+
+    Each arm has its own :class:`TimberAssemblyPlanner` and planner client, and plans with the
+    other arm waiting at its home, so MoveIt checks every motion against the idle other arm. The
+    scheduler then checks motions against the other arm's time-parameterized motions: the origins
+    of every link either arm moves, carriage, column and arm links as well as the tool, are
+    compared along the timeline, with the half length of a held beam added to `clearance` around
+    the tool that holds it, and a motion that would come too close waits for the other one. Beams
+    are placed in building plan order, so every arm plans against the scene it will find.
+
+    :meth:`measure_single_arm` plans the same steps for one arm alone, which gives the makespan
+    the schedule is compared against in :meth:`report`.
+
+    A motion can only wait for motions already on the timeline. If it comes too close to the other
+    arm parked after its last scheduled motion, waiting does not help: the conflict is recorded in
+    `conflicts` and the schedule must not be run. A step neither arm can plan ends the schedule
+    before it, since every later beam is placed on the assumption that it was built.
+
+    Parameters
+    ----------
+    robot : :class:`compas_fab.robots.Robot`
+    assembly : :class:`compas_timber.assembly.TimberAssembly`
+    building_plan : :class:`compas_timber.planning.BuildingPlan`
+    pickup_base_frames : dict
+        Pickup frame of each arm, by arm name.
+    clients : dict
+        Planner client of each arm, by arm name.
+    groups : dict, optional
+        Planning group of each arm, by default `<arm>_eaXYZ`.
+    clearance : float, optional
+        Minimum distance between any link origins of the two arms.
+    time_step : float, optional
+        Seconds between the samples of the collision check.
+    balance : int, optional
+        An arm gets a step nearer to it only while it has at most this many steps more than the other.
+
+    """
+
+    ARMS = ("robot11", "robot12")
+    PHASES = ("pickup", "move", "retract")
+
+    def __init__(self, robot, assembly, building_plan, pickup_base_frames, clients, scene_objects = None, groups = None, planner_id = None, cache = None, clearance = 0.5, time_step = 0.1, balance = 1):
+        self.assembly = assembly
+        self.building_plan = building_plan
+        self.clearance = clearance
+        self.time_step = time_step
+        self.balance = balance
+        self.scene_store = SceneStore(assembly, building_plan)
+        self.dependencies = StepDependencies(assembly, scene_store = self.scene_store)
+        groups = groups or {arm: "{}_eaXYZ".format(arm) for arm in MultiRobotPlanner.ARMS}
+        self.planners = {}
+        for arm in MultiRobotPlanner.ARMS:
+            arm_robot = Robot(robot.model, semantics=robot.semantics, client=clients[arm])
+            self.planners[arm] = TimberAssemblyPlanner(arm_robot, assembly, building_plan, pickup_base_frames[arm], scene_objects, groups[arm], planner_id, cache, self.scene_store, arm=arm, dual_arm=True, dependencies=self.dependencies)
+        self.assignment = {}        # step index -> arm
+        self.robot_steps = {}       # step index -> trajectories by phase
+        self.blended_steps = {}     # step index -> trajectories by phase, each phase blended into one where faster
+        self.schedule = []
+        self.collision_waits = 0
+        self.conflicts = []         # (motion id, id of the parked motion of the other arm it comes too close to)
+        self.failures = {}          # step index -> why neither arm could plan it
+        self.blend_options = None   # tolerances the steps were blended with
+        self.single_arm_makespan = None
+
+
+    def other_arm(self, arm):
+        return [other for other in MultiRobotPlanner.ARMS if other != arm][0]
+
+
+    def link_origins(self, arm, full_values):
+        """Returns the `(N, links, 3)` origins of the links `arm` moves and does not share with the other arm."""
+        planner = self.planners[arm]
+        other = self.planners[self.other_arm(arm)]
+        return planner.kinematics.link_origins(full_values, planner.group, moving_only=True, shared_with=other.group)
+
+
+    @property
+    def unresolved_conflicts(self):
+        return len(self.conflicts)
+
+
+    def home_position(self, arm):
+        planner = self.planners[arm]
+        return planner.robot.forward_kinematics(planner.safe_configuation, planner.group).point
+
+
+    def home_links(self, arm):
+        planner = self.planners[arm]
+        return self.link_origins(arm, np.array(planner.safe_configuation.joint_values))[0]
+
+
+    def assign_steps(self):
+        """Gives every ROBOT step to the arm whose home is nearer to its beam, keeping the arms balanced."""
+        homes = {arm: self.home_position(arm) for arm in MultiRobotPlanner.ARMS}
+        counts = {arm: 0 for arm in MultiRobotPlanner.ARMS}
+        self.assignment = {}
+        for index in range(len(self.building_plan.steps)):
+            step = self.building_plan.steps[index]
+            if step["actor"] != "ROBOT":
+                continue
+            midpoint = self.assembly.beams[step["element_ids"][0]].midpoint
+            nearest, other = sorted(MultiRobotPlanner.ARMS, key=lambda arm: midpoint.distance_to_point(homes[arm]))
+            arm = nearest if counts[nearest] - counts[other] <= self.balance else other
+            self.assignment[index] = arm
+            counts[arm] += 1
+        return self.assignment
+
+
+    def plan(self):
+        """Plans the steps of both arms in parallel, then plans the steps an arm failed on with the other arm."""
+        if not self.assignment:
+            self.assign_steps()
+        if self.planners["robot11"].cache:
+            self.planners["robot11"].cache.begin_session()
+        failed = []
+        self.failures = {}
+        self.blended_steps = {}
+        lock = threading.Lock()
+
+        def work(arm):
+            planner = self.planners[arm]
+            for index in sorted(i for i, a in self.assignment.items() if a == arm):
+                try:
+                    planned = planner.plan_segment([index])
+                except Exception:
+                    with lock:
+                        failed.append(index)
+                    continue
+                with lock:
+                    self.robot_steps.update(planned)
+
+        threads = [threading.Thread(target=work, args=(arm,), daemon=True) for arm in MultiRobotPlanner.ARMS]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for index in sorted(failed):
+            arm = [a for a in MultiRobotPlanner.ARMS if a != self.assignment[index]][0]
+            try:
+                self.robot_steps.update(self.planners[arm].plan_segment([index]))
+            except Exception as e:
+                logger.error("neither arm could plan step %d: %r", index, e, extra={"step": index})
+                self.failures[index] = repr(e)
+                continue
+            self.assignment[index] = arm
+        return self.robot_steps
+
+
+    def scheduled_steps(self):
+        """Returns the planned steps before the first step neither arm could plan, in building plan order."""
+        first_failure = min(self.failures) if self.failures else None
+        return [step for step in sorted(self.robot_steps) if first_failure is None or step < first_failure]
+
+
+    def blend(self, tolerance = 0.01, max_tool_deviation = 0.005):
+        """Blends the phases of every planned step with a :class:`TrajectoryBlender` per arm, and drops the schedule.
+
+        The planned trajectories stay in `robot_steps`; the schedule is made of the blended ones.
+
+        Returns
+        -------
+        dict
+            The blending report of each arm.
+        """
+        blenders = {arm: TrajectoryBlender(planner.kinematics, planner.group, tolerance, max_tool_deviation) for arm, planner in self.planners.items()}
+        self.blend_options = (tolerance, max_tool_deviation)
+        self.blended_steps = {}
+        for step in self.scheduled_steps():
+            beam = self.assembly.beams[self.building_plan.steps[step]["element_ids"][0]]
+            self.blended_steps[step] = blenders[self.assignment[step]].blend_step(step, self.robot_steps[step], beam.length)
+        self.schedule = []
+        return {arm: blender.report() for arm, blender in blenders.items()}
+
+
+    def step_trajectories(self, step):
+        """Returns the trajectories `step` runs with: the blended ones if the steps were blended."""
+        return self.blended_steps.get(step) or self.robot_steps[step]
+
+
+    def motions(self):
+        """Returns the motions of every planned step in building plan order, with link positions and timing."""
+        motions = []
+        for step in self.scheduled_steps():
+            arm = self.assignment[step]
+            planner = self.planners[arm]
+            half_length = self.assembly.beams[self.building_plan.steps[step]["element_ids"][0]].length / 2
+            for phase in MultiRobotPlanner.PHASES:
+                trajectories = self.step_trajectories(step)[phase]
+                for index, trajectory in enumerate(trajectories):
+                    times = [point.time_from_start.seconds for point in trajectory.points]
+                    motion = ScheduledMotion(len(motions), arm, step, phase, index, trajectory, times[-1] if times else 0.0)
+                    motion.times = times
+                    motion.links = self.link_origins(arm, planner.get_configuration_array([trajectory]))
+                    last = index == len(trajectories) - 1
+                    motion.carry = half_length if phase == "move" else 0.0
+                    motion.carry_after = half_length if (phase == "pickup" and last) or (phase == "move" and not last) else 0.0
+                    motions.append(motion)
+        return motions
+
+
+    def position_at(self, arm, t):
+        """Returns the link origins of `arm` and the half length of the beam it holds at time `t` of the schedule."""
+        timeline = self._timelines[arm]
+        position = bisect.bisect_right(self._starts[arm], t) - 1
+        if position < 0:
+            return self._homes[arm], 0.0
+        motion = timeline[position]
+        if t >= motion.end:
+            return motion.links[-1], motion.carry_after
+        index = max(0, bisect.bisect_right(motion.times, t - motion.start) - 1)
+        return motion.links[index], motion.carry
+
+
+    def too_close(self, links, carry, other_links, other_carry):
+        """Checks every pair of link origins of the two arms against `clearance`, plus the half length of a beam held by a tool."""
+        distances = np.linalg.norm(links[:, np.newaxis, :] - other_links[np.newaxis, :, :], axis=2)
+        limits = np.full(distances.shape, self.clearance)
+        limits[-1, :] += carry
+        limits[:, -1] += other_carry
+        return bool(np.any(distances < limits))
+
+
+    def first_conflict(self, motion, start):
+        """Returns the motion of the other arm that `motion` comes too close to if it starts at `start`, or None."""
+        other = self.other_arm(motion.arm)
+        if not self._timelines[other]:
+            return None
+        t = 0.0
+        while t <= motion.duration:
+            index = max(0, bisect.bisect_right(motion.times, t) - 1)
+            other_links, other_carry = self.position_at(other, start + t)
+            if self.too_close(motion.links[index], motion.carry, other_links, other_carry):
+                position = bisect.bisect_right(self._starts[other], start + t) - 1
+                return self._timelines[other][max(position, 0)]
+            t += self.time_step
+        return None
+
+
+    def make_schedule(self):
+        """Schedules the planned motions and returns them ordered by start time.
+
+        Motions are placed in building plan order, each as early as its arm, the placement order
+        and the other arm allow. Conflicts no wait resolves are collected in `conflicts`.
+        """
+        motions = self.motions()
+        self._homes = {arm: self.home_links(arm) for arm in MultiRobotPlanner.ARMS}
+        self._timelines = {arm: [] for arm in MultiRobotPlanner.ARMS}
+        self._starts = {arm: [] for arm in MultiRobotPlanner.ARMS}
+        self.collision_waits = 0
+        self.conflicts = []
+        last_placement = None
+        for motion in motions:
+            timeline = self._timelines[motion.arm]
+            start = timeline[-1].end if timeline else 0.0
+            if timeline:
+                motion.after.append(timeline[-1].id)
+            if motion.phase == "move" and motion.index == 0 and last_placement is not None:
+                """beams are placed in building plan order"""
+                start = max(start, last_placement.end)
+                motion.after.append(last_placement.id)
+            while True:
+                conflict = self.first_conflict(motion, start)
+                if conflict is None:
+                    break
+                if conflict.end <= start:
+                    """the other arm waits where it is until its next motion, which is not scheduled yet"""
+                    logger.error("%s comes within the clearance of %s, parked after motion %d, in the %s of step %d",
+                        motion.arm, conflict.arm, conflict.id, motion.phase, motion.step, extra={"step": motion.step})
+                    self.conflicts.append((motion.id, conflict.id))
+                    break
+                start = conflict.end
+                motion.after.append(conflict.id)
+                self.collision_waits += 1
+            motion.start = start
+            timeline.append(motion)
+            self._starts[motion.arm].append(start)
+            if motion.phase == "move" and motion.index == len(self.step_trajectories(motion.step)["move"]) - 1:
+                last_placement = motion
+        self.schedule = sorted(motions, key=lambda m: (m.start, m.id))
+        return self.schedule
+
+
+    def measure_single_arm(self, arm = "robot11"):
+        """Plans the scheduled steps for `arm` alone, the other arm parked, and returns how long running them takes.
+
+        One arm runs its motions in series, so the makespan is the sum of their durations. The steps
+        are blended like the scheduled ones, if those were. Raises the planning error of a step
+        `arm` cannot plan alone, for which there is no single-arm baseline.
+        """
+        planner = self.planners[arm]
+        robot = Robot(planner.robot.model, semantics=planner.robot.semantics, client=planner.robot.client)
+        single = TimberAssemblyPlanner(robot, self.assembly, self.building_plan, planner.pickup_base_frame, planner.scene_objects, planner.group, planner.planner_id, planner.cache, self.scene_store, arm=arm)
+        blender = TrajectoryBlender(single.kinematics, single.group, *self.blend_options) if self.blended_steps else None
+        makespan = 0.0
+        for step in self.scheduled_steps():
+            trajectories = single.plan_segment([step])[step]
+            if blender:
+                beam = self.assembly.beams[self.building_plan.steps[step]["element_ids"][0]]
+                trajectories = blender.blend_step(step, trajectories, beam.length)
+            makespan += sum(trajectory.points[-1].time_from_start.seconds for phase in MultiRobotPlanner.PHASES for trajectory in trajectories[phase] if trajectory.points)
+        self.single_arm_makespan = makespan
+        return makespan
+
+
+    def report(self):
+        """Returns the makespan of the schedule, against that of one arm alone if :meth:`measure_single_arm` measured it."""
+        makespan = max(motion.end for motion in self.schedule) if self.schedule else 0.0
+        single_arm = self.single_arm_makespan
+        busy = {arm: sum(m.duration for m in self.schedule if m.arm == arm) for arm in MultiRobotPlanner.ARMS}
+        return {
+            "steps": {arm: sorted(i for i, a in self.assignment.items() if a == arm) for arm in MultiRobotPlanner.ARMS},
+            "makespan": makespan,
+            "single_arm_makespan": single_arm,
+            "speedup": single_arm / makespan if single_arm is not None and makespan > 0 else None,
+            "utilization": {arm: busy[arm] / makespan if makespan > 0 else 0.0 for arm in busy},
+            "collision_waits": self.collision_waits,
+            "unresolved_conflicts": self.unresolved_conflicts,
+            "failed_steps": sorted(self.failures),
+            }
@@ -0,0 +1,137 @@
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+
+
+class PresenceTracker(object):
+    """Tracks which users are present from their periodic check-ins, on a single thread.
+
+    Every user has a last-seen timestamp and exactly one live entry in an expiry heap, tagged
+    with the generation of the user's presence. When the earliest entry falls due, the user
+    either has checked in since (the entry is pushed back to its new deadline) or has expired and
+    is removed. Entries of an earlier generation, left by a user removed and back again, are
+    dropped. The thread sleeps until the next deadline, so an idle tracker uses no CPU.
+
+    Joins and leaves are queued under the lock in the order they happen and delivered in that
+    order by one thread at a time, so a late leave never overtakes the join that followed it.
+
+    Parameters
+    ----------
+    ttl : float, optional
+        Seconds without a check-in after which a user expires.
+    on_join : callable, optional
+        Called with the user id when a user checks in for the first time.
+    on_leave : callable, optional
+        Called with the user id when a user expires or is removed.
+
+    """
+
+    def __init__(self, ttl = 2.0, on_join = None, on_leave = None):
+        self.ttl = ttl
+        self.on_join = on_join
+        self.on_leave = on_leave
+        self._last_seen = {}
+        self._generations = {}      # user id -> generation of its live heap entry
+        self._expiries = []
+        self._generation = itertools.count()
+        self._events = deque()      # (callback, user id) not delivered yet
+        self._condition = threading.Condition()
+        self._delivery = threading.RLock()
+        self._running = False
+        self._thread = None
+
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._expire_users, daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join()
+
+
+    def check_in(self, user_id):
+        """Records a check-in of `user_id`. Safe to call from any thread."""
+        now = time.monotonic()
+        with self._condition:
+            joined = user_id not in self._last_seen
+            self._last_seen[user_id] = now
+            if joined:
+                generation = next(self._generation)
+                self._generations[user_id] = generation
+                heapq.heappush(self._expiries, (now + self.ttl, generation, user_id))
+                self._events.append((self.on_join, user_id))
+                self._condition.notify_all()
+        self._deliver()
+
+
+    def remove(self, user_id):
+        """Removes `user_id` right away; its heap entry is discarded when it falls due."""
+        with self._condition:
+            if self._last_seen.pop(user_id, None) is not None:
+                del self._generations[user_id]
+                self._events.append((self.on_leave, user_id))
+        self._deliver()
+
+
+    def last_seen(self, user_id):
+        with self._condition:
+            return self._last_seen.get(user_id)
+
+
+    @property
+    def users(self):
+        with self._condition:
+            return list(self._last_seen.keys())
+
+
+    def _deliver(self):
+        """Runs the queued callbacks in order. A thread finding another one delivering waits for it,
+        so every callback queued before a call has run when the call returns."""
+        with self._delivery:
+            while True:
+                with self._condition:
+                    if not self._events:
+                        return
+                    callback, user_id = self._events.popleft()
+                if callback:
+                    callback(user_id)
+
+
+    def _expire_users(self):
+        while True:
+            expired = False
+            with self._condition:
+                while self._running and not expired:
+                    if not self._expiries:
+                        self._condition.wait()
+                        continue
+                    deadline, generation, user_id = self._expiries[0]
+                    now = time.monotonic()
+                    if deadline > now:
+                        self._condition.wait(deadline - now)
+                        continue
+                    heapq.heappop(self._expiries)
+                    if self._generations.get(user_id) != generation:
+                        continue
+                    last_seen = self._last_seen[user_id]
+                    if last_seen + self.ttl > now:
+                        heapq.heappush(self._expiries, (last_seen + self.ttl, generation, user_id))
+                    else:
+                        del self._last_seen[user_id]
+                        del self._generations[user_id]
+                        self._events.append((self.on_leave, user_id))
+                        expired = True
+                if not self._running:
+                    return
+            self._deliver()
@@ -0,0 +1,101 @@
+import asyncio
+import heapq
+import itertools
+
+
+class PublishQueue(object):
+    """Bounded priority queue of outgoing messages for an asyncio event loop.
+
+    Lower priority values are published first, in insertion order within a priority. When the
+    queue is full, each priority has its own policy:
+
+    - BLOCK: `put` waits until there is room, after first evicting a droppable message of lower priority.
+    - COALESCE: a message replaces the queued message with the same `key`; otherwise behaves like BLOCK.
+    - DROP: the message is discarded and counted in `dropped`.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of queued messages.
+    policies : dict
+        Policy by priority. Priorities without a policy use BLOCK.
+
+    """
+
+    BLOCK = "block"
+    COALESCE = "coalesce"
+    DROP = "drop"
+
+    def __init__(self, maxsize, policies = None):
+        self.maxsize = maxsize
+        self.policies = policies or {}
+        self.dropped = 0
+        self.coalesced = 0
+        self.evicted = 0
+        self._heap = []
+        self._keyed = {}
+        self._count = 0
+        self._sequence = itertools.count()
+        self._changed = asyncio.Condition()
+
+
+    def __len__(self):
+        return self._count
+
+
+    def policy(self, priority):
+        return self.policies.get(priority, PublishQueue.BLOCK)
+
+
+    async def put(self, priority, item, key = None):
+        """Queues `item`. Returns False if it was dropped."""
+        policy = self.policy(priority)
+        async with self._changed:
+            if policy == PublishQueue.COALESCE and (priority, key) in self._keyed:
+                self._keyed[(priority, key)][2] = item
+                self.coalesced += 1
+                return True
+            if self._count >= self.maxsize:
+                if policy == PublishQueue.DROP:
+                    self.dropped += 1
+                    return False
+                if not self._evict_below(priority):
+                    await self._changed.wait_for(lambda: self._count < self.maxsize)
+            entry = [priority, next(self._sequence), item, key]
+            heapq.heappush(self._heap, entry)
+            if policy == PublishQueue.COALESCE:
+                self._keyed[(priority, key)] = entry
+            self._count += 1
+            self._changed.notify_all()
+            return True
+
+
+    def _evict_below(self, priority):
+        """Drops the newest queued message with a DROP policy and a lower priority than `priority`."""
+        candidates = [entry for entry in self._heap if entry[2] is not None and entry[0] > priority and self.policy(entry[0]) == PublishQueue.DROP]
+        if not candidates:
+            return False
+        victim = max(candidates, key=lambda entry: (entry[0], entry[1]))
+        victim[2] = None
+        self._count -= 1
+        self.evicted += 1
+        return True
+
+
+    async def get(self):
+        """Waits for and returns the next `(priority, item)`."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._count > 0)
+            entry = heapq.heappop(self._heap)
+            while entry[2] is None:
+                entry = heapq.heappop(self._heap)
+            priority, _, item, key = entry
+            if self._keyed.get((priority, key)) is entry:
+                del self._keyed[(priority, key)]
+            self._count -= 1
+            self._changed.notify_all()
+            return priority, item
+
+
+    def stats(self):
+        return {"queued": self._count, "dropped": self.dropped, "coalesced": self.coalesced, "evicted": self.evicted}
@@ -0,0 +1,227 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+try:
+    from compas_robots.model import Joint
+except ImportError:
+    from compas.robots import Joint
+
+
+class UnreachableFrameError(ValueError):
+    """Raised before planning when a target frame lies outside the reachability map."""
+
+
+class ReachabilityMap(object):
+    """Voxel map of the tool positions a planning group reaches, sampled with forward kinematics.
+
+    Configurations are drawn uniformly within the joint limits of the group, narrowed to the
+    ranges its joint constraints allow, so the gantry axes (`bridge1_joint_EA_X`, `<arm>_joint_EA_Y`,
+    `<arm>_joint_EA_Z`) and the arm are sampled together. The tool position of every sample marks
+    its voxel; up to `per_voxel` samples are kept per voxel as IK seeds.
+
+    Sampling misses some reachable positions, so a frame counts as reachable when any voxel within
+    `margin` voxels of it was hit. The map only rejects frames clearly out of the workspace; whether
+    a frame in it is reachable in the current scene is still up to the planner.
+
+    Parameters
+    ----------
+    resolution : float, optional
+        Edge length of the voxels.
+    margin : int, optional
+        Number of neighbouring voxels searched around a frame.
+
+    """
+
+    def __init__(self, resolution = 0.25, margin = 1):
+        self.resolution = resolution
+        self.margin = margin
+        self.group = None
+        self.joint_names = []
+        self.values = np.zeros((0, 0))      # full configuration of every kept sample
+        self.zaxes = np.zeros((0, 3))       # tool z axis of every kept sample
+        self.voxels = {}                    # voxel -> indices of its samples
+        self._offsets = [(i, j, k) for i in range(-margin, margin + 1) for j in range(-margin, margin + 1) for k in range(-margin, margin + 1)]
+
+
+    @staticmethod
+    def joint_ranges(robot, group, constraints = None):
+        """Returns the names and `(lower, upper)` ranges of the configurable joints of `group`, narrowed by joint constraints."""
+        allowed = {}
+        for constraint in constraints or []:
+            if hasattr(constraint, "joint_name"):
+                allowed[constraint.joint_name] = (constraint.value - abs(constraint.tolerance_below), constraint.value + abs(constraint.tolerance_above))
+        names, ranges = [], []
+        for joint in robot.get_configurable_joints(group):
+            if joint.type == Joint.CONTINUOUS or joint.limit is None:
+                lower, upper = -math.pi, math.pi
+            else:
+                lower, upper = joint.limit.lower, joint.limit.upper
+            if joint.name in allowed:
+                lower, upper = max(lower, allowed[joint.name][0]), min(upper, allowed[joint.name][1])
+            names.append(joint.name)
+            ranges.append((lower, upper))
+        return names, ranges
+
+
+    @classmethod
+    def build(cls, robot, kinematics, group, samples = 20000, constraints = None, resolution = 0.25, margin = 1, per_voxel = 4, seed = 0):
+        """Samples `samples` configurations of `group` and returns the map of their tool positions.
+
+        Parameters
+        ----------
+        robot : :class:`compas_fab.robots.Robot`
+        kinematics : :class:`BatchKinematics`
+            Supplies the joints outside `group` and the forward kinematics.
+        group : str
+        constraints : list of :class:`compas_fab.robots.Constraint`, optional
+            Joint constraints narrowing the sampled ranges, e.g. the planner's `global_constraints`.
+
+        """
+        reachability = cls(resolution, margin)
+        reachability.group = group
+        names, ranges = cls.joint_ranges(robot, group, constraints)
+        lower, upper = np.array(ranges, dtype=float).T
+        values = np.random.default_rng(seed).uniform(lower, upper, (samples, len(names)))
+        full_values = kinematics.merge(values, group, names)
+        matrices = kinematics.forward_kinematics(full_values, group)
+        cells = np.floor(matrices[:, :3, 3] / resolution).astype(int)
+
+        kept = []
+        for index, cell in enumerate(map(tuple, cells)):
+            indices = reachability.voxels.setdefault(cell, [])
+            if len(indices) < per_voxel:
+                indices.append(len(kept))
+                kept.append(index)
+        reachability.joint_names = list(kinematics.full_joint_names)
+        reachability.values = full_values[kept]
+        reachability.zaxes = matrices[kept, :3, 2]
+        return reachability
+
+
+    def voxel(self, point):
+        return tuple(int(math.floor(v / self.resolution)) for v in point[:3])
+
+
+    def neighbours(self, point):
+        """Returns the sample indices of the voxels within `margin` of `point`."""
+        x, y, z = self.voxel(point)
+        indices = []
+        for i, j, k in self._offsets:
+            indices.extend(self.voxels.get((x + i, y + j, z + k), ()))
+        return indices
+
+
+    def reachable(self, frame):
+        x, y, z = self.voxel(frame.point)
+        return any((x + i, y + j, z + k) in self.voxels for i, j, k in self._offsets)
+
+
+    def seed(self, frame):
+        """Returns the full configuration values of the sample nearest to `frame` whose tool points most like it, or None."""
+        indices = self.neighbours(frame.point)
+        if not indices:
+            return None
+        zaxis = np.array(list(frame.zaxis), dtype=float)
+        return self.values[max(indices, key=lambda index: float(self.zaxes[index] @ zaxis))]
+
+
+    def save(self, path):
+        cells = sorted(self.voxels)
+        np.savez_compressed(
+            path,
+            group=self.group,
+            resolution=self.resolution,
+            margin=self.margin,
+            joint_names=np.array(self.joint_names),
+            values=self.values,
+            zaxes=self.zaxes,
+            cells=np.array(cells, dtype=int).reshape(-1, 3),
+            counts=np.array([len(self.voxels[cell]) for cell in cells], dtype=int),
+            indices=np.array([index for cell in cells for index in self.voxels[cell]], dtype=int),
+            )
+
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        reachability = cls(float(data["resolution"]), int(data["margin"]))
+        reachability.group = str(data["group"])
+        reachability.joint_names = [str(name) for name in data["joint_names"]]
+        reachability.values = data["values"]
+        reachability.zaxes = data["zaxes"]
+        ends = np.cumsum(data["counts"])
+        indices = data["indices"]
+        for cell, end, count in zip(map(tuple, data["cells"].tolist()), ends, data["counts"]):
+            reachability.voxels[cell] = indices[end - count:end].tolist()
+        return reachability
+
+
+class IKCache(object):
+    """Inverse kinematics solutions keyed by quantized target frame.
+
+    Frames within `position_resolution` of each other, with axes within `axis_resolution`, share
+    a solution. Failed solves are cached too, as None, so an unsolvable frame costs one request.
+    Shared by planners on several threads.
+
+    Parameters
+    ----------
+    position_resolution : float, optional
+    axis_resolution : float, optional
+        Quantization of the axis vector components.
+    max_entries : int, optional
+        The least recently used entries are evicted beyond this.
+
+    """
+
+    MISS = object()
+
+    def __init__(self, position_resolution = 0.001, axis_resolution = 0.001, max_entries = 100000):
+        self.position_resolution = position_resolution
+        self.axis_resolution = axis_resolution
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+
+    def key(self, frame, group, context = None):
+        """Returns the key of `frame` for `group`; `context` (e.g. a digest of the constraints) separates solutions."""
+        return (
+            group,
+            context,
+            tuple(int(round(v / self.position_resolution)) for v in frame.point),
+            tuple(int(round(v / self.axis_resolution)) for v in list(frame.xaxis) + list(frame.yaxis)),
+            )
+
+
+    def get(self, key):
+        """Returns the cached configuration, None for a cached failure, or `IKCache.MISS`."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return IKCache.MISS
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+
+    def put(self, key, configuration):
+        with self._lock:
+            self._entries[key] = configuration
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+                }
@@ -0,0 +1,145 @@
+import threading
+
+from compas.datastructures import Mesh
+
+from aabb import aabb_from_mesh
+from trajectory_cache import digest
+from spatial_index import AABBTree
+
+
+def beam_shape(beam):
+    """Returns the box of `beam`: `geometry` in the compas_timber the planner was written against, `shape` in 0.6."""
+    geometry = getattr(beam, "geometry", None)
+    return geometry if geometry is not None else beam.shape
+
+
+class SceneStore(object):
+    """Collision scene state after every step of a building plan.
+
+    Beams are only ever added to the scene, in step order, so the scene at the start of a step is
+    a prefix of one placement list; a snapshot is the length of that prefix and is looked up in O(1).
+    Going from one snapshot to another means adding or removing the placements in between.
+
+    Beam meshes and their bounding boxes are built once per beam geometry and shared by every
+    snapshot and every planner using the store. The digests of the snapshots are chained from the
+    digests of the placements, so each is computed once per change of the placements.
+
+    Parameters
+    ----------
+    assembly : :class:`compas_timber.assembly.TimberAssembly`
+    building_plan : :class:`compas_timber.planning.BuildingPlan`
+
+    """
+
+    def __init__(self, assembly, building_plan):
+        self.assembly = assembly
+        self.building_plan = building_plan
+        self._lock = threading.RLock()
+        self._meshes = {}           # beam digest -> (mesh, bounding box)
+        self.placements = []        # (beam key, beam digest) in placement order
+        self.positions = {}         # beam key -> index in placements
+        self.step_counts = []       # step index -> number of placements before it
+        self.version = 0            # incremented whenever placements change
+        self._index = (None, None)
+        self._prefixes = (None, [])  # version, digest of every snapshot computed so far
+        self.rebuild()
+
+
+    def rebuild(self):
+        """Indexes the placements of the building plan."""
+        with self._lock:
+            self.placements = []
+            self.positions = {}
+            self.step_counts = []
+            for step in self.building_plan.steps:
+                self.step_counts.append(len(self.placements))
+                if step["actor"] == "ROBOT":
+                    key = step["element_ids"][0]
+                    self.positions[key] = len(self.placements)
+                    self.placements.append((key, digest(self.assembly.beams[key])))
+            self.step_counts.append(len(self.placements))
+            self.version += 1
+
+
+    def refresh(self, beam_keys):
+        """Re-digests changed beams.
+
+        Returns
+        -------
+        int
+            Position of the first changed placement, or None if no placement changed.
+        """
+        first = None
+        with self._lock:
+            for key in beam_keys:
+                position = self.positions.get(key)
+                if position is None:
+                    continue
+                beam_digest = digest(self.assembly.beams[key])
+                if self.placements[position][1] != beam_digest:
+                    self.placements[position] = (key, beam_digest)
+                    first = position if first is None else min(first, position)
+            if first is not None:
+                self.version += 1
+        return first
+
+
+    def _entry(self, beam):
+        beam_digest = digest(beam)
+        with self._lock:
+            entry = self._meshes.get(beam_digest)
+            if entry is None:
+                mesh = Mesh.from_shape(beam_shape(beam))
+                entry = (mesh, aabb_from_mesh(mesh))
+                self._meshes[beam_digest] = entry
+            return entry
+
+
+    def mesh(self, beam):
+        """Returns the shared collision mesh of `beam`. Do not transform it in place."""
+        return self._entry(beam)[0]
+
+
+    def bounding_box(self, beam):
+        return self._entry(beam)[1]
+
+
+    def spatial_index(self):
+        """Returns an :class:`AABBTree` over the boxes of all placements, rebuilt when they change."""
+        with self._lock:
+            if self._index[0] != self.version:
+                items = [(key, self.bounding_box(self.assembly.beams[key])) for key, _ in self.placements]
+                self._index = (self.version, AABBTree(items))
+            return self._index[1]
+
+
+    def snapshot(self, step_index):
+        """Returns the snapshot of the scene at the start of `step_index`."""
+        return self.step_counts[step_index]
+
+
+    def snapshot_digest(self, snapshot):
+        """Returns a digest of the placements in `snapshot`, extended from the digest of the snapshot before it."""
+        with self._lock:
+            if self._prefixes[0] != self.version:
+                self._prefixes = (self.version, [digest([])])
+            chain = self._prefixes[1]
+            while len(chain) <= snapshot:
+                chain.append(digest([chain[-1], self.placements[len(chain) - 1][1]]))
+            return chain[snapshot]
+
+
+    def beam_digest(self, key):
+        """Returns the digest `key` was placed with."""
+        return self.placements[self.positions[key]][1]
+
+
+    def keys(self, snapshot):
+        return [key for key, _ in self.placements[:snapshot]]
+
+
+    def diff(self, from_snapshot, to_snapshot):
+        """Returns the beam keys to add and to remove to go from one snapshot to another."""
+        if to_snapshot >= from_snapshot:
+            return [key for key, _ in self.placements[from_snapshot:to_snapshot]], []
+        return [], [key for key, _ in self.placements[to_snapshot:from_snapshot]]
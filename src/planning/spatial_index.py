@@ -0,0 +1,54 @@
+from aabb import aabb_union
+from aabb import aabb_intersects
+
+
+class AABBTree(object):
+    """Static bounding volume hierarchy over axis-aligned boxes.
+
+    Built top-down by splitting at the median of the longest axis of the node's box, with at most
+    `leaf_size` items per leaf.
+
+    Parameters
+    ----------
+    items : list
+        `(id, box)` pairs.
+    leaf_size : int, optional
+
+    """
+
+    def __init__(self, items, leaf_size = 4):
+        self.items = list(items)
+        self.leaf_size = leaf_size
+        self.root = self._build(self.items) if self.items else None
+
+
+    def _build(self, items):
+        box = aabb_union(b for _, b in items)
+        if len(items) <= self.leaf_size:
+            return (box, items, None, None)
+        extents = [box[1][i] - box[0][i] for i in range(3)]
+        axis = extents.index(max(extents))
+        items = sorted(items, key=lambda item: item[1][0][axis] + item[1][1][axis])
+        middle = len(items) // 2
+        return (box, None, self._build(items[:middle]), self._build(items[middle:]))
+
+
+    def query(self, box):
+        """Returns the ids of the items whose box intersects `box`."""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_box, items, left, right = stack.pop()
+            if not aabb_intersects(node_box, box):
+                continue
+            if items is not None:
+                found.extend(item_id for item_id, item_box in items if aabb_intersects(item_box, box))
+            else:
+                stack.append(left)
+                stack.append(right)
+        return found
+
+
+    def brute_force_query(self, box):
+        """Reference result of `query`, for verification."""
+        return [item_id for item_id, item_box in self.items if aabb_intersects(item_box, box)]
@@ -0,0 +1,99 @@
+import threading
+
+from compas.datastructures import Mesh
+
+from aabb import aabb_from_mesh
+from aabb import aabb_inflate
+from aabb import aabb_intersects
+from trajectory_cache import digest
+from scene_store import beam_shape
+
+
+class StepDependencies(object):
+    """Tracks which planned steps depend on which beams.
+
+    A ROBOT step depends on the beam it places, on the beams joined to it in the assembly graph,
+    and on every beam placed before it whose collision mesh lies inside the step's motion envelope.
+    The envelope is the bounding box of the frames the step plans through, inflated by `margin`.
+
+    Parameters
+    ----------
+    assembly : :class:`compas_timber.assembly.TimberAssembly`
+    margin : float, optional
+        Clearance in meters added around every envelope.
+    scene_store : :class:`SceneStore`, optional
+        Source of precomputed beam bounding boxes.
+
+    Planners planning in parallel share one instance, so records are taken under a lock.
+
+    """
+
+    def __init__(self, assembly, margin = 0.5, scene_store = None):
+        self.assembly = assembly
+        self.margin = margin
+        self.scene_store = scene_store
+        self.step_beams = {}        # step index -> key of the placed beam
+        self.envelopes = {}         # step index -> envelope the step was planned with
+        self.beam_boxes = {}        # beam key -> bounding box at planning time
+        self.beam_digests = {}      # beam key -> digest of the beam at planning time
+        self._lock = threading.Lock()
+
+
+    def beam_box(self, beam):
+        if self.scene_store:
+            return self.scene_store.bounding_box(beam)
+        return aabb_from_mesh(Mesh.from_shape(beam_shape(beam)))
+
+
+    def joined_beams(self, beam_key):
+        """Returns the keys of the beams sharing a joint with `beam_key` in the assembly graph."""
+        graph = self.assembly.graph
+        joined = set()
+        for joint_node in graph.neighbors(beam_key):
+            for node in graph.neighbors(joint_node):
+                if node != beam_key:
+                    joined.add(node)
+        return joined
+
+
+    def record(self, step_index, beam, envelope):
+        """Records the inputs step `step_index` was planned with."""
+        box, beam_digest = self.beam_box(beam), digest(beam)
+        with self._lock:
+            self.step_beams[step_index] = beam.key
+            self.envelopes[step_index] = aabb_inflate(envelope, self.margin)
+            self.beam_boxes[beam.key] = box
+            self.beam_digests[beam.key] = beam_digest
+
+
+    def changed_beams(self):
+        """Returns the keys of the recorded beams whose geometry differs from the assembly."""
+        with self._lock:
+            recorded = list(self.beam_digests.items())
+        return [key for key, value in recorded if digest(self.assembly.beams[key]) != value]
+
+
+    def affected_steps(self, beam_keys):
+        """Returns the sorted indices of the planned steps a change to `beam_keys` invalidates.
+
+        Both the recorded and the current box of a changed beam are tested, since a step may
+        have planned around the old position and must now plan around the new one.
+        """
+        with self._lock:
+            step_beams, envelopes, beam_boxes = dict(self.step_beams), dict(self.envelopes), dict(self.beam_boxes)
+        placed_at = {key: index for index, key in step_beams.items()}
+        affected = set()
+        for key in beam_keys:
+            boxes = [self.beam_box(self.assembly.beams[key])]
+            if key in beam_boxes:
+                boxes.append(beam_boxes[key])
+            joined = self.joined_beams(key)
+            first = placed_at.get(key, -1)
+            if first >= 0:
+                affected.add(first)
+            for index, beam_key in step_beams.items():
+                if index <= first:
+                    continue
+                if beam_key in joined or any(aabb_intersects(box, envelopes[index]) for box in boxes):
+                    affected.add(index)
+        return sorted(affected)
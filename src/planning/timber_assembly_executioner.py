@@ -1,101 +1,395 @@
 from timber_assembly_planner import TimberAssemblyPlanner
+import logging
 import threading
 import time
 
 from executor_communicator import ExecutorCommunicator
+from execution_pipeline import ExecutionPipeline
+from execution_journal import ExecutionJournal
+from execution_journal import UnresolvedStepError
+from multi_robot_planner import ScheduleConflictError
+import instrumentation
+
+logger = logging.getLogger(__name__)
 
 
 class TimberAssemblyExecutioner(object):
-    def __init__(self, ros_client = None, assembly = None, building_plan = None, scene_objects = None, group = None, planner_id = None):
+    def __init__(self, ros_client = None, assembly = None, building_plan = None, scene_objects = None, group = None, planner_id = None, quorum = ExecutorCommunicator.ALL, confirmation_timeout = None, compact_configurations = False, stream_configurations = False, comms = None, planner = None, journal = None):
         self.ros_client = ros_client
         self.assembly = assembly
         self.building_plan = building_plan
+        self.confirmation_timeout = confirmation_timeout
+        self.stream_configurations = stream_configurations
+        self.preview_tolerance = 0.01
+        self.refinement_chunk_size = 100
+        self.settle_time = 5.0          # seconds to wait after each motion
+        self.stop_event = threading.Event()
         # self.robot = self.ros_client.load_robot()
-        print("instanting communicator")
-        self.comms = ExecutorCommunicator("broker.hivemq.com", "T2_command_test")
+        logger.info("instantiating communicator")
+        self.comms = comms or ExecutorCommunicator(None, "T2_command_test", quorum, compact = compact_configurations)
+        self.planner = planner
+        self.pipeline = None
+        self.journal = journal
+        self.blender = None             # a TrajectoryBlender merges the motions of each phase before confirmation
         # self.planner = TimberAssemblyPlanner(self.robot, self.assembly, self.building_plan)
         # self.planner.plan_robot_assembly()
 
     def run(self):
-        print("running executioner")
+        logger.info("running executioner")
         dummy_configs = [[0,15,3,0,468,0,86,488,56,79,56], [0,15,3,0,468,0,86,488,56,79,56]]
 
         self.execute_robot_motion(0, dummy_configs)
 
         # thread = threading.Thread(target=self.send_configs_to_app, args=(0,dummy_configs,), daemon=True)
         # thread.start()
-        while True:
-            pass
+        try:
+            self.stop_event.wait()
+        except KeyboardInterrupt:
+            self.stop_event.set()
 
             # self.execute_()
 
     def execute_(self):
-        step, index = self.get_current_step()
+        self.check_resolved()
+        step, index = self.get_first_unbuilt_step()
         if step["actor"] == "ROBOT":
             self.execute_step(index)
 
     def plan_next_robot_step(self):
-        for index, step in self.building_plan.steps:
-            if step['actor'] == 'ROBOT' and step['is_built'] == 'false':
-                self.planner.plan_robot_assembly(index)
+        index = self.get_next_robot_step()
+        if index is not None:
+            self.planner.plan_robot_assembly(index)
 
 
     def get_first_unbuilt_step(self):
-        for index, step in self.building_plan.steps:
-            if step['is_built'] == 'false':
+        """Returns the first unbuilt step and its index, from the journal if there is one."""
+        if self.journal:
+            index = self.journal.next_unbuilt()
+            return (self.building_plan.steps[index], index) if index is not None else (None, None)
+        for index in range(len(self.building_plan.steps)):
+            step = self.building_plan.steps[index]
+            if step['is_built'] not in (True, 'true'):
                 return (step, index)
-            
+        return (None, None)
 
-    def execute_step(self, step_index):
-        self.execute_robot_motion(step_index, self.planner.trajectories[step_index]["pickup"])
-        self.close_gripper()
-        self.execute_robot_motion(step_index, self.planner.trajectories[step_index]["move"])
-        self.open_gripper()
-        self.execute_robot_motion(step_index, self.planner.trajectories[step_index]["retract"])
+
+    def get_next_robot_step(self):
+        """Returns the index of the first unbuilt ROBOT step, or None."""
+        if self.journal:
+            return self.journal.next_robot_step()
+        for index in range(len(self.building_plan.steps)):
+            step = self.building_plan.steps[index]
+            if step['actor'] == 'ROBOT' and step['is_built'] not in (True, 'true'):
+                return index
+
+
+    def record(self, step_index, event):
+        if self.journal:
+            self.journal.record(step_index, event)
+
+
+    def mark_built(self, step_index):
         self.building_plan.steps[step_index]["is_built"] = "true"
+        self.record(step_index, ExecutionJournal.BUILT)
+
+
+    def check_resolved(self):
+        """Raises :class:`UnresolvedStepError` if the journal holds steps interrupted while the robot moved them."""
+        unresolved = self.journal.unresolved() if self.journal else []
+        if unresolved:
+            logger.error("steps %s were interrupted while the robot moved them; check them and call resolve_step", unresolved)
+            raise UnresolvedStepError("steps {} need to be resolved by an operator before resuming".format(unresolved))
+
+
+    def resolve_step(self, step_index, built):
+        """Records an operator's check of an interrupted step: built, or undone so it runs again."""
+        if built:
+            self.mark_built(step_index)
+        else:
+            self.journal.resolve(step_index, False)
+
+
+    def resume(self, lookahead = 1, max_retries = 1):
+        """Continues the building plan from the first unbuilt ROBOT step, e.g. after a restart.
+
+        Built steps are skipped without being planned again; with a persistent trajectory cache,
+        steps planned before the restart are not planned again either. A step interrupted once the
+        robot started moving it may have placed its beam already, so resuming raises
+        :class:`UnresolvedStepError` until it is resolved with :meth:`resolve_step`.
+        """
+        self.check_resolved()
+        index = self.get_next_robot_step()
+        if index is None:
+            logger.info("all robot steps are built")
+            return None
+        logger.info("resuming at step %d", index, extra={"step": index})
+        return self.execute_pipelined(index, lookahead, max_retries)
+
+
+    def execute_step(self, step_index):
+        """Confirms and executes the motions of a step one by one.
+
+        Returns False, leaving the step unbuilt, as soon as a motion is not confirmed or fails;
+        the gripper and the later motions are not touched.
+        """
+        self.record(step_index, ExecutionJournal.STARTED)
+        trajectories = self.blend_step(step_index, self.planner.robot_steps[step_index])
+        for phase in ("pickup", "move", "retract"):
+            if not self.execute_robot_motion(step_index, self.planner.get_configurations(trajectories[phase]), trajectories[phase]):
+                logger.warning("stopped step %d in the %s", step_index, phase, extra={"step": step_index})
+                return False
+            if phase == "pickup":
+                self.close_gripper()
+            elif phase == "move":
+                self.open_gripper()
+        self.record(step_index, ExecutionJournal.EXECUTED)
+        self.mark_built(step_index)
+        return True
+
+
+    def execute_pipelined(self, start_index = 0, lookahead = 1, max_retries = 1):
+        """Plans, confirms and executes the ROBOT steps from `start_index` on, overlapping the three.
+
+        While a step executes, the next `lookahead` steps are planned and out for confirmation.
+        Each step is confirmed once, for all of its motions. See :class:`ExecutionPipeline`.
+
+        Returns
+        -------
+        dict
+            The pipeline report, with the utilization of every stage.
+        """
+        self.check_resolved()
+        if self.journal:
+            indices = self.journal.unbuilt_robot_steps(start_index)
+        else:
+            indices = [index for index in range(start_index, len(self.building_plan.steps)) if self.building_plan.steps[index]["actor"] == "ROBOT"]
+        self.pipeline = ExecutionPipeline(self.plan_step, self.confirm_step, self.execute_confirmed_step, lookahead, max_retries, self.rollback_to_step, self.comms.wake_confirmation_waiters)
+        try:
+            report = self.pipeline.run(indices)
+        finally:
+            """a finished pipeline counts as stopped, which would cancel every later confirmation"""
+            self.pipeline = None
+        for stage, stats in report["stages"].items():
+            logger.info("%s: %d steps, %.1f s busy, %.0f%% utilization", stage, stats["count"], stats["busy"], 100 * stats["utilization"], extra={"stage": stage})
+        return report
+
+
+    def plan_step(self, step_index, attempt = 0):
+        """Plans one ROBOT step. Retries bypass the trajectory cache, which holds the plan that failed."""
+        cache = self.planner.cache
+        if attempt > 0:
+            self.planner.cache = None
+        try:
+            self.planner.replay_scene(step_index)
+            self.planner.trajectories = []
+            self.planner.step_index = step_index
+            self.planner.robot_steps[step_index] = self.planner.plan_robot_step(self.building_plan.steps[step_index])
+        finally:
+            self.planner.cache = cache
+        self.planner.record_step_result(step_index)
+        return self.blend_step(step_index, self.planner.robot_steps[step_index])
+
+
+    def blend_step(self, step_index, trajectories):
+        """Returns the trajectories of a step with the motions of each phase blended, if there is a blender.
 
+        The planned trajectories stay in `planner.robot_steps`; the users confirm the configurations
+        of the blended ones, and the robot runs them with their times and velocities. A phase whose
+        blend is not faster keeps its planned trajectories.
+        """
+        if self.blender is None:
+            return trajectories
+        beam = self.assembly.beams[self.building_plan.steps[step_index]["element_ids"][0]]
+        blended = self.blender.blend_step(step_index, trajectories, beam.length)
+        report = self.blender.reports[step_index]
+        logger.info("blended step %d: %.1f s instead of %.1f s", step_index, report["blended_duration"], report["original_duration"], extra={"step": step_index})
+        return blended
 
-    def execute_robot_motion(self, step_index, configurations):
+
+    def rollback_to_step(self, step_index):
+        for index in [index for index in self.planner.robot_steps if index >= step_index]:
+            del self.planner.robot_steps[index]
+
+
+    def confirm_step(self, step_index, trajectories, planner = None, cancelled = None):
+        """Sends all motions of a step out for one confirmation. In a pipeline, a wait for a step
+        the pipeline has discarded is cancelled."""
+        self.record(step_index, ExecutionJournal.STARTED)
+        planner = planner or self.planner
+        if cancelled is None and self.pipeline:
+            cancelled = self.pipeline.confirmation_cancelled
+        configurations = planner.get_configurations(trajectories["pickup"] + trajectories["move"] + trajectories["retract"])
         self.send_configs_to_app(step_index, configurations)
-        if self.await_confirmation(step_index):
-            self.execute_trajectory(configurations)
-        time.sleep(5)
-
-    def send_configs_to_app(self, step_index, configurations):
-        print("sending configs")
-        configs = {"type": "configurations", "step": step_index}
-        index = 0
-        for config in configurations:
-            print("config = {}".format(config))
-            configs[index]=(config)
-            index += 1
-        self.comms.send_configurations(step_index, configs)
-        print("configs sent")
-
-
-    def await_confirmation(self, step_index):
-        print("awaiting confirmation")
-        while True:
-            if len(self.comms.AR_users) == 0:
-                print("no users")
-                time.sleep(1)
-                continue
-            confirmed = True
-            for user in self.comms.AR_users.values():
-                confirmed = confirmed and user.step_confirmations.get(step_index, False) 
-                if confirmed:
-                    print("user {} confirmed step {}".format(user.id, step_index))                   
-            if confirmed:
-                print("step {} confirmed".format(step_index))
-                return True
+        confirmed = self.await_confirmation(step_index, cancelled = cancelled)
+        if confirmed:
+            self.record(step_index, ExecutionJournal.CONFIRMED)
+        return confirmed
+
+
+    def execute_confirmed_step(self, step_index, trajectories):
+        """Executes a confirmed step without asking for confirmation per motion."""
+        self.record(step_index, ExecutionJournal.MOVING)
+        for phase in ("pickup", "move", "retract"):
+            if not self.execute_trajectory(trajectories[phase], step_index):
+                return False
+            if phase == "pickup":
+                self.close_gripper()
+            elif phase == "move":
+                self.open_gripper()
+            time.sleep(self.settle_time)
+        self.record(step_index, ExecutionJournal.EXECUTED)
+        self.mark_built(step_index)
+        return True
+
+
+    def execute_schedule(self, multi_planner):
+        """Runs the coordinated schedule of a :class:`MultiRobotPlanner`, one thread per arm.
+
+        Each arm runs its motions in order, starting every motion once the motions it waits for,
+        on either arm, have finished. Each step is confirmed once, before its first motion. A
+        failure stops both arms after their current motion. A schedule in which the arms would
+        come too close raises :class:`ScheduleConflictError` before anything moves. With a
+        blender, the steps are blended per arm and scheduled with the blended trajectories.
+
+        Returns
+        -------
+        dict
+            The built and failed steps and the wall time.
+        """
+        if self.blender is not None and not multi_planner.blended_steps:
+            multi_planner.blend(self.blender.tolerance, self.blender.max_tool_deviation)
+        schedule = multi_planner.schedule or multi_planner.make_schedule()
+        if multi_planner.conflicts:
+            raise ScheduleConflictError("the schedule has {} unresolved conflicts between the arms, at motions {}".format(
+                len(multi_planner.conflicts), [motion_id for motion_id, _ in multi_planner.conflicts]))
+        condition = threading.Condition()
+        finished = set()
+        built = []
+        failures = []
+
+        def run_arm(arm):
+            planner = multi_planner.planners[arm]
+            for motion in [motion for motion in schedule if motion.arm == arm]:
+                with condition:
+                    condition.wait_for(lambda: failures or finished.issuperset(motion.after))
+                    if failures:
+                        return
+                trajectories = multi_planner.step_trajectories(motion.step)
+                ok = True
+                if motion.phase == "pickup" and motion.index == 0:
+                    ok = self.confirm_step(motion.step, trajectories, planner)
+                    if ok:
+                        self.record(motion.step, ExecutionJournal.MOVING)
+                if ok:
+                    ok = self.execute_trajectory([motion.trajectory], motion.step)
+                if ok and motion.index == len(trajectories[motion.phase]) - 1:
+                    if motion.phase == "pickup":
+                        self.close_gripper(arm)
+                        time.sleep(self.settle_time)
+                    elif motion.phase == "move":
+                        self.open_gripper(arm)
+                        time.sleep(self.settle_time)
+                    else:
+                        self.record(motion.step, ExecutionJournal.EXECUTED)
+                        self.mark_built(motion.step)
+                        built.append(motion.step)
+                with condition:
+                    if ok:
+                        finished.add(motion.id)
+                    else:
+                        failures.append((motion.step, arm, motion.phase))
+                        logger.warning("%s failed in the %s of step %d", arm, motion.phase, motion.step, extra={"step": motion.step})
+                    condition.notify_all()
+                if not ok:
+                    return
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=run_arm, args=(arm,), daemon=True) for arm in multi_planner.planners]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {"built": built, "failures": failures, "wall_time": time.perf_counter() - start}
+
+
+    def close_gripper(self, arm = None):
+        self.comms.send_to_robot("close_gripper" if arm is None else "{} close_gripper".format(arm))
+
+
+    def open_gripper(self, arm = None):
+        self.comms.send_to_robot("open_gripper" if arm is None else "{} open_gripper".format(arm))
+
+
+    def execute_robot_motion(self, step_index, configurations, trajectories = None):
+        """Sends a motion for confirmation and executes it once confirmed.
+
+        The users confirm `configurations`; the robot runs `trajectories`, the time-parameterized
+        motion they were taken from, if given, and `configurations` otherwise.
+
+        Returns
+        -------
+        bool
+            False if the motion was not confirmed within `confirmation_timeout` or failed.
+        """
+        self.send_configs_to_app(step_index, configurations)
+        if not self.await_confirmation(step_index):
+            logger.warning("step %d was not confirmed within %s s", step_index, self.confirmation_timeout, extra={"step": step_index})
+            return False
+        if self.journal is None or self.journal.state(step_index) != ExecutionJournal.MOVING:
+            """a step stays MOVING from its first motion on, also while its next motion waits for confirmation"""
+            self.record(step_index, ExecutionJournal.CONFIRMED)
+            self.record(step_index, ExecutionJournal.MOVING)
+        if not self.execute_trajectory(configurations if trajectories is None else trajectories, step_index):
+            return False
+        time.sleep(self.settle_time)
+        return True
+
+    def send_configs_to_app(self, step_index, configurations, stream = None):
+        """Sends the configurations of a step to the AR users.
+
+        In streaming mode a keyframe preview goes out first and is refined in chunks. Only what is
+        shown is reduced: `execute_trajectory` still runs the full trajectories.
+        """
+        stream = self.stream_configurations if stream is None else stream
+        if stream:
+            self.comms.stream_configurations(step_index, configurations, self.preview_tolerance, self.refinement_chunk_size)
+        else:
+            self.comms.publish_configurations(step_index, configurations)
+        logger.debug("sent %d configurations", len(configurations), extra={"step": step_index})
+
+
+    def await_confirmation(self, step_index, quorum = None, cancelled = None):
+        confirmed = self.comms.wait_for_confirmation(step_index, quorum, self.confirmation_timeout, cancelled)
+        if confirmed:
+            logger.info("step %d confirmed", step_index, extra={"step": step_index})
+        return confirmed
+
             
 
-    def execute_trajectory(self, trajectory):
-        print("executing trajectory")
+    def execute_trajectory(self, trajectory, step_index = None):
+        """Runs `trajectory` on the robot.
+
+        `trajectory` is a list of :class:`JointTrajectory`, each run with the times and velocities
+        of its points, or a list of configurations without timing.
+
+        Returns
+        -------
+        bool
+            False if the trajectory was not run, e.g. because the executioner was stopped.
+        """
+        with instrumentation.span("trajectory.execute", step=step_index) as span:
+            if self.stop_event.is_set():
+                logger.warning("executioner stopped, not executing step %s", step_index, extra={"step": step_index})
+                span.set(executed=False)
+                return False
+            logger.debug("executing trajectory", extra={"step": step_index})
+            span.set(executed=True)
+            return True
 
 
 if __name__ == '__main__':
-    print("instanting executioner")
+    instrumentation.configure_logging()
+    logger.info("instantiating executioner")
     exc = TimberAssemblyExecutioner()
     exc.run()
     pass
\ No newline at end of file
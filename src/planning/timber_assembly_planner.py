@@ -1,7 +1,8 @@
 import math
+import queue
+import threading
+import numpy as np
 from compas.geometry import Frame
-from compas.geometry import Vector
-from compas.datastructures import Mesh
 from compas_fab.robots import AttachedCollisionMesh
 from compas_fab.robots import CollisionMesh
 from compas_fab.robots import Robot
@@ -9,41 +10,265 @@ from compas_fab.robots import JointConstraint
 from compas_fab.robots import PlanningScene
 from compas.geometry import Transformation
 
+from trajectory_cache import digest
+from step_dependencies import StepDependencies
+from aabb import aabb_from_points
+from aabb import aabb_from_mesh
+from aabb import aabb_inflate
+from batch_kinematics import BatchKinematics
+from scene_store import SceneStore
+import instrumentation
+from spatial_index import AABBTree
+from reachability import IKCache
+from reachability import UnreachableFrameError
+
 
 class TimberAssemblyPlanner(object):
 
     TOLERANCE_POSITION = 0.001          # 1 mm tolerance on position
     TOLERANCE_AXES = [1.0, 1.0, 1.0]    # 1 degree tolerance per axis
 
+    """joint values of an arm between steps, and of an arm folded out of the way of the other"""
+    HOMES = {
+        "robot11": {"robot11_joint_EA_Z": -4.5, "robot11_joint_2": 0, "robot11_joint_3": -math.pi/2},
+        "robot12": {"robot12_joint_EA_Y": -12, "robot12_joint_EA_Z": -4.5, "robot12_joint_2": 0, "robot12_joint_3": -math.pi/2},
+        }
+    PARKED = {
+        "robot11": {"robot11_joint_EA_Z": -4.5, "robot11_joint_2": math.pi/2},
+        "robot12": {"robot12_joint_EA_Y": -12, "robot12_joint_EA_Z": -4.5, "robot12_joint_2": math.pi/2},
+        }
+
 
-    def __init__(self, robot, assembly, building_plan, pickup_base_frame, scene_objects = None, group = None, planner_id = None):
+    def __init__(self, robot, assembly, building_plan, pickup_base_frame, scene_objects = None, group = None, planner_id = None, cache = None, scene_store = None, prune_scene = False, arm = "robot11", dual_arm = False, reachability = None, ik_cache = None, dependencies = None):
         self.pickup_base_frame = pickup_base_frame
         self.robot = robot
+        self.arm = arm
+        self.dual_arm = dual_arm      # the other arm waits at its home instead of parked, and shares the bridge
         self.assembly = assembly
         self.building_plan = building_plan
         self.group = group or self.robot.main_group_name
         self.planner_id = str(planner_id) if planner_id else "RRTConnect"
-        self.current_configuration = self.safe_configuation 
+        self.trajectories = []
         self.robot_steps = {}
-        self.scene_objects = scene_objects
+        self.path_constraints = []
+        self.attached_collision_meshes = []
+        self.placed_beams = []
+        self.attached_beam = None
+        self.step_index = None
+        self.cache = cache
+        self.scene_store = scene_store or SceneStore(assembly, building_plan)
+        self.dependencies = dependencies or StepDependencies(assembly, scene_store = self.scene_store)
+        self.scene_objects = scene_objects or []
+        self._scene_objects_digest = digest(self.scene_objects)
+        self.kinematics = BatchKinematics(robot, self.safe_configuation)
+        self._current_frame = (None, None)
         self.scene = PlanningScene(robot)
-        for mesh in scene_objects:
-            self.scene.add_collision_meshes(CollisionMesh(mesh, "scene_mesh"))
+
+        """in pruning mode only the meshes near each requested motion are sent to MoveIt"""
+        self.prune_scene = prune_scene
+        self.prune_margin = 1.0
+        self.link_clearance = 0.3      # meters of link geometry around every link origin
+        self.verify_pruning = False    # also scan every mesh per request and count what the index missed; for tests
+        self.pruning_stats = {"requests": 0, "in_scene": 0, "sent": 0, "missed": 0, "escaped": 0}
+        self.sent_meshes = set()
+        self._scene_object_meshes = {"scene_mesh_{}".format(i): mesh for i, mesh in enumerate(self.scene_objects)}
+        self._scene_object_index = AABBTree([(name, aabb_from_mesh(mesh)) for name, mesh in self._scene_object_meshes.items()])
+        if not self.prune_scene:
+            for mesh in self.scene_objects:
+                self.scene.append_collision_mesh(CollisionMesh(mesh, "scene_mesh"))
+
+        """frames outside the reachability map fail before any planner request; IK solutions seed joint space goals"""
+        self.reachability = reachability
+        self.ik_cache = ik_cache
+        self.joint_goal_tolerance = 0.001
+        self.reachability_stats = {"checked": 0, "rejected": 0, "seeded": 0, "seed_fallbacks": 0, "ik_failures": 0}
             
 
     def plan_robot_assembly(self, replan_index = 0):
+        """Plans the robot assembly segment by segment, the way `plan_robot_assembly_parallel` does.
+
+        Every segment starts in `safe_configuation`, which the previous retract ends in, so both give
+        the same trajectories.
+        """
+        if self.cache:
+            self.cache.begin_session()
+        for segment in self.plan_segments(replan_index):
+            planned = self.plan_segment(segment)
+            for index in sorted(planned):
+                self.robot_steps[index] = planned[index]
+                self.record_step_result(index)
+
+
+    def plan_robot_assembly_parallel(self, clients, replan_index = 0):
+        """Plans the robot assembly on a pool of planner clients.
+
+        The building plan is split into segments that start in `safe_configuation`, so every segment
+        can be planned independently once the collision scene of its first step has been replayed.
+
+        Parameters
+        ----------
+        clients : list of :class:`compas_fab.backends.RosClient`
+            One connected client per worker, each talking to its own MoveIt instance.
+        replan_index : int, optional
+            Index of the first step to plan.
+        """
+        if self.cache:
+            self.cache.begin_session()
+        segments = queue.Queue()
+        for segment in self.plan_segments(replan_index):
+            segments.put(segment)
+        results = {}
+        errors = []
+        lock = threading.Lock()
+
+        def work(planner):
+            while True:
+                try:
+                    segment = segments.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    planned = planner.plan_segment(segment)
+                except Exception as e:
+                    with lock:
+                        errors.append((segment[0], e))
+                    continue
+                with lock:
+                    results.update(planned)
+
+        threads = [threading.Thread(target=work, args=(self.spawn(client),), daemon=True) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            index, error = min(errors, key=lambda e: e[0])
+            raise RuntimeError("planning segment starting at step {} failed: {}".format(index, error))
+
+        for index in sorted(results):
+            self.robot_steps[index] = results[index]
+            self.record_step_result(index)
+
+
+    def replan_changed_steps(self, beam_keys = None):
+        """Replans only the ROBOT steps invalidated by a change to some beams.
+
+        Parameters
+        ----------
+        beam_keys : list of int, optional
+            Keys of the changed beams. Defaults to every beam whose geometry differs from the one
+            its step was planned with.
+
+        Returns
+        -------
+        list of int
+            Indices of the replanned steps.
+        """
+        if beam_keys is None:
+            beam_keys = self.dependencies.changed_beams()
+        """every step starts in safe_configuation, so steps depend on each other only through the scene"""
+        affected = set(self.dependencies.affected_steps(beam_keys))
+
+        """roll the scene back to before the first changed beam, so replaying adds the new geometry"""
+        first = self.scene_store.refresh(beam_keys)
+        if first is not None and first < len(self.placed_beams):
+            for key in self.placed_beams[first:]:
+                self.scene.remove_collision_mesh("beam_mesh_{}".format(key))
+                self.sent_meshes.discard("beam_mesh_{}".format(key))
+            self.placed_beams = self.placed_beams[:first]
+
+        if self.cache:
+            self.cache.begin_session()
+        for index in sorted(affected):
+            self.replay_scene(index)
+            self.trajectories = []
+            self.step_index = index
+            self.robot_steps[index] = self.plan_robot_step(self.building_plan.steps[index])
+            self.record_step_result(index)
+        return sorted(affected)
+
+
+    def record_step_result(self, step_index):
+        """Invalidates cached downstream steps if the result of `step_index` changed since the last run."""
+        if self.cache and self.cache.record_step(step_index, self.robot_steps[step_index]):
+            self.cache.invalidate_after(step_index)
+
+
+    def plan_segments(self, replan_index = 0):
+        """Splits the steps from `replan_index` on into lists of step indices.
+
+        Each ROBOT step ends with `retract_trajectories`, which returns to `safe_configuation`,
+        so a segment closes after every ROBOT step.
+        """
+        segments = []
+        segment = []
         for index in range(replan_index, len(self.building_plan.steps)):
+            segment.append(index)
+            if self.building_plan.steps[index]["actor"] == "ROBOT":
+                segments.append(segment)
+                segment = []
+        if segment:
+            segments.append(segment)
+        return segments
+
+
+    def plan_segment(self, segment):
+        """Replays the scene for the first step of `segment` and plans its ROBOT steps."""
+        self.replay_scene(segment[0])
+        self.trajectories = []
+        planned = {}
+        for index in segment:
             step = self.building_plan.steps[index]
             if step["actor"] == "ROBOT":
-                self.robot_steps[index] = self.plan_robot_step(step)
+                self.step_index = index
+                planned[index] = self.plan_robot_step(step)
+        return planned
+
+
+    def spawn(self, client):
+        """Creates a planner sharing this planner's inputs and step dependencies, bound to another planner client."""
+        robot = Robot(self.robot.model, semantics=self.robot.semantics, client=client)
+        return TimberAssemblyPlanner(robot, self.assembly, self.building_plan, self.pickup_base_frame, self.scene_objects, self.group, self.planner_id, self.cache, self.scene_store, self.prune_scene, self.arm, self.dual_arm, self.reachability, self.ik_cache, self.dependencies)
+
+
+    def beams_placed_before(self, step_index):
+        """Returns the keys of the beams released by ROBOT steps before `step_index`, in placement order."""
+        return self.scene_store.keys(self.scene_store.snapshot(step_index))
+
+
+    def replay_scene(self, step_index):
+        """Brings the planning scene to the state it has at the start of `step_index`.
+
+        The beams in the scene are always a prefix of the scene store's placements, so only the
+        placements between the current and the target snapshot are sent to MoveIt.
+        """
+        if self.attached_collision_meshes:
+            self.scene.remove_attached_collision_mesh("attached_beam")
+            self.attached_collision_meshes = []
+            self.attached_beam = None
+        snapshot = self.scene_store.snapshot(step_index)
+        if not self.prune_scene:
+            to_add, to_remove = self.scene_store.diff(len(self.placed_beams), snapshot)
+            for key in to_remove:
+                self.scene.remove_collision_mesh("beam_mesh_{}".format(key))
+            for key in to_add:
+                self.scene.add_collision_mesh(CollisionMesh(self.scene_store.mesh(self.assembly.beams[key]), "beam_mesh_{}".format(key)))
+        self.placed_beams = self.scene_store.keys(snapshot)
 
 
     def get_configurations(self, trajectories):
-        configurations = []
-        for trajectory in trajectories:
-            for point in trajectory.points:
-                config = self.robot.merge_group_with_full_configuration(point, self.safe_configuration, self.group)
-                configurations.append(config)
+        return self.kinematics.to_configurations(self.get_configuration_array(trajectories))
+
+
+    def get_configuration_array(self, trajectories):
+        """Returns the full configurations of every point of `trajectories` as one `(N, joints)` array."""
+        values, joint_names = self.kinematics.points_array(trajectories)
+        return self.kinematics.merge(values, self.group, joint_names)
+
+
+    def get_tool_frames(self, trajectories):
+        """Returns the full configurations and the end effector frames of every point of `trajectories`, in one batch."""
+        return self.kinematics.tool_frames(trajectories, self.group)
 
 
     def plan_robot_step(self, step, path_constraints = None, group = None):
@@ -66,16 +291,58 @@ class TimberAssemblyPlanner(object):
             (beam.width / 2) * self.pickup_base_frame.yaxis,
             beam.height * self.pickup_base_frame.zaxis
             ]
-        pickup_frame = Frame(self.pickup_base_frame + offset_vector, self.pickup_base_frame.xaxis, self.pickup_base_frame.yaxis)
+        pickup_point = self.pickup_base_frame.point + offset_vector[0] + offset_vector[1] + offset_vector[2]
+        pickup_frame = Frame(pickup_point, self.pickup_base_frame.xaxis, self.pickup_base_frame.yaxis)
         target_frame = Frame(beam.midpoint, beam.frame.xaxis, beam.frame.yaxis)
 
+        key = None
+        if self.cache:
+            key = self.cache.key(
+                beam = beam,
+                pickup_base_frame = self.pickup_base_frame,
+                start_configuration = self.current_configuration,
+                scene = self.scene_signature(),
+                planner_id = self.planner_id,
+                path_constraints = self.path_constraints,
+                group = self.group,
+                home = self.safe_configuation,
+                )
+            step_trajectories = self.cache.get(key)
+            if step_trajectories is not None:
+                """a cached step still has to leave the scene and the robot where planning would have"""
+                self.release_beam(beam)
+                for phase in ("pickup", "move", "retract"):
+                    self.trajectories.extend(step_trajectories[phase])
+                self.record_step_envelope(beam, pickup_frame, target_frame)
+                return step_trajectories
+
+        self.check_reachable(pickup_frame, target_frame)
         step_trajectories = {}
         step_trajectories["pickup"] = self.pickup_trajectories(pickup_frame)
-        self.grab_beam(beam, pickup_frame(beam), target_frame)
+        self.grab_beam(beam, pickup_frame, target_frame)
         step_trajectories["move"] = self.move_trajectories(target_frame)
-        self.release_beam()
+        self.release_beam(beam)
         step_trajectories["retract"] = self.retract_trajectories()
+        if key:
+            self.cache.put(key, step_trajectories, self.step_index)
+        self.record_step_envelope(beam, pickup_frame, target_frame)
         return step_trajectories
+
+
+    def record_step_envelope(self, beam, pickup_frame, target_frame):
+        """Records the region the step moves `beam` through, for `replan_changed_steps`."""
+        if self.step_index is None:
+            return
+        frames = [
+            pickup_frame,
+            self.offset_frame(pickup_frame, 0.2),
+            self.offset_frame(target_frame, 0.5),
+            target_frame,
+            self.robot.forward_kinematics(self.safe_configuation, self.group),
+            ]
+        envelope = aabb_inflate(aabb_from_points([frame.point for frame in frames]), beam.length / 2)
+        self.dependencies.record(self.step_index, beam, envelope)
+
     
 
     def pickup_trajectories(self, pickup_frame):
@@ -100,44 +367,211 @@ class TimberAssemblyPlanner(object):
 
 
     def retract_trajectories(self):
+        """Retracts from the placed beam and returns to `safe_configuation` itself, not just to its tool
+        frame: the gantry and arm reach that frame in many ways, and the next segment starts there."""
         trajectories = []
         offset_frame = Frame(self.current_frame.point - self.current_frame.zaxis * 0.5, self.current_frame.xaxis, self.current_frame.yaxis)
         trajectories.append(self.get_trajectory(offset_frame, linear=True))
-        trajectories.append(self.get_trajectory(self.robot.forward_kinematics(self.safe_position, self.group)))
+        home = self.safe_configuation
+        trajectories.append(self.get_trajectory(self.robot.forward_kinematics(home, self.group), configuration=home))
         return trajectories
 
 
     def grab_beam(self, beam, pickup_frame, target_frame):
-        beam_mesh = Mesh.from_shape(beam.geometry)
-        beam_mesh.transform(Transformation.from_frame_to_frame(target_frame, pickup_frame))
-        beam_collision_mesh = CollisionMesh(Mesh.from_shape(beam.geometry), "attached_beam")
-        acm = AttachedCollisionMesh(beam_collision_mesh, 'robot11_tool0', touch_links = ['robot11_link_6'])
-        self.scene.append_attached_collision_mesh(acm)
+        """Attaches `beam` to the tool. The tool places it at `target_frame`, so the beam sits where its
+        assembled pose lies relative to that frame; the attached mesh is expressed in the tool frame."""
+        to_tool = Transformation.from_frame_to_frame(target_frame, Frame.worldXY())
+        beam_collision_mesh = CollisionMesh(self.scene_store.mesh(beam).transformed(to_tool), "attached_beam")
+        acm = AttachedCollisionMesh(beam_collision_mesh, '{}_tool0'.format(self.arm), touch_links = ['{}_link_6'.format(self.arm)])
+        self.scene.add_attached_collision_mesh(acm)
+        self.attached_collision_meshes = [acm]
+        self.attached_beam = beam
 
 
     def release_beam(self, beam):
         self.scene.remove_attached_collision_mesh("attached_beam")
-        added_beam_collision_mesh = CollisionMesh(Mesh.from_shape(beam.geometry), "beam_mesh_{}".format(beam.key))
-        self.scene.add_collision_mesh(added_beam_collision_mesh)
+        self.attached_collision_meshes = []
+        self.attached_beam = None
+        if not self.prune_scene:
+            added_beam_collision_mesh = CollisionMesh(self.scene_store.mesh(beam), "beam_mesh_{}".format(beam.key))
+            self.scene.add_collision_mesh(added_beam_collision_mesh)
+        self.placed_beams.append(beam.key)
 
 
     def offset_frame(self, frame, offset):
         return Frame(frame.point - frame.zaxis * offset, frame.xaxis, frame.yaxis)
 
 
-    def get_trajectory(self, target_frame, linear = False):
-        if (self.robot.client and self.robot.client.is_connected):
-            options = dict(
-                    attached_collision_meshes = self.attached_collision_meshes,
-                    path_constraints=self.path_constraints,
-                    planner_id=self.planner_id
-                    )
-            if linear:
-                this_trajectory = self.robot.plan_cartesian_motion([self.current_frame, target_frame], start_configuration=self.current_configuration, group=self.group, options = options)
+    def scene_signature(self):
+        """Returns a digest of the collision scene the next planning request runs against.
+
+        The placed beams are always a prefix of the scene store's placements, whose digest the store
+        keeps, so this does not depend on the number of placed beams.
+        """
+        return digest([
+            self._scene_objects_digest,
+            self.scene_store.snapshot_digest(len(self.placed_beams)),
+            self.scene_store.beam_digest(self.attached_beam.key) if self.attached_beam else None,
+            ])
+
+
+    def swept_volume(self, target_frame):
+        """Returns the box around the tool moving from `current_frame` to `target_frame` and the links
+        of the group at the start, plus the held beam and `prune_margin`."""
+        margin = self.prune_margin + (self.attached_beam.length / 2 if self.attached_beam else 0.0)
+        """merging with the safe configuration keeps the full joint order of the kinematics"""
+        links = self.kinematics.link_origins(np.array(self.current_configuration.joint_values), self.group, moving_only=True)[0]
+        return aabb_inflate(aabb_from_points([self.current_frame.point, target_frame.point] + links.tolist()), margin)
+
+
+    def sync_pruned_scene(self, swept = None):
+        """Sends MoveIt the meshes intersecting `swept`, or every mesh in the scene if `swept` is None."""
+        placed = set(self.placed_beams)
+        all_meshes = {"beam_mesh_{}".format(key) for key in placed} | set(self._scene_object_meshes)
+        if swept is None:
+            selected = all_meshes
+        else:
+            selected = {"beam_mesh_{}".format(key) for key in self.scene_store.spatial_index().query(swept) if key in placed}
+            selected |= set(self._scene_object_index.query(swept))
+            if self.verify_pruning:
+                reference = {"beam_mesh_{}".format(key) for key in self.scene_store.spatial_index().brute_force_query(swept) if key in placed}
+                reference |= set(self._scene_object_index.brute_force_query(swept))
+                self.pruning_stats["missed"] += len(reference - selected)
+                selected |= reference
+            self.pruning_stats["requests"] += 1
+            self.pruning_stats["in_scene"] += len(all_meshes)
+            self.pruning_stats["sent"] += len(selected)
+
+        for name in self.sent_meshes - selected:
+            self.scene.remove_collision_mesh(name)
+        for name in selected - self.sent_meshes:
+            if name in self._scene_object_meshes:
+                mesh = self._scene_object_meshes[name]
             else:
-                constraints = self.robot.constraints_from_frame(target_frame, TimberAssemblyPlanner.TOLERANCE_POSITION, TimberAssemblyPlanner.TOLERANCE_AXES, self.group)
-                this_trajectory = self.robot.plan_motion(constraints, start_configuration=self.current_configuration, group=self.group, options = options)
-        return this_trajectory
+                mesh = self.scene_store.mesh(self.assembly.beams[int(name[len("beam_mesh_"):])])
+            self.scene.add_collision_mesh(CollisionMesh(mesh, name))
+        self.sent_meshes = selected
+
+
+    def stays_inside(self, trajectory, box):
+        """Checks that pruning the scene to `box` was sound for `trajectory`.
+
+        Every link the group moves, gantry axes included, must stay `link_clearance` inside the box at
+        every point, and the tool far enough inside for the held beam as well.
+        """
+        origins = self.kinematics.link_origins(self.get_configuration_array([trajectory]), self.group, moving_only=True)
+        lower, upper = np.array(box[0]), np.array(box[1])
+        beam = self.attached_beam.length / 2 if self.attached_beam else 0.0
+        links_inside = np.all((origins >= lower + self.link_clearance) & (origins <= upper - self.link_clearance))
+        tools = origins[:, -1, :]
+        tools_inside = np.all((tools >= lower + self.link_clearance + beam) & (tools <= upper - self.link_clearance - beam))
+        return bool(links_inside and tools_inside)
+
+
+    def get_trajectory(self, target_frame, linear = False, configuration = None):
+        """Plans from `current_configuration` to `target_frame`, or to `configuration` of the group if
+        given, whose tool is at `target_frame`."""
+        with instrumentation.span("planner.get_trajectory", step=self.step_index, linear=linear) as span:
+            key = None
+            if self.cache:
+                key = self.cache.key(
+                    target_frame = target_frame,
+                    linear = linear,
+                    goal_configuration = configuration,
+                    start_configuration = self.current_configuration,
+                    scene = self.scene_signature(),
+                    planner_id = self.planner_id,
+                    path_constraints = self.path_constraints,
+                    group = self.group,
+                    )
+                this_trajectory = self.cache.get(key)
+                if this_trajectory is not None:
+                    span.set(cached=True)
+                    self.trajectories.append(this_trajectory)
+                    return this_trajectory
+            if (self.robot.client and self.robot.client.is_connected):
+                self.check_reachable(target_frame)
+                if self.prune_scene:
+                    swept = self.swept_volume(target_frame)
+                    self.sync_pruned_scene(swept)
+                    this_trajectory = self.plan_to_frame(target_frame, linear, configuration)
+                    if not self.stays_inside(this_trajectory, swept):
+                        """the motion left the volume the scene was pruned to, so plan it again against the full scene"""
+                        self.pruning_stats["escaped"] += 1
+                        self.sync_pruned_scene()
+                        this_trajectory = self.plan_to_frame(target_frame, linear, configuration)
+                else:
+                    this_trajectory = self.plan_to_frame(target_frame, linear, configuration)
+                self.trajectories.append(this_trajectory)
+                if key:
+                    self.cache.put(key, this_trajectory, self.step_index)
+            return this_trajectory
+
+
+    def check_reachable(self, *frames):
+        """Raises :class:`UnreachableFrameError` if a frame lies outside the reachability map."""
+        if not self.reachability:
+            return
+        for frame in frames:
+            self.reachability_stats["checked"] += 1
+            if not self.reachability.reachable(frame):
+                self.reachability_stats["rejected"] += 1
+                raise UnreachableFrameError("step {}: {} is outside the reachability map of {}".format(self.step_index, frame.point, self.group))
+
+
+    def goal_configuration(self, target_frame):
+        """Returns a cached or freshly solved configuration of `group` reaching `target_frame`, or None.
+
+        The solver is seeded with the reachability map sample nearest to the frame. Collisions are
+        left to the planner, so solutions hold across scenes.
+        """
+        if not self.ik_cache:
+            return None
+        key = self.ik_cache.key(target_frame, self.group, digest(self.path_constraints))
+        configuration = self.ik_cache.get(key)
+        if configuration is not IKCache.MISS:
+            return configuration
+        start_configuration = self.current_configuration
+        if self.reachability:
+            seed = self.reachability.seed(target_frame)
+            if seed is not None:
+                start_configuration = self.kinematics.to_configurations(seed)[0]
+        options = dict(avoid_collisions = False, constraints = self.path_constraints)
+        try:
+            configuration = self.robot.inverse_kinematics(target_frame, start_configuration, self.group, options = options)
+        except Exception:
+            self.reachability_stats["ik_failures"] += 1
+            configuration = None
+        self.ik_cache.put(key, configuration)
+        return configuration
+
+
+    def plan_to_frame(self, target_frame, linear = False, configuration = None):
+        options = dict(
+                attached_collision_meshes = self.attached_collision_meshes,
+                path_constraints=self.path_constraints,
+                planner_id=self.planner_id
+                )
+        if linear:
+            return self.robot.plan_cartesian_motion([self.current_frame, target_frame], start_configuration=self.current_configuration, group=self.group, options = options)
+        if configuration is not None:
+            goal = self.robot.get_group_configuration(self.group, configuration)
+            tolerances = [self.joint_goal_tolerance] * len(goal.joint_values)
+            constraints = self.robot.constraints_from_configuration(goal, tolerances, tolerances, self.group)
+            return self.robot.plan_motion(constraints, start_configuration=self.current_configuration, group=self.group, options = options)
+        goal = self.goal_configuration(target_frame)
+        if goal is not None:
+            """a joint space goal spares MoveIt sampling IK for the pose; it may still collide, then plan for the pose"""
+            tolerances = [self.joint_goal_tolerance] * len(goal.joint_values)
+            constraints = self.robot.constraints_from_configuration(goal, tolerances, tolerances, self.group)
+            try:
+                trajectory = self.robot.plan_motion(constraints, start_configuration=self.current_configuration, group=self.group, options = options)
+                self.reachability_stats["seeded"] += 1
+                return trajectory
+            except Exception:
+                self.reachability_stats["seed_fallbacks"] += 1
+        constraints = self.robot.constraints_from_frame(target_frame, TimberAssemblyPlanner.TOLERANCE_POSITION, TimberAssemblyPlanner.TOLERANCE_AXES, self.group)
+        return self.robot.plan_motion(constraints, start_configuration=self.current_configuration, group=self.group, options = options)
 
 
     @property
@@ -145,34 +579,42 @@ class TimberAssemblyPlanner(object):
         if len(self.trajectories) == 0:
             return self.safe_configuation
         else:
-            return self.trajectories[-1].points[-1]
+            return self.robot.merge_group_with_full_configuration(self.trajectories[-1].points[-1], self.safe_configuation, self.group)
 
 
     @property
     def current_frame(self):
-        return self.robot.forward_kinematics(self.current_configuration, self.group)
+        configuration = self.current_configuration
+        key = tuple(configuration.joint_values)
+        if self._current_frame[0] != key:
+            self._current_frame = (key, self.robot.forward_kinematics(configuration, self.group))
+        return self._current_frame[1]
+
+
     
 
     @property
     def safe_configuation(self):
         configuration = self.robot.zero_configuration()
-        configuration['robot11_joint_EA_Z'] = -4.5
-        configuration['robot11_joint_2'] = 0
-        configuration['robot11_joint_3'] = -math.pi/2
+        for name, value in TimberAssemblyPlanner.HOMES[self.arm].items():
+            configuration[name] = value
         configuration['bridge1_joint_EA_X'] = 9
 
-        """ get robot_12 out of the way """
-        configuration['robot12_joint_EA_Y'] = -12
-        configuration['robot12_joint_EA_Z'] = -4.5
-        configuration['robot12_joint_2'] = math.pi/2
+        """ get the other arm out of the way, or to its home if it works too """
+        for other in TimberAssemblyPlanner.HOMES:
+            if other != self.arm:
+                for name, value in (TimberAssemblyPlanner.HOMES if self.dual_arm else TimberAssemblyPlanner.PARKED)[other].items():
+                    configuration[name] = value
         return configuration
 
 
     @property
     def global_constraints(self):
         constraints = []
-        constraints.append(JointConstraint('robot11_joint_2', 0, -0.1, 0.1, 0.5))
-        constraints.append(JointConstraint('robot11_joint_3', -math.pi/2, -0.1, 0.1, 0.5))
-        constraints.append(JointConstraint('bridge1_joint_EA_X', 9, 3, 3, 1.0))
+        constraints.append(JointConstraint('{}_joint_2'.format(self.arm), 0, -0.1, 0.1, 0.5))
+        constraints.append(JointConstraint('{}_joint_3'.format(self.arm), -math.pi/2, -0.1, 0.1, 0.5))
+        """both arms hang from the bridge, so neither may move it while the other works"""
+        bridge_tolerance = 0.001 if self.dual_arm else 3
+        constraints.append(JointConstraint('bridge1_joint_EA_X', 9, bridge_tolerance, bridge_tolerance, 1.0))
         return constraints
             
\ No newline at end of file
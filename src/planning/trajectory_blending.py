@@ -0,0 +1,342 @@
+"""Merging of the sub-trajectories of a step phase into one continuous, time-parameterized trajectory.
+
+Planned trajectories start and end at rest, so a phase made of several of them stops at every
+junction. Blending treats the points of all of them as one joint-space path and re-times it:
+
+- The path is first thinned to the waypoints needed to follow it within half of `tolerance`, so
+  blends have room to round corners instead of being squeezed between closely spaced points.
+- Joints are scaled by their velocity limits, so the path speed is at most 1 and the per-joint
+  speed limit becomes a single bound on an infinity norm.
+- At every waypoint the path turns, and a parabolic blend rounds the corner. The speed through
+  a corner is limited so that the blend deviates from the waypoint by at most half of `tolerance` on
+  every joint and leaves at least half of each neighbouring segment straight.
+- A forward and a backward pass over the waypoints, both cumulative minima, limit the speed
+  changes along the straight parts to the acceleration limit.
+- Reversals and waypoints rejected by the recheck are stops.
+
+Limits default to the largest velocity and acceleration of every joint in the input, so the
+blended trajectory moves no faster than the planner's. The collision recheck bounds how far the
+tool, and the ends of a held beam, move from where the planned, collision-checked path had them.
+A dropped waypoint that moves them more than `max_tool_deviation` is kept, and a corner that does
+becomes a stop again.
+
+The blended trajectory carries the times and velocities of every point, so it must reach the
+robot as a trajectory, not as its configurations. A phase whose blend is not faster than the
+planned trajectories, e.g. planned at constant speed already, keeps them.
+"""
+import numpy as np
+from compas_fab.robots import Duration
+from compas_fab.robots import JointTrajectory
+from compas_fab.robots import JointTrajectoryPoint
+
+EPSILON = 1e-9
+
+
+def trajectory_arrays(trajectory):
+    """Returns the `(N, joints)` values and the `(N,)` times of the points of `trajectory`."""
+    values = np.array([point.joint_values for point in trajectory.points], dtype=float)
+    times = np.array([point.time_from_start.seconds for point in trajectory.points], dtype=float)
+    return values, times
+
+
+def observed_limits(trajectories):
+    """Returns the largest absolute velocity and acceleration of every joint along `trajectories`, which start and end at rest."""
+    velocity, acceleration = None, None
+    for trajectory in trajectories:
+        values, times = trajectory_arrays(trajectory)
+        dt = np.diff(times)
+        moving = dt > EPSILON
+        if not moving.any():
+            continue
+        v = np.diff(values, axis=0)[moving] / dt[moving, np.newaxis]
+        dt = dt[moving]
+        padded = np.vstack([np.zeros((1, v.shape[1])), v, np.zeros((1, v.shape[1]))])
+        dt_mid = np.concatenate([dt[:1], (dt[1:] + dt[:-1]) / 2, dt[-1:]])
+        a = np.diff(padded, axis=0) / dt_mid[:, np.newaxis]
+        v, a = np.abs(v).max(axis=0), np.abs(a).max(axis=0)
+        velocity = v if velocity is None else np.maximum(velocity, v)
+        acceleration = a if acceleration is None else np.maximum(acceleration, a)
+    return velocity, acceleration
+
+
+def time_parameterize(path, velocity_limits, acceleration_limits, tolerance, stops = ()):
+    """Blends the corners of a joint-space `path` and times it within the limits.
+
+    Parameters
+    ----------
+    path : array
+        `(N, joints)` waypoints; the first and the last are at rest.
+    velocity_limits, acceleration_limits : array
+        Per joint.
+    tolerance : float or array
+        Largest deviation of a blend from its waypoint, on any joint, or one per waypoint of the
+        path without repeated waypoints.
+    stops : list of int, optional
+        Indices of waypoints to stop at, in the path without repeated waypoints.
+
+    Returns
+    -------
+    dict
+        `times`, `positions` and `velocities` of the blended trajectory, and per waypoint of the
+        deduplicated path: `waypoints`, `speeds` (path speed), `blend_times` and `apexes` (the
+        positions closest to each waypoint).
+    """
+    vmax = np.where(velocity_limits > EPSILON, velocity_limits, 1.0)
+    moving = velocity_limits > EPSILON
+    a = float(np.min((acceleration_limits / vmax)[moving])) if moving.any() else 1.0
+
+    u = np.asarray(path, dtype=float) / vmax
+    keep = np.concatenate([[True], np.abs(np.diff(u, axis=0)).max(axis=1) > EPSILON])
+    u = u[keep]
+    if len(u) < 2:
+        return {"times": np.zeros(1), "positions": u * vmax, "velocities": np.zeros_like(u), "waypoints": u * vmax,
+                "speeds": np.zeros(1), "blend_times": np.zeros(1), "apexes": u * vmax}
+
+    tolerance = np.broadcast_to(np.asarray(tolerance, dtype=float), (len(u),))
+    du = np.diff(u, axis=0)
+    ds = np.abs(du).max(axis=1)
+    d = du / ds[:, np.newaxis]                      # segment directions, of unit infinity norm
+    dd = d[1:] - d[:-1]                             # direction change at each interior waypoint
+    turn = np.abs(dd).max(axis=1)
+    turn_joint = np.abs(dd * vmax).max(axis=1)
+
+    """speed limits at the waypoints: the blend must fit in a quarter of each segment and stay within tolerance"""
+    limits = np.zeros(len(u))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fit = np.sqrt(a * np.minimum(ds[:-1], ds[1:]) / (2 * turn))
+        deviation = np.sqrt(8 * a * tolerance[1:-1] / (turn * turn_joint))
+    limits[1:-1] = np.where(turn > EPSILON, np.minimum(1.0, np.minimum(fit, deviation)), 1.0)
+    limits[list(stops)] = 0.0
+
+    """v[i]^2 = min over k of limits[k]^2 + 2a|S[i] - S[k]|, over at least half of each segment"""
+    s = np.concatenate([[0.0], np.cumsum(ds / 2)])
+    forward = 2 * a * s + np.minimum.accumulate(limits ** 2 - 2 * a * s)
+    backward = -2 * a * s + np.minimum.accumulate((limits ** 2 + 2 * a * s)[::-1])[::-1]
+    v = np.sqrt(np.maximum(np.minimum(forward, backward), 0.0))
+
+    tb = np.zeros(len(u))
+    tb[1:-1] = v[1:-1] * turn / a
+    h = v * tb / 2                                  # path length of a blend on each side of its waypoint
+
+    """straight parts: accelerate, cruise and decelerate between the blends"""
+    length = np.maximum(ds - h[:-1] - h[1:], 0.0)
+    v0, v1 = v[:-1], v[1:]
+    peak = np.minimum(1.0, np.sqrt(a * length + (v0 ** 2 + v1 ** 2) / 2))
+    accelerate = (peak ** 2 - v0 ** 2) / (2 * a)
+    decelerate = (peak ** 2 - v1 ** 2) / (2 * a)
+    cruise = np.maximum(length - accelerate - decelerate, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cruise_time = np.where(peak > EPSILON, cruise / peak, 0.0)
+    straight_time = (peak - v0) / a + (peak - v1) / a + cruise_time
+
+    apex_times = np.concatenate([[0.0], np.cumsum(tb[:-1] / 2 + straight_time + tb[1:] / 2)])
+    apexes = u.copy()
+    apexes[1:-1] += (v[1:-1] * tb[1:-1] / 8)[:, np.newaxis] * dd
+    d_in = np.vstack([d[:1], d])
+    d_out = np.vstack([d, d[-1:]])
+
+    blended = tb > 1e-6
+    times = [apex_times, apex_times[blended] - tb[blended] / 2, apex_times[blended] + tb[blended] / 2]
+    positions = [apexes, u[blended] - d_in[blended] * h[blended, np.newaxis], u[blended] + d_out[blended] * h[blended, np.newaxis]]
+    velocities = [v[:, np.newaxis] * (d_in + d_out) / 2, v[blended, np.newaxis] * d_in[blended], v[blended, np.newaxis] * d_out[blended]]
+
+    ramp = accelerate > 1e-6
+    start = apex_times[:-1] + tb[:-1] / 2 + (peak - v0) / a
+    times.append(start[ramp])
+    positions.append(u[:-1][ramp] + d[ramp] * (h[:-1] + accelerate)[ramp, np.newaxis])
+    velocities.append(peak[ramp, np.newaxis] * d[ramp])
+    ramp = decelerate > 1e-6
+    times.append((start + cruise_time)[ramp])
+    positions.append(u[:-1][ramp] + d[ramp] * (h[:-1] + accelerate + cruise)[ramp, np.newaxis])
+    velocities.append(peak[ramp, np.newaxis] * d[ramp])
+
+    times = np.concatenate(times)
+    order = np.argsort(times, kind="stable")
+    times = times[order]
+    distinct = np.concatenate([[True], np.diff(times) > 1e-6])
+    velocities = np.vstack(velocities)[order][distinct]
+    velocities[[0, -1]] = 0.0
+    return {
+        "times": times[distinct],
+        "positions": np.vstack(positions)[order][distinct] * vmax,
+        "velocities": velocities * vmax,
+        "waypoints": u * vmax,
+        "speeds": v,
+        "blend_times": tb,
+        "apexes": apexes * vmax,
+        }
+
+
+class TrajectoryBlender(object):
+    """Post-planning stage merging the trajectories of every phase of a step into one.
+
+    Phases stay separate, since the gripper acts between them. See the module documentation for
+    the blending and the recheck.
+
+    Parameters
+    ----------
+    kinematics : :class:`BatchKinematics`
+        Of the planner, for the forward kinematics of the recheck.
+    group : str
+    tolerance : float, optional
+        Largest deviation of a blend from its waypoint, on any joint, in radians or meters.
+    max_tool_deviation : float, optional
+        Largest distance the tool or a held beam end may move away from the planned path.
+    velocity_limits, acceleration_limits : list, optional
+        Per joint of `group`; by default the largest in the trajectories of each step.
+    max_iterations : int, optional
+        Rounds of recheck and tightening before the corners still rejected become stops.
+
+    """
+
+    PHASES = ("pickup", "move", "retract")
+
+    def __init__(self, kinematics, group, tolerance = 0.01, max_tool_deviation = 0.005, velocity_limits = None, acceleration_limits = None, max_iterations = 5):
+        self.kinematics = kinematics
+        self.group = group
+        self.tolerance = tolerance
+        self.max_tool_deviation = max_tool_deviation
+        self.velocity_limits = None if velocity_limits is None else np.asarray(velocity_limits, dtype=float)
+        self.acceleration_limits = None if acceleration_limits is None else np.asarray(acceleration_limits, dtype=float)
+        self.max_iterations = max_iterations
+        self.reports = {}           # step index -> cycle times of the step
+
+
+    def tool_points(self, values, joint_names, half_length):
+        """Returns the `(N, 3, 3)` tool origin and beam ends along the tool x axis for `(N, group joints)` values."""
+        matrices = self.kinematics.forward_kinematics(self.kinematics.merge(values, self.group, joint_names), self.group)
+        origin = matrices[:, :3, 3]
+        xaxis = matrices[:, :3, 0] * half_length
+        return np.stack([origin, origin + xaxis, origin - xaxis], axis=1)
+
+
+    def simplify(self, path, joint_names, half_length):
+        """Returns the mask of the waypoints of `path` to keep.
+
+        Waypoints are added where the path strays furthest from the chords between the kept ones,
+        until every dropped waypoint is within half of `tolerance` of its chord on every joint, and
+        its tool points within `max_tool_deviation` of those of its projection on the chord.
+        """
+        keep = np.zeros(len(path), dtype=bool)
+        keep[[0, -1]] = True
+        planned = self.tool_points(path, joint_names, half_length)
+        indices = np.arange(len(path))
+        while True:
+            kept = np.flatnonzero(keep)
+            position = np.searchsorted(kept, indices, side="right")
+            left = kept[position - 1]
+            right = kept[np.minimum(position, len(kept) - 1)]
+            chord = path[right] - path[left]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = np.einsum("ij,ij->i", path - path[left], chord) / np.einsum("ij,ij->i", chord, chord)
+            t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+            projections = path[left] + t[:, np.newaxis] * chord
+            joint_deviation = np.abs(path - projections).max(axis=1) / (self.tolerance / 2)
+            tool_deviation = np.linalg.norm(self.tool_points(projections, joint_names, half_length) - planned, axis=2).max(axis=1) / self.max_tool_deviation
+            deviation = np.where(keep, 0.0, np.maximum(joint_deviation, tool_deviation))
+            if not (deviation > 1.0).any():
+                return keep
+            """keep the worst dropped waypoint between each pair of kept ones, then check again"""
+            worst = {}
+            for index in np.flatnonzero(deviation > 1.0):
+                if left[index] not in worst or deviation[index] > deviation[worst[left[index]]]:
+                    worst[left[index]] = index
+            keep[list(worst.values())] = True
+
+
+    def blend(self, trajectories, half_length = 0.0):
+        """Returns one trajectory through the points of `trajectories`, and its report.
+
+        Parameters
+        ----------
+        trajectories : list of :class:`compas_fab.robots.JointTrajectory`
+            Consecutive trajectories of one group, each starting where the previous one ends.
+        half_length : float, optional
+            Half the length of the beam held along the tool x axis, 0 for none.
+
+        """
+        joint_names = list(trajectories[0].joint_names)
+        joint_types = trajectories[0].points[0].joint_types
+        path = np.vstack([trajectory_arrays(trajectory)[0] for trajectory in trajectories])
+        velocity, acceleration = observed_limits(trajectories)
+        velocity = self.velocity_limits if self.velocity_limits is not None else velocity
+        acceleration = self.acceleration_limits if self.acceleration_limits is not None else acceleration
+        original = float(sum(trajectory_arrays(trajectory)[1][-1] for trajectory in trajectories))
+        report = {"trajectories": len(trajectories), "original_duration": original, "waypoints": len(path), "corners": 0, "stops": 0, "max_tool_deviation": 0.0}
+        if velocity is None or len(path) < 3:
+            report.update(blended_duration=original, stops=len(trajectories) - 1)
+            return None, report
+        path = path[self.simplify(path, joint_names, half_length)]
+
+        tolerances = self.tolerance / 2
+        for _ in range(self.max_iterations):
+            result = time_parameterize(path, velocity, acceleration, tolerances)
+            tolerances = np.array(np.broadcast_to(tolerances, result["speeds"].shape))
+            blended = np.flatnonzero(result["blend_times"] > 1e-6)
+            if len(blended) == 0:
+                deviation = np.zeros(0)
+                break
+            """recheck: the apex of a blend is where it strays furthest from the planned path"""
+            planned = self.tool_points(result["waypoints"][blended], joint_names, half_length)
+            apexes = self.tool_points(result["apexes"][blended], joint_names, half_length)
+            deviation = np.linalg.norm(apexes - planned, axis=2).max(axis=1)
+            rejected = deviation > self.max_tool_deviation
+            if not rejected.any():
+                break
+            """the apex deviation grows in proportion to the tolerance, so tighten the rejected corners to match"""
+            tolerances[blended[rejected]] *= 0.9 * self.max_tool_deviation / deviation[rejected]
+        else:
+            stops = blended[rejected].tolist()
+            result = time_parameterize(path, velocity, acceleration, tolerances, stops)
+            deviation = deviation[~rejected]
+
+        waypoints = len(result["speeds"])
+        report.update(
+            blended_duration=float(result["times"][-1]),
+            corners=int(np.count_nonzero(result["blend_times"] > 1e-6)),
+            stops=int(np.count_nonzero(result["speeds"][1:-1] < 1e-6)) if waypoints > 2 else 0,
+            max_tool_deviation=float(deviation.max()) if len(deviation) else 0.0,
+            kept_waypoints=waypoints,
+            points=len(result["times"]),
+            )
+
+        points = []
+        for time, values, velocities in zip(result["times"], result["positions"], result["velocities"]):
+            points.append(JointTrajectoryPoint(values.tolist(), joint_types, velocities.tolist(), [0.0] * len(values),
+                                               time_from_start=Duration(int(time), int(round((time - int(time)) * 1e9))), joint_names=joint_names))
+        return JointTrajectory(points, joint_names, trajectories[0].start_configuration, fraction=1.0), report
+
+
+    def blend_step(self, step_index, step_trajectories, beam_length = 0.0):
+        """Returns the trajectories of a step with each phase merged into one where that is faster, and records its cycle times."""
+        blended = {}
+        phases = {}
+        for phase in TrajectoryBlender.PHASES:
+            trajectories = step_trajectories[phase]
+            trajectory, report = self.blend(trajectories, beam_length / 2 if phase == "move" else 0.0)
+            report["blended"] = trajectory is not None and report["blended_duration"] < report["original_duration"]
+            if not report["blended"]:
+                report["blended_duration"] = report["original_duration"]
+            blended[phase] = [trajectory] if report["blended"] else list(trajectories)
+            phases[phase] = report
+        original = sum(report["original_duration"] for report in phases.values())
+        duration = sum(report["blended_duration"] for report in phases.values())
+        self.reports[step_index] = {
+            "phases": phases,
+            "original_duration": original,
+            "blended_duration": duration,
+            "reduction": 1.0 - duration / original if original > 0 else 0.0,
+            }
+        return blended
+
+
+    def report(self):
+        """Returns the cycle times of every blended step and of all of them together."""
+        original = sum(report["original_duration"] for report in self.reports.values())
+        blended = sum(report["blended_duration"] for report in self.reports.values())
+        return {
+            "steps": {index: self.reports[index] for index in sorted(self.reports)},
+            "original_duration": original,
+            "blended_duration": blended,
+            "reduction": 1.0 - blended / original if original > 0 else 0.0,
+            }
@@ -0,0 +1,229 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from compas.data import json_dumps
+from compas.data import json_loads
+
+
+class TrajectoryCache(object):
+    """Persistent content-addressed cache of planned trajectories.
+
+    Entries are stored as one compas JSON file per key in `directory`, named `<key>.<step>.json`
+    so the index can be rebuilt from the file names alone. The least recently used entries are
+    evicted once `max_entries` or `max_bytes` is exceeded.
+
+    Parameters
+    ----------
+    directory : str
+        Folder holding the cache files. Created if it does not exist.
+    max_entries : int, optional
+        Maximum number of stored entries.
+    max_bytes : int, optional
+        Maximum total size of the stored entries.
+
+    Attributes
+    ----------
+    hits, misses, stores, evictions, invalidations : int
+        Counters since the cache was opened.
+
+    """
+
+    STEPS_FILE = "steps.json"
+    NO_STEP = -1
+
+    def __init__(self, directory, max_entries = 10000, max_bytes = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.session_keys = set()
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()    # key -> (step, size), least recently used first
+        self._bytes = 0
+        self._step_digests = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load_index()
+
+
+    def _load_index(self):
+        files = []
+        for name in os.listdir(self.directory):
+            parts = name.split(".")
+            if len(parts) != 3 or parts[2] != "json":
+                continue
+            try:
+                step = int(parts[1])
+            except ValueError:
+                continue
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, parts[0], step, stat.st_size))
+        for _, key, step, size in sorted(files):
+            self._entries[key] = (step, size)
+            self._bytes += size
+        steps_path = os.path.join(self.directory, TrajectoryCache.STEPS_FILE)
+        if os.path.exists(steps_path):
+            with open(steps_path) as f:
+                self._step_digests = {int(k): v for k, v in json.load(f).items()}
+
+
+    @staticmethod
+    def key(**inputs):
+        """Returns the hex digest identifying a set of planning inputs."""
+        return digest(inputs)
+
+
+    def _path(self, key, step):
+        return os.path.join(self.directory, "{}.{}.json".format(key, step))
+
+
+    def get(self, key):
+        """Returns the stored result for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            path = self._path(key, entry[0])
+            try:
+                with open(path) as f:
+                    value = json_loads(f.read())
+            except (IOError, OSError, ValueError):
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            os.utime(path, None)
+            self.session_keys.add(key)
+            self.hits += 1
+            return value
+
+
+    def put(self, key, value, step = None):
+        """Stores `value` (a trajectory or a structure of trajectories) under `key`."""
+        step = TrajectoryCache.NO_STEP if step is None else step
+        text = json_dumps(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            path = self._path(key, step)
+            with open(path + ".tmp", "w") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+            size = len(text)
+            self._entries[key] = (step, size)
+            self._bytes += size
+            self.session_keys.add(key)
+            self.stores += 1
+            self._evict()
+
+
+    def _drop(self, key):
+        step, size = self._entries.pop(key)
+        self._bytes -= size
+        try:
+            os.remove(self._path(key, step))
+        except OSError:
+            pass
+
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._drop(key)
+            self.evictions += 1
+
+
+    def record_step(self, step_index, result):
+        """Records the digest of a step's planned result.
+
+        Returns
+        -------
+        bool
+            True if the result differs from the one recorded by an earlier run.
+        """
+        result_digest = digest(result)
+        with self._lock:
+            changed = self._step_digests.get(step_index) != result_digest
+            if changed:
+                self._step_digests[step_index] = result_digest
+                with open(os.path.join(self.directory, TrajectoryCache.STEPS_FILE), "w") as f:
+                    json.dump(self._step_digests, f)
+            return changed
+
+
+    def invalidate_after(self, step_index):
+        """Drops the entries of every step after `step_index` that were not used in this session.
+
+        Called when an upstream step's result changed: downstream entries were planned from the
+        old result and would only linger until evicted.
+        """
+        with self._lock:
+            stale = [key for key, (step, _) in self._entries.items() if step > step_index and key not in self.session_keys]
+            for key in stale:
+                self._drop(key)
+            for step in [s for s in self._step_digests if s > step_index]:
+                del self._step_digests[step]
+            self.invalidations += len(stale)
+            return len(stale)
+
+
+    def begin_session(self):
+        """Starts a new planning run; entries used from here on are protected from invalidation."""
+        with self._lock:
+            self.session_keys = set()
+
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+            self._step_digests = {}
+
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                }
+
+
+def canonical(obj, precision = 9):
+    """Converts planning inputs (compas data, constraints, numbers, containers) to plain sorted JSON values."""
+    if isinstance(obj, float):
+        return round(obj, precision)
+    if obj is None or isinstance(obj, (bool, int, str)):
+        return obj
+    if isinstance(obj, dict):
+        return {str(k): canonical(v, precision) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [canonical(v, precision) for v in obj]
+    if hasattr(obj, "tolist"):
+        return canonical(obj.tolist(), precision)
+    """compas 2 data is in `__data__`, compas 1 data in `data`; other attributes may hold guids and caches"""
+    if hasattr(obj, "__data__"):
+        return {"type": type(obj).__name__, "data": canonical(obj.__data__, precision)}
+    if hasattr(obj, "data"):
+        return {"type": type(obj).__name__, "data": canonical(obj.data, precision)}
+    return {"type": type(obj).__name__, "data": canonical(vars(obj), precision)}
+
+
+def digest(obj):
+    text = json.dumps(canonical(obj), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,79 @@
+"""Keyframe reduction of trajectories for progressive AR previews.
+
+Points are ranked with a joint-space Ramer-Douglas-Peucker split: the error of a point is its
+largest per-joint deviation from the linear interpolation between the two keyframes it was split
+from. The preview holds the endpoints and every point whose error exceeds the tolerance, so linear
+interpolation of the preview stays within the tolerance of the full trajectory on every joint.
+Refinement chunks add the remaining points in decreasing order of error.
+"""
+from configuration_codec import configuration_values
+
+
+def split_errors(rows):
+    """Returns the split error of every point of `rows`; the endpoints get infinity."""
+    count = len(rows)
+    errors = [0.0] * count
+    if count == 0:
+        return errors
+    errors[0] = errors[-1] = float("inf")
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = rows[start], rows[end]
+        span = float(end - start)
+        worst, worst_index = -1.0, None
+        for index in range(start + 1, end):
+            t = (index - start) / span
+            row = rows[index]
+            error = max(abs(row[j] - (a[j] + t * (b[j] - a[j]))) for j in range(len(row)))
+            if error > worst:
+                worst, worst_index = error, index
+        """a point never ranks above the split it refines, which keeps the ranking progressive"""
+        errors[worst_index] = min(worst, min(errors[start], errors[end]))
+        stack.append((start, worst_index))
+        stack.append((worst_index, end))
+    return errors
+
+
+def preview_and_refinements(configurations, tolerance = 0.01, chunk_size = 100):
+    """Splits a trajectory into a keyframe preview and refinement chunks.
+
+    Parameters
+    ----------
+    configurations : list
+        Compas `Configuration` objects or sequences of joint values.
+    tolerance : float, optional
+        Maximum joint deviation of the interpolated preview from the full trajectory.
+    chunk_size : int, optional
+        Number of points per refinement chunk.
+
+    Returns
+    -------
+    tuple
+        `(preview, refinements)`, each a list of `(index, values)` pairs sorted by index; `preview`
+        is one list and `refinements` a list of them. Together they hold every point once.
+    """
+    rows = [configuration_values(c) for c in configurations]
+    errors = split_errors(rows)
+    ranked = sorted(range(len(rows)), key=lambda index: -errors[index])
+    keyframes = [index for index in ranked if errors[index] > tolerance]
+    rest = ranked[len(keyframes):]
+    preview = [(index, rows[index]) for index in sorted(keyframes)]
+    refinements = []
+    for start in range(0, len(rest), chunk_size):
+        refinements.append([(index, rows[index]) for index in sorted(rest[start:start + chunk_size])])
+    return preview, refinements
+
+
+def interpolate(keyframes, count):
+    """Rebuilds `count` points by linear interpolation between the `(index, values)` keyframes received so far."""
+    keyframes = sorted(keyframes)
+    rows = []
+    for (i0, a), (i1, b) in zip(keyframes, keyframes[1:]):
+        for index in range(i0, i1):
+            t = (index - i0) / float(i1 - i0)
+            rows.append([a[j] + t * (b[j] - a[j]) for j in range(len(a))])
+    rows.append(list(keyframes[-1][1]))
+    return rows[:count]
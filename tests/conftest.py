@@ -0,0 +1,39 @@
+"""Shared fixtures of the test suite.
+
+The modules under `src` import each other flat, as the benchmarks and interface scripts do, so
+their directories go on the path here. Tests needing the RFL model load it from the URDF and SRDF
+named by `$T2_RFL_URDF` and `$T2_RFL_SRDF` (the `rfl` files of the compas_fab robot library or of
+`rfl_moveit_config`), and are skipped without them.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("planning", "benchmarks", "interface"):
+    sys.path.insert(0, os.path.join(ROOT, "src", directory))
+
+EXAMPLE = os.path.join(ROOT, "examples", "building_plan.json")
+
+
+@pytest.fixture(scope="session")
+def rfl_robot():
+    urdf, srdf = os.environ.get("T2_RFL_URDF"), os.environ.get("T2_RFL_SRDF")
+    if not urdf or not srdf:
+        pytest.skip("set T2_RFL_URDF and T2_RFL_SRDF to the RFL robot description")
+    from compas_robots import RobotModel
+    from compas_fab.robots import Robot
+    from compas_fab.robots import RobotSemantics
+    model = RobotModel.from_urdf_file(urdf)
+    return Robot(model, semantics=RobotSemantics.from_srdf_file(srdf, model))
+
+
+@pytest.fixture
+def robot_plan(tmp_path):
+    """The example plan with every step given to the robot, loaded lazily."""
+    from lazy_building_plan import load_lazy
+    from run_benchmarks import synthetic_plan
+    plan = load_lazy(synthetic_plan(EXAMPLE, 1, str(tmp_path)))
+    yield plan
+    plan["document"].close()
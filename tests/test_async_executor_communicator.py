@@ -0,0 +1,80 @@
+import asyncio
+import json
+import socket
+import threading
+
+import async_executor_communicator
+from async_executor_communicator import AsyncExecutorCommunicator
+
+
+class Client(object):
+    """Stands in for the paho client: `connect` opens a socket pair and runs the socket callbacks on the calling thread."""
+
+    def __init__(self):
+        self.published = []
+        self.retained = []
+        self.reads = []
+
+    def connect(self, host, port = 1883, keepalive = 60):
+        self.sock, self.peer = socket.socketpair()
+        self.on_socket_open(self, None, self.sock)
+        self.on_socket_register_write(self, None, self.sock)
+
+    def loop_read(self):
+        self.sock.recv(1)
+        self.reads.append(threading.get_ident())
+
+    def loop_write(self):
+        self.on_socket_unregister_write(self, None, self.sock)
+
+    def loop_misc(self):
+        return async_executor_communicator.mqtt.MQTT_ERR_SUCCESS
+
+    def publish(self, topic, payload, retain = False):
+        self.published.append((topic, payload))
+        if retain:
+            self.retained.append(topic)
+
+    def disconnect(self):
+        self.on_socket_close(self, None, self.sock)
+        self.sock.close()
+        self.peer.close()
+
+
+def test_socket_presence_and_publish(monkeypatch):
+    monkeypatch.setattr(async_executor_communicator.mqtt, "Client", Client)
+
+    async def scenario():
+        comms = AsyncExecutorCommunicator("localhost", "T2_async_test", user_ttl=0.1)
+        await comms.start()
+        client = comms.client
+        client.peer.send(b"x")
+        await asyncio.sleep(0.05)
+        assert client.reads == [threading.get_ident()]
+
+        comms.check_in("a")
+        await asyncio.sleep(0.01)
+        assert list(comms.AR_users) == ["a"]
+
+        await comms.send_to_robot("close_gripper")
+        await asyncio.sleep(0.01)
+        assert client.published[-1][0] == comms.command_topic
+        assert json.loads(client.published[-1][1]) == {"text": "close_gripper"}
+
+        """like the sync communicator, whose publishers cannot retain"""
+        await comms.send_configurations(0, {"step": 0, 0: [0.0, 1.0]})
+        await asyncio.sleep(0.01)
+        assert client.published[-1][0] == comms.interface_topic
+        assert client.retained == []
+
+        """a user joining later gets the configurations of the step again"""
+        published = len(client.published)
+        comms.check_in("b")
+        await asyncio.sleep(0.02)
+        assert client.published[published:] == [client.published[published - 1]]
+
+        await asyncio.sleep(0.3)
+        assert comms.AR_users == {}
+        await comms.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from compas_robots import Configuration
+
+from batch_kinematics import BatchKinematics
+
+
+@pytest.mark.parametrize("group", ["robot11", "robot11_eaXYZ", "robot12_eaXYZ"])
+def test_forward_kinematics_matches_robot(rfl_robot, group):
+    kinematics = BatchKinematics(rfl_robot, rfl_robot.zero_configuration())
+    names = rfl_robot.get_configurable_joint_names(group)
+    types = rfl_robot.get_joint_types_by_names(names)
+    """beyond the joint limits too, which both clamp"""
+    values = np.random.default_rng(0).uniform(-6.0, 6.0, (20, len(names)))
+    matrices = kinematics.forward_kinematics(kinematics.merge(values, group, names), group)
+    for row, matrix in zip(values, matrices):
+        configuration = rfl_robot.merge_group_with_full_configuration(Configuration(row.tolist(), types, names), kinematics.full_configuration, group)
+        frame = rfl_robot.forward_kinematics(configuration, group)
+        assert np.allclose(matrix[:3, 3], list(frame.point), atol=1e-9)
+        assert np.allclose(matrix[:3, 0], list(frame.xaxis), atol=1e-9)
+        assert np.allclose(matrix[:3, 1], list(frame.yaxis), atol=1e-9)
+
+
+def test_merge_fills_other_joints(rfl_robot):
+    kinematics = BatchKinematics(rfl_robot, rfl_robot.zero_configuration())
+    names = rfl_robot.get_configurable_joint_names("robot11")
+    merged = kinematics.merge(np.ones((3, len(names))), "robot11", names)
+    columns = kinematics.group_indices("robot11", names)
+    assert merged.shape == (3, len(kinematics.full_joint_names))
+    assert np.all(merged[:, columns] == 1.0)
+    assert np.all(np.delete(merged, columns, axis=1) == np.delete(kinematics.full_values, columns))
+
+
+def test_to_configurations_round_trip(rfl_robot):
+    kinematics = BatchKinematics(rfl_robot, rfl_robot.zero_configuration())
+    values = np.random.default_rng(1).uniform(-1.0, 1.0, (4, len(kinematics.full_joint_names)))
+    configurations = kinematics.to_configurations(values)
+    assert [c.joint_names for c in configurations] == [kinematics.full_joint_names] * 4
+    assert np.allclose([c.joint_values for c in configurations], values)
+
+
+def test_link_origins_match_robot(rfl_robot):
+    group = "robot11_eaXYZ"
+    kinematics = BatchKinematics(rfl_robot, rfl_robot.zero_configuration())
+    names = rfl_robot.get_configurable_joint_names(group)
+    types = rfl_robot.get_joint_types_by_names(names)
+    values = np.random.default_rng(2).uniform(-1.0, 1.0, (5, len(names)))
+    merged = kinematics.merge(values, group, names)
+    origins = kinematics.link_origins(merged, group)
+    end_link = rfl_robot.get_end_effector_link_name(group)
+    joints = list(rfl_robot.model.iter_joint_chain(rfl_robot.model.root.name, end_link))
+    assert origins.shape == (5, len(joints), 3)
+    assert np.allclose(origins[:, -1, :], kinematics.forward_kinematics(merged, group)[:, :3, 3])
+    for row, points in zip(values, origins):
+        configuration = rfl_robot.merge_group_with_full_configuration(Configuration(row.tolist(), types, names), kinematics.full_configuration, group)
+        for joint, point in zip(joints, points):
+            frame = rfl_robot.model.forward_kinematics(configuration, joint.child.link)
+            assert np.allclose(point, list(frame.point), atol=1e-9)
@@ -0,0 +1,50 @@
+import itertools
+import math
+
+import pytest
+
+import configuration_codec
+
+JOINT_NAMES = ["bridge1_joint_EA_X", "robot11_joint_EA_Y", "robot11_joint_EA_Z"] + ["robot11_joint_{}".format(i) for i in range(1, 7)]
+CONFIGURATIONS = [[9 + 3 * math.sin(t / 30.0), -2 + t / 100.0, -4.5 + 0.5 * math.cos(t / 20.0)] + [math.sin(t / (5.0 + j)) for j in range(6)] for t in range(25)]
+OPTIONS = [(quantize, delta, compress) for quantize, delta, compress in itertools.product((False, True), repeat=3) if quantize or not delta]
+
+
+def tolerance(configurations, quantize):
+    """Float32 rounding, or half a quantization step over the largest joint range."""
+    if not quantize:
+        return 1e-5
+    return max(max(column) - min(column) for column in zip(*configurations)) / 65535.0
+
+
+@pytest.mark.parametrize("quantize, delta, compress", OPTIONS)
+@pytest.mark.parametrize("chunk_points", [None, 1, 7])
+@pytest.mark.parametrize("joint_names", [JOINT_NAMES, None])
+def test_round_trip(quantize, delta, compress, chunk_points, joint_names):
+    chunks = configuration_codec.encode_configurations(3, CONFIGURATIONS, joint_names, quantize, delta, compress, chunk_points)
+    texts = [configuration_codec.to_text(chunk) for chunk in reversed(chunks)]
+    step, names, configurations = configuration_codec.decode_configurations([configuration_codec.from_text(text) for text in texts])
+    assert step == 3
+    assert names == (joint_names or [])
+    assert len(configurations) == len(CONFIGURATIONS)
+    error = max(abs(a - b) for row, decoded in zip(CONFIGURATIONS, configurations) for a, b in zip(row, decoded))
+    assert all(len(row) == len(JOINT_NAMES) for row in configurations)
+    assert error <= tolerance(CONFIGURATIONS, quantize)
+
+
+def test_plain_lists_quantized():
+    """The dummy configurations of the executioner, without joint names, in the default compact options."""
+    dummy_configs = [[0, 15, 3, 0, 468, 0, 86, 488, 56, 79, 56], [0, 15, 3, 0, 468, 0, 86, 488, 56, 79, 56]]
+    chunks = configuration_codec.encode_configurations(0, dummy_configs, quantize=True, delta=True, compress=True)
+    assert configuration_codec.decode_configurations(chunks)[2] == dummy_configs
+
+
+def test_empty_and_invalid():
+    chunks = configuration_codec.encode_configurations(1, [], JOINT_NAMES, quantize=True)
+    assert configuration_codec.decode_configurations(chunks) == (1, JOINT_NAMES, [])
+    with pytest.raises(ValueError):
+        configuration_codec.encode_configurations(1, CONFIGURATIONS, JOINT_NAMES[:3])
+    with pytest.raises(ValueError):
+        configuration_codec.encode_configurations(1, CONFIGURATIONS, delta=True)
+    with pytest.raises(ValueError):
+        configuration_codec.decode_chunk(b"XXXX" + bytes(32))
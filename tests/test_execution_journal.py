@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from execution_journal import ExecutionJournal
+from execution_journal import UnresolvedStepError
+from timber_assembly_executioner import TimberAssemblyExecutioner
+
+
+class Plan(object):
+    guid = "journal-test"
+
+    def __init__(self, count = 6):
+        self.steps = [{"actor": "ROBOT" if index % 3 else "HUMAN", "is_built": index == 0} for index in range(count)]
+
+
+def build(journal, index):
+    for event in (ExecutionJournal.STARTED, ExecutionJournal.CONFIRMED, ExecutionJournal.MOVING, ExecutionJournal.EXECUTED, ExecutionJournal.BUILT):
+        journal.record(index, event)
+
+
+@pytest.mark.parametrize("snapshot_interval", [1000, 3])
+def test_recovers_after_restart(tmp_path, snapshot_interval):
+    journal = ExecutionJournal(str(tmp_path), Plan(), snapshot_interval, durable=False)
+    assert journal.robot_steps == [1, 2, 4, 5]
+    assert journal.next_unbuilt() == 1
+    build(journal, 1)
+    build(journal, 2)
+    journal.record(4, ExecutionJournal.STARTED)
+    journal.close()
+
+    journal = ExecutionJournal(str(tmp_path), Plan(), snapshot_interval, durable=False)
+    assert journal.built == {0, 1, 2}
+    assert journal.state(4) == ExecutionJournal.STARTED
+    assert journal.next_unbuilt() == 3
+    assert journal.next_robot_step() == 4
+    assert journal.unbuilt_robot_steps() == [4, 5]
+    assert journal.unresolved() == []
+    journal.close()
+
+
+def test_torn_line_is_cut(tmp_path):
+    journal = ExecutionJournal(str(tmp_path), Plan(), durable=False)
+    build(journal, 1)
+    journal.close()
+    with open(journal.log_path, "a") as f:
+        f.write('{"seq": 99, "step": 2, "ev')
+
+    journal = ExecutionJournal(str(tmp_path), Plan(), durable=False)
+    assert journal.built == {0, 1}
+    journal.record(2, ExecutionJournal.STARTED)
+    journal.close()
+    journal = ExecutionJournal(str(tmp_path), Plan(), durable=False)
+    assert journal.state(2) == ExecutionJournal.STARTED
+    journal.close()
+
+
+def test_other_plan_is_refused(tmp_path):
+    ExecutionJournal(str(tmp_path), Plan(), durable=False).close()
+    other = Plan()
+    other.guid = "another plan"
+    with pytest.raises(ValueError):
+        ExecutionJournal(str(tmp_path), other)
+
+
+@pytest.mark.parametrize("event", [ExecutionJournal.MOVING, ExecutionJournal.EXECUTED])
+def test_interrupted_step_needs_resolution(tmp_path, event):
+    plan = Plan()
+    journal = ExecutionJournal(str(tmp_path), plan, durable=False)
+    journal.record(1, ExecutionJournal.STARTED)
+    journal.record(1, ExecutionJournal.CONFIRMED)
+    journal.record(1, event)
+    journal.close()
+
+    journal = ExecutionJournal(str(tmp_path), plan, durable=False)
+    assert journal.unresolved() == [1]
+    executioner = TimberAssemblyExecutioner(building_plan=plan, comms=object(), journal=journal)
+    with pytest.raises(UnresolvedStepError):
+        executioner.resume()
+    with pytest.raises(UnresolvedStepError):
+        executioner.execute_pipelined()
+
+    executioner.resolve_step(1, built=(event == ExecutionJournal.EXECUTED))
+    assert journal.unresolved() == []
+    assert journal.next_robot_step() == (2 if event == ExecutionJournal.EXECUTED else 1)
+    assert plan.steps[1]["is_built"] == ("true" if event == ExecutionJournal.EXECUTED else False)
+    journal.close()
+
+    journal = ExecutionJournal(str(tmp_path), plan, durable=False)
+    assert journal.unresolved() == []
+    journal.close()
+    assert os.path.exists(journal.snapshot_path)
+
+
+def test_steps_confirmed_ahead_are_not_unresolved(tmp_path):
+    """a pipeline with lookahead 1 whose step 1 fails: step 2 was only confirmed, and is planned and confirmed again"""
+    plan = Plan()
+    journal = ExecutionJournal(str(tmp_path), plan, durable=False)
+    executioner = TimberAssemblyExecutioner(building_plan=plan, comms=object(), journal=journal)
+    executioner.execute_trajectory = lambda trajectory, step_index = None: step_index != 1
+    for index in (1, 2):
+        journal.record(index, ExecutionJournal.STARTED)
+        journal.record(index, ExecutionJournal.CONFIRMED)
+    assert journal.unresolved() == []
+    executioner.settle_time = 0.0
+    executioner.close_gripper = executioner.open_gripper = lambda arm = None: None
+    assert executioner.execute_confirmed_step(1, {"pickup": [], "move": [], "retract": []}) is False
+    journal.close()
+
+    journal = ExecutionJournal(str(tmp_path), plan, durable=False)
+    assert journal.unresolved() == [1]
+    assert journal.state(2) == ExecutionJournal.CONFIRMED
+    journal.close()
@@ -0,0 +1,101 @@
+import threading
+
+from execution_pipeline import ExecutionPipeline
+
+
+def run(pipeline, indices, timeout = 5.0):
+    """Runs the pipeline on a thread, so a hang fails the test instead of blocking it."""
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(pipeline.run(indices)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline did not finish"
+    return result
+
+
+def test_runs_every_step_in_order():
+    executed = []
+    pipeline = ExecutionPipeline(lambda index, attempt: index * 10, lambda index, planned: True, lambda index, planned: executed.append(planned), lookahead=2)
+    report = run(pipeline, [1, 2, 3, 4])
+    assert report["completed"] == [1, 2, 3, 4]
+    assert executed == [10, 20, 30, 40]
+    assert report["failures"] == [] and report["rollbacks"] == 0
+    assert [report["stages"][stage]["count"] for stage in ExecutionPipeline.STAGES] == [4, 4, 4]
+
+
+def test_failed_execution_rolls_back_and_retries():
+    planned, rollbacks = [], []
+
+    def plan(index, attempt):
+        planned.append((index, attempt))
+        return attempt
+
+    def execute(index, attempt):
+        return not (index == 2 and attempt == 0)
+
+    pipeline = ExecutionPipeline(plan, lambda index, result: True, execute, lookahead=2, rollback=rollbacks.append)
+    report = run(pipeline, [1, 2, 3])
+    assert report["completed"] == [1, 2, 3]
+    assert report["failures"] == [(2, "execute", "execution failed")]
+    assert rollbacks == [2]
+    assert (2, 1) in planned and planned.index((2, 1)) > planned.index((2, 0))
+
+
+def test_stops_after_max_retries():
+    def plan(index, attempt):
+        if index == 2:
+            raise ValueError("unreachable")
+        return index
+
+    pipeline = ExecutionPipeline(plan, lambda index, result: True, lambda index, result: True, max_retries=1)
+    report = run(pipeline, [1, 2, 3])
+    assert report["completed"] == [1]
+    assert [failure[:2] for failure in report["failures"]] == [(2, "plan"), (2, "plan")]
+
+
+def test_stale_confirmation_is_cancelled():
+    """Step 2 is out for confirmation, which never comes, when step 1 fails; the rollback must free the confirm stage."""
+    condition = threading.Condition()
+    confirming = threading.Event()
+
+    def confirm(index, attempt):
+        if index == 2 and not confirming.is_set():
+            confirming.set()
+            with condition:
+                condition.wait_for(pipeline.confirmation_cancelled)
+                return False
+        return True
+
+    def execute(index, attempt):
+        if index == 1 and attempt == 0:
+            confirming.wait(2.0)
+            return False
+        return True
+
+    def wake():
+        with condition:
+            condition.notify_all()
+
+    pipeline = ExecutionPipeline(lambda index, attempt: attempt, confirm, execute, lookahead=1, cancel=wake)
+    report = run(pipeline, [1, 2])
+    assert report["completed"] == [1, 2]
+    assert report["failures"] == [(1, "execute", "execution failed")]
+
+
+def test_stop_cancels_pending_confirmation():
+    condition = threading.Condition()
+
+    def confirm(index, result):
+        if index == 2:
+            with condition:
+                condition.wait_for(pipeline.confirmation_cancelled)
+                return False
+        return True
+
+    def wake():
+        with condition:
+            condition.notify_all()
+
+    pipeline = ExecutionPipeline(lambda index, attempt: index, confirm, lambda index, result: index != 1, lookahead=1, max_retries=0, cancel=wake)
+    report = run(pipeline, [1, 2])
+    assert report["completed"] == []
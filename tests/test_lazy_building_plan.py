@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import lazy_building_plan
+from lazy_building_plan import LazyDocument
+from lazy_building_plan import load_lazy
+
+from conftest import EXAMPLE
+
+
+@pytest.fixture
+def plan_path(tmp_path):
+    path = str(tmp_path / "building_plan.json")
+    shutil.copy(EXAMPLE, path)
+    return path
+
+
+@pytest.fixture
+def eager():
+    with open(EXAMPLE) as f:
+        return json.load(f)
+
+
+def test_matches_eager_load(plan_path, eager):
+    plan = load_lazy(plan_path, decode=json.loads)
+    try:
+        steps = plan["building_plan"].steps
+        assert [step for step in steps] == [step["data"] for step in eager["building_plan"]["data"]["steps"]]
+        assert steps[-1] == eager["building_plan"]["data"]["steps"][-1]["data"]
+        assert plan["building_plan"].guid == eager["building_plan"]["guid"]
+        assert sorted(plan["beams"].keys(), key=int) == sorted(eager["beams"], key=int)
+        assert all(plan["beams"][int(key)] == beam for key, beam in eager["beams"].items())
+        assert all(plan["joints"][key] == joint for key, joint in eager["joints"].items())
+        graph = plan["assembly"].graph
+        for key, targets in eager["assembly"]["graph"]["edge"].items():
+            assert set(map(int, targets)) <= set(graph.neighbors(key))
+    finally:
+        plan["document"].close()
+
+
+def test_changes_to_steps_persist(plan_path):
+    plan = load_lazy(plan_path, decode=json.loads)
+    try:
+        steps = plan["building_plan"].steps
+        steps[0]["is_built"] = "true"
+        assert steps[0]["is_built"] == "true"
+        with pytest.raises(IndexError):
+            steps[len(steps)]
+    finally:
+        plan["document"].close()
+
+
+def test_index_file_is_reused_until_the_file_changes(plan_path, eager):
+    LazyDocument(plan_path, json.loads).close()
+    index_path = plan_path + ".index.json"
+    assert os.path.exists(index_path)
+    with open(index_path) as f:
+        first = json.load(f)
+
+    document = LazyDocument(plan_path, json.loads)
+    assert document._read_index() == document.spans
+    document.close()
+
+    """a key holding braces and quotes shifts every span after it"""
+    eager["assembly"]["attributes"]["note"] = "{[\"}"
+    with open(plan_path, "w") as f:
+        json.dump(eager, f)
+    plan = load_lazy(plan_path, decode=json.loads)
+    try:
+        with open(index_path) as f:
+            assert json.load(f)["signature"] != first["signature"]
+        assert plan["assembly"].attributes["note"] == "{[\"}"
+        assert [step for step in plan["building_plan"].steps] == [step["data"] for step in eager["building_plan"]["data"]["steps"]]
+    finally:
+        plan["document"].close()
+
+
+def test_compas_decode(plan_path):
+    plan = load_lazy(plan_path)
+    try:
+        beam = plan["assembly"].beams[0]
+        assert beam.length > 0
+    finally:
+        plan["document"].close()
+
+
+def test_measurement_runs():
+    """every loader is measured in a subprocess of the module's main, on the example scaled by 1"""
+    output = subprocess.check_output([sys.executable, lazy_building_plan.__file__, "1"], universal_newlines=True)
+    lines = output.splitlines()
+    assert [line.split()[0] for line in lines[2:]] == ["json.load", "lazy,", "lazy,"]
@@ -0,0 +1,82 @@
+import json
+
+import paho.mqtt.client as mqtt
+import pytest
+from compas_eve import Message
+from compas_eve import Subscriber
+
+from message_bus import AT_LEAST_ONCE
+from message_bus import AT_MOST_ONCE
+from message_bus import EXACTLY_ONCE
+from message_bus import MessageBus
+from message_bus import TopicTrie
+from message_bus import topic
+
+
+class Received(object):
+    """An incoming MQTT message, as paho hands it to `on_message`."""
+
+    def __init__(self, topic_name, payload):
+        self.topic = topic_name
+        self.payload = payload.encode("utf-8")
+
+
+@pytest.fixture
+def bus():
+    """A bus that never connects, so published messages stay held."""
+    bus = MessageBus("127.0.0.1:1", protocol=mqtt.MQTTv311)
+    yield bus
+    bus.stop()
+
+
+def test_topic_trie_wildcards():
+    trie = TopicTrie()
+    trie.insert("/T2/+/status", "plus")
+    trie.insert("/T2/#", "hash")
+    trie.insert("/T2/robot/status", "exact")
+    assert sorted(value for _, value in trie.match("/T2/robot/status")) == ["exact", "hash", "plus"]
+    assert [value for _, value in trie.match("/T2/robot")] == ["hash"]
+    assert trie.remove("/T2/#", "hash")
+    assert trie.match("/T2/robot") == []
+
+
+def test_qos_of_most_specific_rule(bus):
+    assert bus.qos("/T2_command_test/command_topic") == EXACTLY_ONCE
+    assert bus.qos("/T2_command_test/interface_topic") == AT_LEAST_ONCE
+    assert bus.qos("/T2_command_test/anything") == AT_MOST_ONCE
+
+
+def test_publish_serializes_message_data(bus):
+    command = topic("T2_bus_test", "command_topic")
+    bus.publish(command, Message(text="close_gripper"))
+    bus.publish(command, {"text": "open_gripper"})
+    assert [(name, json.loads(payload)) for name, payload, _ in bus._pending] == [
+        (command.name, {"text": "close_gripper"}),
+        (command.name, {"text": "open_gripper"}),
+        ]
+    assert bus.metrics()["topics"][command.name]["published"] == 2
+
+
+def test_received_messages_reach_matching_callbacks(bus):
+    received = []
+    bus.subscribe(topic("T2_bus_test", "confirmation_topic"), lambda message: received.append(("exact", message["step"])))
+    bus.subscribe(topic("T2_bus_test", "#"), lambda message: 1 / 0)
+    bus.subscribe(topic("T2_bus_test", "+"), lambda message: received.append(("plus", message["step"])))
+    bus._on_message(None, None, Received("/T2_bus_test/confirmation_topic", json.dumps({"step": 3, "confirmation": True})))
+    assert sorted(received) == [("exact", 3), ("plus", 3)]
+
+
+def test_unsubscribe_by_subscriber_and_by_topic(bus):
+    received = []
+    confirmation = topic("T2_bus_test", "confirmation_topic")
+    first = Subscriber(confirmation, callback=lambda message: received.append("first"), transport=bus)
+    second = Subscriber(confirmation, callback=lambda message: received.append("second"), transport=bus)
+    first.subscribe()
+    second.subscribe()
+    first.unsubscribe()
+    bus._on_message(None, None, Received(confirmation.name, json.dumps({"step": 0})))
+    assert received == ["second"]
+
+    bus.unsubscribe(confirmation)
+    bus._on_message(None, None, Received(confirmation.name, json.dumps({"step": 1})))
+    assert received == ["second"] and bus._filters == {}
@@ -0,0 +1,49 @@
+import time
+
+from executor_communicator import ExecutorCommunicator
+from local_broker import LocalBroker
+from mock_ar import MockAR
+
+
+def test_users_respond_in_parallel():
+    """the delays of several users overlap instead of holding up the broker's dispatch one after the other"""
+    broker = LocalBroker()
+    comms = ExecutorCommunicator(None, "T2_mock_ar_test", transport=broker)
+    users = [MockAR(broker, "T2_mock_ar_test", response_delay=0.3, check_in_interval=0.05) for _ in range(4)]
+    try:
+        deadline = time.monotonic() + 5
+        while len(comms.AR_users) < len(users) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        start = time.monotonic()
+        comms.publish_configurations(0, [[0.0, 1.0], [1.0, 2.0]])
+        assert comms.wait_for_confirmation(0, timeout=5) is True
+        assert time.monotonic() - start < 0.9
+        assert all(user.configurations[0] == [[0.0, 1.0], [1.0, 2.0]] for user in users)
+    finally:
+        for user in users:
+            user.stop()
+        comms.presence.stop()
+        broker.stop()
+
+
+def test_users_who_join_get_the_step_to_confirm():
+    """a headset reconnecting after the configurations went out still gets them, so all users can confirm"""
+    broker = LocalBroker()
+    comms = ExecutorCommunicator(None, "T2_mock_ar_rejoin_test", transport=broker)
+    users = [MockAR(broker, "T2_mock_ar_rejoin_test", response_delay=0.05, check_in_interval=0.05)]
+    try:
+        deadline = time.monotonic() + 5
+        while len(comms.AR_users) < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        comms.publish_configurations(0, [[0.0, 1.0], [1.0, 2.0]])
+        assert comms.wait_for_confirmation(0, timeout=5) is True
+        users.append(MockAR(broker, "T2_mock_ar_rejoin_test", response_delay=0.05, check_in_interval=0.05))
+        while len(comms.AR_users) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert comms.wait_for_confirmation(0, timeout=2) is True
+        assert users[1].configurations[0] == [[0.0, 1.0], [1.0, 2.0]]
+    finally:
+        for user in users:
+            user.stop()
+        comms.presence.stop()
+        broker.stop()
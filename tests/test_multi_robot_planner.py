@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from fake_planner_client import FakePlannerClient
+from multi_robot_planner import MultiRobotPlanner
+from multi_robot_planner import ScheduleConflictError
+from run_benchmarks import PICKUP_BASE_FRAME
+from timber_assembly_executioner import TimberAssemblyExecutioner
+
+
+class Comms(object):
+    """Confirms every step and records the robot commands."""
+
+    def __init__(self):
+        self.commands = []
+
+    def publish_configurations(self, step_index, configurations):
+        pass
+
+    def wait_for_confirmation(self, step_index, quorum = None, timeout = None, cancelled = None):
+        return True
+
+    def send_to_robot(self, command):
+        self.commands.append(command)
+
+
+def multi_planner(robot, plan):
+    return MultiRobotPlanner(robot, plan["assembly"], plan["building_plan"], {arm: PICKUP_BASE_FRAME for arm in MultiRobotPlanner.ARMS},
+                             {arm: FakePlannerClient() for arm in MultiRobotPlanner.ARMS})
+
+
+def executioner(plan):
+    executioner = TimberAssemblyExecutioner(building_plan=plan["building_plan"], comms=Comms())
+    executioner.settle_time = 0.0
+    return executioner
+
+
+def test_schedule_runs_on_both_arms(rfl_robot, robot_plan):
+    planner = multi_planner(rfl_robot, robot_plan)
+    planner.plan()
+    planner.make_schedule()
+    report = planner.report()
+    assert report["unresolved_conflicts"] == 0 and report["failed_steps"] == []
+    assert sorted(report["steps"]["robot11"] + report["steps"]["robot12"]) == list(range(6))
+    result = executioner(robot_plan).execute_schedule(planner)
+    assert sorted(result["built"]) == list(range(6)) and result["failures"] == []
+
+
+def test_schedule_with_unresolved_conflicts_is_refused(rfl_robot, robot_plan):
+    planner = multi_planner(rfl_robot, robot_plan)
+    planner.plan()
+    planner.clearance = 100.0
+    planner.make_schedule()
+    assert planner.report()["unresolved_conflicts"] > 0
+    runner = executioner(robot_plan)
+    with pytest.raises(ScheduleConflictError):
+        runner.execute_schedule(planner)
+    assert runner.comms.commands == []
+    assert all(step["is_built"] in (False, "false") for step in robot_plan["building_plan"].steps)
+
+
+def test_step_neither_arm_plans_ends_the_schedule(rfl_robot, robot_plan):
+    planner = multi_planner(rfl_robot, robot_plan)
+    for arm_planner in planner.planners.values():
+        plan_segment = arm_planner.plan_segment
+
+        def failing(indices, plan_segment = plan_segment):
+            if 3 in indices:
+                raise RuntimeError("no plan for step 3")
+            return plan_segment(indices)
+
+        arm_planner.plan_segment = failing
+    planned = planner.plan()
+    assert 3 not in planned and 4 in planned
+    assert planner.report()["failed_steps"] == [3]
+    planner.make_schedule()
+    assert sorted({motion.step for motion in planner.schedule}) == [0, 1, 2]
+
+
+def test_arms_are_checked_link_by_link(rfl_robot, robot_plan):
+    planner = multi_planner(rfl_robot, robot_plan)
+    links = planner.home_links("robot11")
+    """the bridge both arms hang from is left out, the carriage, column and arm links are not"""
+    assert links.shape == (10, 3)
+    assert np.allclose(links[-1], list(planner.home_position("robot11")))
+
+    tool, elbow = np.array([[0.0, 0.0, 0.0]]), np.array([[5.0, 0.0, 0.0]])
+    other_tool, other_elbow = np.array([[0.0, 3.0, 0.0]]), np.array([[5.0, 0.3, 0.0]])
+    """the tools are far apart, the elbows are not"""
+    assert planner.too_close(np.vstack([elbow, tool]), 0.0, np.vstack([other_elbow, other_tool]), 0.0)
+    assert not planner.too_close(np.vstack([elbow, tool]), 0.0, np.vstack([elbow + 1.0, other_tool]), 0.0)
+    """a held beam widens the clearance around the tool holding it only"""
+    assert planner.too_close(np.vstack([elbow, tool]), 2.6, np.vstack([elbow + 1.0, other_tool]), 0.0)
+    assert not planner.too_close(np.vstack([elbow, tool]), 0.0, np.vstack([elbow + 1.0, other_tool]), 0.2)
+
+
+def test_single_arm_baseline_is_measured(rfl_robot, robot_plan):
+    planner = multi_planner(rfl_robot, robot_plan)
+    planner.plan()
+    planner.make_schedule()
+    assert planner.report()["speedup"] is None
+    requests = planner.planners["robot11"].robot.client.requests
+    single_arm = planner.measure_single_arm("robot11")
+    assert planner.planners["robot11"].robot.client.requests > requests
+    report = planner.report()
+    assert report["single_arm_makespan"] == single_arm > 0
+    assert report["speedup"] == single_arm / report["makespan"]
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from presence_tracker import PresenceTracker
+
+
+def wait_until(predicate, timeout = 2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+def test_user_expires_without_check_in():
+    events = []
+    tracker = PresenceTracker(0.05, on_join=lambda user: events.append(("join", user)), on_leave=lambda user: events.append(("leave", user)))
+    tracker.start()
+    try:
+        tracker.check_in("a")
+        assert tracker.users == ["a"]
+        assert wait_until(lambda: not tracker.users)
+        assert events == [("join", "a"), ("leave", "a")]
+    finally:
+        tracker.stop()
+
+
+def test_check_in_during_late_leave_rejoins():
+    present = set()
+    leaving, release = threading.Event(), threading.Event()
+
+    def on_leave(user):
+        leaving.set()
+        release.wait(2.0)
+        present.discard(user)
+
+    tracker = PresenceTracker(0.2, on_join=present.add, on_leave=on_leave)
+    tracker.start()
+    try:
+        tracker.check_in("a")
+        assert leaving.wait(2.0)
+        rejoin = threading.Thread(target=tracker.check_in, args=("a",))
+        rejoin.start()
+        time.sleep(0.02)
+        release.set()
+        rejoin.join()
+        time.sleep(0.05)
+        assert present == {"a"}
+        assert tracker.users == ["a"]
+    finally:
+        release.set()
+        tracker.stop()
+
+
+def test_remove_and_check_in_keeps_one_heap_entry():
+    tracker = PresenceTracker(0.05)
+    tracker.start()
+    try:
+        tracker.check_in("a")
+        tracker.remove("a")
+        tracker.check_in("a")
+        deadline = time.monotonic() + 0.3
+        while time.monotonic() < deadline:
+            tracker.check_in("a")
+            time.sleep(0.01)
+        assert len([entry for entry in tracker._expiries if entry[-1] == "a"]) == 1
+        assert tracker.users == ["a"]
+    finally:
+        tracker.stop()
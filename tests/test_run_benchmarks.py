@@ -0,0 +1,12 @@
+import json
+
+import run_benchmarks
+
+
+def test_harness_runs_every_benchmark(rfl_robot, tmp_path):
+    output = tmp_path / "report.json"
+    run_benchmarks.main(["--scales", "1", "--no-memory", "--workers", "2", "--lookahead", "1",
+                         "--reachability", "--reachability-samples", "500", "--blend", "--output", str(output)])
+    results = json.loads(output.read_text())["results"]
+    assert [r["benchmark"] for r in results] == ["planning", "execution", "pipeline", "reachability/baseline", "reachability/reachability", "blending"]
+    assert all(r["steps"] == 6 for r in results if r["benchmark"] in ("planning", "execution", "blending"))
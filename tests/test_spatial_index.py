@@ -0,0 +1,26 @@
+import random
+
+import pytest
+
+from aabb import aabb_inflate
+from spatial_index import AABBTree
+
+
+def random_box(rng, size):
+    corner = [rng.uniform(-10.0, 10.0) for _ in range(3)]
+    return (tuple(corner), tuple(v + rng.uniform(0.0, size) for v in corner))
+
+
+@pytest.mark.parametrize("count, leaf_size", [(0, 4), (1, 4), (7, 1), (300, 4)])
+def test_query_matches_brute_force(count, leaf_size):
+    rng = random.Random(count)
+    tree = AABBTree([(index, random_box(rng, 2.0)) for index in range(count)], leaf_size)
+    for _ in range(100):
+        box = random_box(rng, 6.0)
+        assert sorted(tree.query(box)) == sorted(tree.brute_force_query(box))
+
+
+def test_touching_boxes_intersect():
+    tree = AABBTree([("a", ((0.0, 0.0, 0.0), (1.0, 1.0, 1.0))), ("b", ((5.0, 5.0, 5.0), (6.0, 6.0, 6.0)))])
+    assert tree.query(((1.0, 1.0, 1.0), (2.0, 2.0, 2.0))) == ["a"]
+    assert sorted(tree.query(aabb_inflate(((2.0, 2.0, 2.0), (4.0, 4.0, 4.0)), 1.0))) == ["a", "b"]
@@ -0,0 +1,141 @@
+import threading
+import time
+
+from execution_journal import ExecutionJournal
+from executor_communicator import ExecutorCommunicator
+from local_broker import LocalBroker
+from mock_ar import MockAR
+from timber_assembly_executioner import TimberAssemblyExecutioner
+
+TOPICS = "T2_executioner_test"
+
+
+class Plan(object):
+    guid = "test"
+
+    def __init__(self, count):
+        self.steps = [{"actor": "ROBOT", "is_built": False, "element_ids": [index]} for index in range(count)]
+
+
+class Planner(object):
+    """Stands in for a planner whose steps are planned already; a trajectory is a list of configurations."""
+
+    def __init__(self, count):
+        self.robot_steps = {index: {"pickup": [[[0.0]]], "move": [[[1.0]]], "retract": [[[2.0]]]} for index in range(count)}
+
+    def get_configurations(self, trajectories):
+        return [configuration for trajectory in trajectories for configuration in trajectory]
+
+
+class Comms(object):
+    """Records what the executioner sends and confirms the steps in `confirmed` only."""
+
+    def __init__(self, confirmed):
+        self.confirmed = confirmed
+        self.commands = []
+        self.published = []
+
+    def publish_configurations(self, step_index, configurations):
+        self.published.append((step_index, configurations))
+
+    def wait_for_confirmation(self, step_index, quorum = None, timeout = None, cancelled = None):
+        return step_index in self.confirmed and not (cancelled is not None and cancelled())
+
+    def wake_confirmation_waiters(self):
+        pass
+
+    def send_to_robot(self, command):
+        self.commands.append(command)
+
+
+def executioner(comms, plan, journal = None):
+    executioner = TimberAssemblyExecutioner(building_plan=plan, comms=comms, planner=Planner(len(plan.steps)), journal=journal, confirmation_timeout=0.1)
+    executioner.settle_time = 0.0
+    return executioner
+
+
+def test_confirmed_step_is_built(tmp_path):
+    plan = Plan(1)
+    journal = ExecutionJournal(str(tmp_path), plan, durable=False)
+    comms = Comms({0})
+    assert executioner(comms, plan, journal).execute_step(0) is True
+    assert comms.commands == ["close_gripper", "open_gripper"]
+    assert len(comms.published) == 3
+    assert journal.is_built(0) and plan.steps[0]["is_built"] == "true"
+    journal.close()
+
+
+def test_unconfirmed_step_stops(tmp_path):
+    plan = Plan(1)
+    journal = ExecutionJournal(str(tmp_path), plan, durable=False)
+    comms = Comms(set())
+    assert executioner(comms, plan, journal).execute_step(0) is False
+    assert comms.commands == []
+    assert len(comms.published) == 1
+    assert journal.state(0) == ExecutionJournal.STARTED
+    assert not journal.is_built(0) and plan.steps[0]["is_built"] is False
+    journal.close()
+
+
+def test_failed_motion_stops(tmp_path):
+    plan = Plan(1)
+    journal = ExecutionJournal(str(tmp_path), plan, durable=False)
+    comms = Comms({0})
+    runner = executioner(comms, plan, journal)
+    runner.execute_trajectory = lambda trajectory, step_index = None: False
+    assert runner.execute_step(0) is False
+    assert comms.commands == []
+    assert journal.state(0) == ExecutionJournal.MOVING
+    journal.close()
+
+
+def test_mock_ar_confirms_motion():
+    broker = LocalBroker()
+    comms = ExecutorCommunicator(None, TOPICS, transport=broker)
+    user = MockAR(broker, TOPICS, response_delay=0.0, check_in_interval=0.05)
+    try:
+        deadline = time.monotonic() + 5
+        while not comms.AR_users and time.monotonic() < deadline:
+            time.sleep(0.01)
+        runner = executioner(comms, Plan(1))
+        runner.confirmation_timeout = 5
+        assert runner.execute_robot_motion(0, [[0.0, 1.0], [1.0, 2.0]]) is True
+        assert user.configurations[0] == [[0.0, 1.0], [1.0, 2.0]]
+    finally:
+        user.stop()
+        comms.presence.stop()
+        broker.stop()
+
+
+def test_stopped_executioner_reports_failure(tmp_path):
+    plan = Plan(1)
+    journal = ExecutionJournal(str(tmp_path), plan, durable=False)
+    runner = executioner(Comms({0}), plan, journal)
+    runner.stop_event.set()
+    assert runner.execute_confirmed_step(0, runner.planner.robot_steps[0]) is False
+    assert not journal.is_built(0) and plan.steps[0]["is_built"] is False
+    journal.close()
+
+
+def test_cancelled_wait_returns():
+    broker = LocalBroker()
+    comms = ExecutorCommunicator(None, TOPICS, transport=broker)
+    cancelled = threading.Event()
+    try:
+        timer = threading.Timer(0.05, lambda: (cancelled.set(), comms.wake_confirmation_waiters()))
+        timer.start()
+        start = time.monotonic()
+        assert comms.wait_for_confirmation(0, timeout=None, cancelled=cancelled.is_set) is False
+        assert time.monotonic() - start < 2.0
+    finally:
+        comms.presence.stop()
+        broker.stop()
+
+
+def test_confirmation_after_a_pipelined_run_is_not_cancelled():
+    plan = Plan(2)
+    runner = executioner(Comms({0, 1}), plan)
+    runner.plan_step = lambda step_index, attempt = 0: runner.planner.robot_steps[step_index]
+    report = runner.execute_pipelined()
+    assert report["completed"] == [0, 1] and runner.pipeline is None
+    assert runner.confirm_step(0, runner.planner.robot_steps[0]) is True
@@ -0,0 +1,124 @@
+from compas.geometry import Frame
+from compas.geometry import Vector
+
+from aabb import aabb_from_points
+from aabb import aabb_inflate
+from fake_planner_client import FakePlannerClient
+import scene_store
+from run_benchmarks import PICKUP_BASE_FRAME
+from spatial_index import AABBTree
+import timber_assembly_planner
+from timber_assembly_planner import TimberAssemblyPlanner
+from trajectory_cache import digest
+
+
+def planner(robot, plan, client):
+    robot.client = client
+    return TimberAssemblyPlanner(robot, plan["assembly"], plan["building_plan"], PICKUP_BASE_FRAME, group="robot11_eaXYZ")
+
+
+def joint_values(robot_steps):
+    return {index: {phase: [[point.joint_values for point in t.points] for t in trajectories] for phase, trajectories in step.items()}
+            for index, step in robot_steps.items()}
+
+
+def test_serial_and_parallel_planning_agree(rfl_robot, robot_plan):
+    serial = planner(rfl_robot, robot_plan, FakePlannerClient())
+    serial.plan_robot_assembly()
+    parallel = planner(rfl_robot, robot_plan, FakePlannerClient())
+    parallel.plan_robot_assembly_parallel([FakePlannerClient() for _ in range(3)])
+    assert len(serial.robot_steps) == 6
+    assert joint_values(serial.robot_steps) == joint_values(parallel.robot_steps)
+
+
+def test_every_step_starts_in_the_safe_configuration(rfl_robot, robot_plan):
+    serial = planner(rfl_robot, robot_plan, FakePlannerClient())
+    serial.plan_robot_assembly()
+    safe = serial.safe_configuation
+    for step in serial.robot_steps.values():
+        start = step["pickup"][0].start_configuration
+        assert dict(zip(start.joint_names, start.joint_values)) == dict(zip(safe.joint_names, safe.joint_values))
+
+
+def test_every_step_ends_in_the_safe_configuration(rfl_robot, robot_plan):
+    """the last retract has a joint space goal, so the next step starts where this one ended"""
+    serial = planner(rfl_robot, robot_plan, FakePlannerClient())
+    serial.plan_robot_assembly()
+    safe = rfl_robot.get_group_configuration("robot11_eaXYZ", serial.safe_configuation)
+    for step in serial.robot_steps.values():
+        end = step["retract"][-1].points[-1]
+        assert dict(zip(end.joint_names, end.joint_values)) == dict(zip(safe.joint_names, safe.joint_values))
+
+
+def test_parallel_planning_records_step_dependencies_for_replanning(rfl_robot, robot_plan):
+    parent = planner(rfl_robot, robot_plan, FakePlannerClient())
+    parent.plan_robot_assembly_parallel([FakePlannerClient() for _ in range(3)])
+    assert sorted(parent.dependencies.step_beams) == sorted(parent.robot_steps)
+
+    steps = robot_plan["building_plan"].steps
+    key = steps[3]["element_ids"][0]
+    beam = robot_plan["assembly"].beams[key]
+    beam.frame = Frame(beam.frame.point + Vector(0.0, 0.0, 0.3), beam.frame.xaxis, beam.frame.yaxis)
+    assert parent.dependencies.changed_beams() == [key]
+    replanned = parent.replan_changed_steps()
+    assert 3 in replanned
+    assert all(index >= 3 for index in replanned)
+
+
+def test_scene_signature_does_not_digest_placed_beams(rfl_robot, robot_plan, monkeypatch):
+    arm = planner(rfl_robot, robot_plan, FakePlannerClient())
+    arm.replay_scene(5)
+    assert len(arm.placed_beams) == 5
+    signature = arm.scene_signature()
+
+    """only digests of digests are taken, none of a beam"""
+    digested = []
+    for module in (scene_store, timber_assembly_planner):
+        monkeypatch.setattr(module, "digest", lambda obj: digested.append(obj) or digest(obj))
+    assert arm.scene_signature() == signature
+    assert digested and all(isinstance(item, str) or item is None for obj in digested for item in obj)
+
+    key = arm.placed_beams[2]
+    beam = robot_plan["assembly"].beams[key]
+    beam.frame = Frame(beam.frame.point + Vector(0.0, 0.0, 0.3), beam.frame.xaxis, beam.frame.yaxis)
+    arm.scene_store.refresh([key])
+    assert arm.scene_signature() != signature
+
+
+def test_grabbed_beam_is_attached_relative_to_the_tool(rfl_robot, robot_plan):
+    arm = planner(rfl_robot, robot_plan, FakePlannerClient())
+    beam = robot_plan["assembly"].beams[robot_plan["building_plan"].steps[0]["element_ids"][0]]
+    target_frame = Frame(beam.midpoint, beam.frame.xaxis, beam.frame.yaxis)
+    arm.grab_beam(beam, PICKUP_BASE_FRAME, target_frame)
+    mesh = arm.attached_collision_meshes[0].collision_mesh.mesh
+    assert Vector(*mesh.centroid()).length < 1e-6
+    xs = [mesh.vertex_coordinates(vertex)[0] for vertex in mesh.vertices()]
+    assert abs(max(xs) - min(xs) - beam.length) < 1e-6
+    assert Vector(*arm.scene_store.mesh(beam).centroid()).length > 0.1
+
+
+def test_pruning_checks_every_link_of_the_group(rfl_robot, robot_plan):
+    rfl_robot.client = FakePlannerClient()
+    pruned = TimberAssemblyPlanner(rfl_robot, robot_plan["assembly"], robot_plan["building_plan"], PICKUP_BASE_FRAME, group="robot11_eaXYZ", prune_scene=True)
+    pruned.verify_pruning = True
+    pruned.plan_robot_assembly()
+    assert pruned.pruning_stats["requests"] > 0 and pruned.pruning_stats["missed"] == 0
+    full = planner(rfl_robot, robot_plan, FakePlannerClient())
+    full.plan_robot_assembly()
+    assert joint_values(pruned.robot_steps) == joint_values(full.robot_steps)
+
+    """a box around the tool path alone misses the arm and the gantry column above the tool"""
+    trajectory = pruned.robot_steps[0]["pickup"][0]
+    _, frames = pruned.get_tool_frames([trajectory])
+    pruned.trajectories = []
+    assert not pruned.stays_inside(trajectory, aabb_inflate(aabb_from_points([frame.point for frame in frames]), pruned.prune_margin))
+    assert pruned.stays_inside(trajectory, pruned.swept_volume(frames[-1]))
+
+
+def test_pruning_does_not_scan_the_scene_by_default(rfl_robot, robot_plan, monkeypatch):
+    rfl_robot.client = FakePlannerClient()
+    pruned = TimberAssemblyPlanner(rfl_robot, robot_plan["assembly"], robot_plan["building_plan"], PICKUP_BASE_FRAME, group="robot11_eaXYZ", prune_scene=True)
+    scans = []
+    monkeypatch.setattr(AABBTree, "brute_force_query", lambda tree, box: scans.append(box) or [])
+    pruned.plan_robot_assembly()
+    assert pruned.pruning_stats["requests"] > 0 and scans == []
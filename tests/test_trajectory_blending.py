@@ -0,0 +1,128 @@
+import numpy as np
+from compas_fab.robots import Duration
+from compas_fab.robots import JointTrajectory
+from compas_fab.robots import JointTrajectoryPoint
+
+from batch_kinematics import BatchKinematics
+from test_multi_robot_planner import executioner as schedule_executioner
+from test_multi_robot_planner import multi_planner
+from test_timber_assembly_executioner import Comms
+from timber_assembly_executioner import TimberAssemblyExecutioner
+from trajectory_blending import TrajectoryBlender
+from trajectory_blending import time_parameterize
+
+GROUP = "robot11"
+
+
+class Assembly(object):
+    def __init__(self, length):
+        self.beams = {0: type("Beam", (object,), {"length": length})()}
+
+
+class Planner(object):
+    """Stands in for a planner of one step whose phases are made of rest-to-rest segments."""
+
+    def __init__(self, robot_step):
+        self.robot_steps = {0: robot_step}
+
+    def get_configurations(self, trajectories):
+        return [point.joint_values for trajectory in trajectories for point in trajectory.points]
+
+
+def segment(robot, start, end, duration = 2.0, count = 21):
+    """A motion from `start` to `end` at rest at both, with a cosine speed profile."""
+    names = robot.get_configurable_joint_names(GROUP)
+    types = robot.get_joint_types_by_names(names)
+    points = []
+    for t in np.linspace(0.0, duration, count):
+        s = (1 - np.cos(np.pi * t / duration)) / 2
+        points.append(JointTrajectoryPoint((start + s * (end - start)).tolist(), types, time_from_start=Duration(int(t), int(round((t - int(t)) * 1e9))), joint_names=names))
+    return JointTrajectory(points, names, None, fraction=1.0)
+
+
+def corners(robot):
+    """Three segments of a path turning twice."""
+    a = np.zeros(len(robot.get_configurable_joint_names(GROUP)))
+    b, c, d = a.copy(), a.copy(), a.copy()
+    b[0] = c[0] = 0.3
+    c[1] = d[1] = 0.3
+    d[0] = 0.6
+    return [segment(robot, a, b), segment(robot, b, c), segment(robot, c, d)]
+
+
+def blender(robot, **kwargs):
+    return TrajectoryBlender(BatchKinematics(robot, robot.zero_configuration()), GROUP, max_tool_deviation=0.05, **kwargs)
+
+
+def test_time_parameterize_respects_limits():
+    path = np.array([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0]])
+    velocity, acceleration = np.array([1.0, 2.0]), np.array([2.0, 4.0])
+    result = time_parameterize(path, velocity, acceleration, 0.05)
+    times, positions, velocities = result["times"], result["positions"], result["velocities"]
+    assert np.all(np.diff(times) > 0)
+    assert np.allclose(positions[[0, -1]], path[[0, -1]]) and np.allclose(velocities[[0, -1]], 0.0)
+    assert np.all(np.abs(velocities) <= velocity + 1e-9)
+    assert np.all(np.abs(np.diff(velocities, axis=0)) <= acceleration * np.diff(times)[:, np.newaxis] + 1e-9)
+    assert result["blend_times"][1] > 0
+    assert np.abs(result["apexes"][1] - path[1]).max() <= 0.05 + 1e-9
+
+
+def test_blend_is_faster_and_timed(rfl_robot):
+    trajectory, report = blender(rfl_robot).blend(corners(rfl_robot))
+    assert report["blended_duration"] < report["original_duration"] == 6.0
+    assert report["corners"] == 2 and report["stops"] == 0
+    times = [point.time_from_start.seconds for point in trajectory.points]
+    assert np.all(np.diff(times) > 0) and np.isclose(times[-1], report["blended_duration"])
+    assert any(np.abs(point.velocities).max() > 0 for point in trajectory.points[1:-1])
+    assert np.allclose(trajectory.points[-1].joint_values, corners(rfl_robot)[-1].points[-1].joint_values)
+
+
+def test_step_keeps_planned_trajectories_when_blend_is_slower(rfl_robot):
+    step = {phase: corners(rfl_robot) for phase in TrajectoryBlender.PHASES}
+    faster = blender(rfl_robot)
+    blended = faster.blend_step(0, step)
+    assert all(len(blended[phase]) == 1 for phase in TrajectoryBlender.PHASES)
+    assert all(report["blended"] for report in faster.reports[0]["phases"].values())
+
+    slower = blender(rfl_robot, velocity_limits=[0.01] * 6, acceleration_limits=[0.01] * 6)
+    assert slower.blend_step(0, step) == step
+    report = slower.reports[0]
+    assert not any(phase["blended"] for phase in report["phases"].values())
+    assert report["blended_duration"] == report["original_duration"] == 18.0
+
+
+def test_robot_runs_the_blended_trajectories(rfl_robot):
+    step = {phase: corners(rfl_robot) for phase in TrajectoryBlender.PHASES}
+    runner = TimberAssemblyExecutioner(building_plan=type("Plan", (object,), {"steps": [{"actor": "ROBOT", "is_built": False, "element_ids": [0]}]})(),
+                                       assembly=Assembly(0.5), comms=Comms({0}), planner=Planner(step))
+    runner.settle_time = 0.0
+    runner.blender = blender(rfl_robot)
+    executed = []
+    runner.execute_trajectory = lambda trajectory, step_index = None: executed.append(trajectory) or True
+    assert runner.execute_step(0) is True
+    assert len(executed) == 3
+    for trajectories, (_, configurations) in zip(executed, runner.comms.published):
+        assert len(trajectories) == 1 and isinstance(trajectories[0], JointTrajectory)
+        assert trajectories[0].points[-1].time_from_start.seconds < 6.0
+        assert configurations == [point.joint_values for point in trajectories[0].points]
+
+    executed[:] = []
+    assert runner.execute_confirmed_step(0, runner.blend_step(0, step)) is True
+    assert all(len(trajectories) == 1 and isinstance(trajectories[0], JointTrajectory) for trajectories in executed)
+
+
+def test_schedule_runs_blended_steps(rfl_robot, robot_plan):
+    planner = multi_planner(rfl_robot, robot_plan)
+    planner.plan()
+    runner = schedule_executioner(robot_plan)
+    """the schedule is blended per arm, with the kinematics of each arm and the tolerances of this blender"""
+    runner.blender = TrajectoryBlender(None, None)
+    executed = []
+    runner.execute_trajectory = lambda trajectory, step_index = None: executed.append((step_index, trajectory)) or True
+    result = runner.execute_schedule(planner)
+    assert sorted(result["built"]) == list(range(6)) and result["failures"] == []
+    assert sorted(planner.blended_steps) == list(range(6))
+    assert sorted(motion.step for motion in planner.schedule if motion.phase == "pickup" and motion.index == 0) == list(range(6))
+    for step, trajectories in executed:
+        assert len(trajectories) == 1 and isinstance(trajectories[0], JointTrajectory)
+        assert any(trajectories[0] is trajectory for phase in TrajectoryBlender.PHASES for trajectory in planner.step_trajectories(step)[phase])
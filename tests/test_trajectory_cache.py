@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+from compas.geometry import Frame
+from compas_fab.robots import Duration
+from compas_fab.robots import JointTrajectory
+from compas_fab.robots import JointTrajectoryPoint
+
+from trajectory_cache import TrajectoryCache
+from trajectory_cache import digest
+
+
+def trajectory(offset = 0.0, points = 5):
+    return JointTrajectory([JointTrajectoryPoint([offset + i, 0.0], [0, 0], time_from_start=Duration(i, 0), joint_names=["a", "b"]) for i in range(points)], ["a", "b"])
+
+
+def test_digest_is_stable_across_equal_compas_objects():
+    """compas 2 objects carry a random guid, which must not change the digest"""
+    assert digest(Frame([1, 2, 3], [1, 0, 0], [0, 1, 0])) == digest(Frame([1, 2, 3], [1, 0, 0], [0, 1, 0]))
+    assert digest(Frame([1, 2, 3], [1, 0, 0], [0, 1, 0])) != digest(Frame([1, 2, 4], [1, 0, 0], [0, 1, 0]))
+    assert digest({"values": np.arange(3.0)}) == digest({"values": [0.0, 1.0, 2.0]})
+
+
+def test_digest_ignores_float_noise_below_precision():
+    assert digest([0.1 + 0.2]) == digest([0.3])
+
+
+def test_put_get_round_trip_and_persistence(tmp_path):
+    cache = TrajectoryCache(str(tmp_path))
+    key = TrajectoryCache.key(target=Frame.worldXY(), linear=True)
+    assert cache.get(key) is None
+    cache.put(key, {"pickup": [trajectory()]}, step=3)
+    value = cache.get(key)
+    assert [p.joint_values for p in value["pickup"][0].points] == [p.joint_values for p in trajectory().points]
+    assert (cache.hits, cache.misses, cache.stores) == (1, 1, 1)
+
+    reopened = TrajectoryCache(str(tmp_path))
+    assert reopened.get(key) is not None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = TrajectoryCache(str(tmp_path), max_entries=2)
+    cache.put("a", trajectory(0))
+    cache.put("b", trajectory(1))
+    cache.get("a")
+    cache.put("c", trajectory(2))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.evictions == 1
+    assert len([name for name in os.listdir(str(tmp_path)) if name.endswith(".json")]) == 2
+
+
+def test_changed_step_invalidates_downstream_entries_not_used_this_session(tmp_path):
+    cache = TrajectoryCache(str(tmp_path))
+    cache.put("upstream", trajectory(0), step=0)
+    cache.put("downstream", trajectory(1), step=1)
+    cache.put("reused", trajectory(2), step=2)
+    assert cache.record_step(0, trajectory(0)) is True
+    assert cache.record_step(0, trajectory(0)) is False
+
+    cache.begin_session()
+    cache.get("reused")
+    assert cache.record_step(0, trajectory(5)) is True
+    assert cache.invalidate_after(0) == 1
+    assert cache.get("downstream") is None
+    assert cache.get("reused") is not None
+    assert cache.get("upstream") is not None
+
+
+def test_unreadable_entry_counts_as_miss(tmp_path):
+    cache = TrajectoryCache(str(tmp_path))
+    cache.put("key", trajectory(), step=0)
+    with open(os.path.join(str(tmp_path), "key.0.json"), "w") as f:
+        f.write("not json")
+    assert cache.get("key") is None
+    assert cache.get("key") is None
+
+
+def test_unrelated_files_are_ignored(tmp_path):
+    (tmp_path / "notes.backup.json").write_text("{}")
+    cache = TrajectoryCache(str(tmp_path))
+    assert len(cache._entries) == 0